@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+asyncio bridge benchmark
+
+Runs the timer and fd dispatch benchmarks from evloop.py on a Thor loop
+that runs on asyncio (compare them to loop_timers_fired and
+loop_fd_dispatch, on the native loop), and reports how many callbacks
+asyncio's own loop and a ThorEventLoop can run per second.
+
+Needs asyncio or trollius; if neither is installed, there are no results.
+
+Usage: aio.py [seconds]
+"""
+
+import sys
+
+import thor.loop
+from thor.aio import asyncio, AsyncioLoop, ThorEventLoop
+
+import evloop
+from benchlib import rate, report, result
+
+
+def asyncio_loop(precision=None):
+    "Make a Thor loop on a new asyncio loop."
+    return AsyncioLoop(precision, asyncio.new_event_loop())
+
+
+def call_soon(duration, make_loop, batch=10000):
+    "Run batches of callbacks, each of which schedules the next."
+    loop = make_loop()
+    def go():
+        counts = {'called': 0}
+        def call():
+            counts['called'] += 1
+            if counts['called'] < batch:
+                loop.call_soon(call)
+            else:
+                loop.stop()
+        loop.call_soon(call)
+        loop.run_forever()
+        return batch
+    return rate(go, duration)
+
+
+def benchmarks(duration):
+    "Return results for the benchmark suite."
+    if asyncio is None:
+        sys.stderr.write("asyncio isn't available; skipping.\n")
+        return {}
+    return {
+        'aio_timers_fired': result(
+            evloop.timers_fired(duration, make=asyncio_loop), "timers/sec"),
+        'aio_fd_dispatch': result(
+            evloop.fd_dispatch(duration, make=asyncio_loop), "events/sec"),
+        'aio_call_soon_asyncio': result(
+            call_soon(duration, asyncio.new_event_loop), "calls/sec"),
+        'aio_call_soon_thor': result(
+            call_soon(duration, lambda: ThorEventLoop(thor.loop.make())),
+            "calls/sec"),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report(benchmarks(float(args and args.pop(0) or 2)))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Benchmark helpers
+
+Shared by the benchmarks in this directory: timing loops, an HTTP load
+generator, and reading, writing and comparing results.
+
+Results are dictionaries mapping a benchmark's name to a dictionary with
+its 'value', 'unit', and whether 'higher' or 'lower' values are better.
+"""
+
+import json
+import platform
+import sys
+import time as systime
+
+import thor
+from thor.events import on
+from thor.http import HttpClient
+
+test_host = "127.0.0.1"
+
+
+def result(value, unit, better='higher'):
+    "Make a result."
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def rate(func, duration):
+    """
+    Call func (which does some work and returns how many operations it
+    did) repeatedly for duration seconds, and return operations per second.
+    """
+    ops = 0
+    start = systime.time()
+    deadline = start + duration
+    while True:
+        ops += func()
+        now = systime.time()
+        if now >= deadline:
+            return ops / (now - start)
+
+
+def percentile(values, pct):
+    "Return the pct percentile of the (sorted) values."
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def load(port, duration, concurrency, idle_timeout=60, path="/"):
+    """
+    Keep concurrency requests outstanding to port for duration seconds,
+    using an HttpClient. Returns (requests, bytes, latencies, errors).
+    """
+    loop = thor.loop.make(0.1)
+    client = HttpClient(loop)
+    client.idle_timeout = idle_timeout
+    client.max_idle_per_origin = concurrency
+    uri = "http://%s:%s%s" % (test_host, port, path)
+    stats = {'requests': 0, 'bytes': 0, 'errors': 0, 'outstanding': 0}
+    latencies = []
+    deadline = systime.time() + duration
+
+    def go():
+        if systime.time() >= deadline:
+            if stats['outstanding'] == 0:
+                loop.stop()
+            return
+        stats['outstanding'] += 1
+        x = client.exchange()
+        start = systime.time()
+        @on(x)
+        def response_body(chunk):
+            stats['bytes'] += len(chunk)
+        @on(x)
+        def response_done(trailers):
+            stats['outstanding'] -= 1
+            stats['requests'] += 1
+            latencies.append(systime.time() - start)
+            go()
+        @on(x)
+        def error(err):
+            stats['outstanding'] -= 1
+            stats['errors'] += 1
+            go()
+        x.request_start("GET", uri, [])
+        x.request_done([])
+
+    for i in range(concurrency):
+        go()
+    loop.schedule(duration + 5, loop.stop)
+    loop.run()
+    return stats['requests'], stats['bytes'], latencies, stats['errors']
+
+
+def report(results, out=sys.stdout):
+    "Print results."
+    for name in sorted(results):
+        res = results[name]
+        out.write("%-32s %14.1f %s\n" % (name, res['value'], res['unit']))
+
+
+def save(results, path):
+    "Write results to path as JSON, along with where they came from."
+    doc = {
+        'time': systime.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'thor': thor.__version__,
+        'results': results,
+    }
+    fh = open(path, 'w')
+    try:
+        json.dump(doc, fh, indent=2, sort_keys=True)
+    finally:
+        fh.close()
+
+
+def load_results(path):
+    "Read results written by save()."
+    fh = open(path)
+    try:
+        return json.load(fh)['results']
+    finally:
+        fh.close()
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compare results to baseline. Returns a list of (name, baseline value,
+    value, change, regressed) for the benchmarks in both, where change is
+    the fractional difference, and regressed is True if it's more than
+    tolerance worse.
+    """
+    out = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = results[name]['value']
+        if not old:
+            continue
+        change = (new - old) / float(old)
+        if results[name].get('better', 'higher') == 'higher':
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+        out.append((name, old, new, change, regressed))
+    return out
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+Event loop benchmark
+
+Reports how many timers can be scheduled and cancelled, and fired, per
+second, and how many fd events the loop can dispatch per second (using
+sockets that are always writable, so that the loop never waits).
+
+Usage: evloop.py [seconds]
+"""
+
+import socket
+import sys
+import time as systime
+
+import thor.loop
+from thor.loop import EventSource
+
+from benchlib import rate, report, result
+
+
+def timers_cancelled(duration, batch=1000):
+    "Schedule and then cancel batches of timers."
+    loop = thor.loop.make()
+    def noop():
+        pass
+    def go():
+        events = [loop.schedule(60, noop) for i in xrange(batch)]
+        for event in events:
+            event.delete()
+        return batch
+    return rate(go, duration)
+
+
+def timers_fired(duration, batch=10000, make=thor.loop.make):
+    "Fire batches of timers that are all due at once."
+    loop = make(0.001)
+    def go():
+        counts = {'fired': 0}
+        def fire():
+            counts['fired'] += 1
+            if counts['fired'] == batch:
+                loop.stop()
+        for i in xrange(batch):
+            loop.schedule(0.001, fire)
+        loop.run()
+        return batch
+    return rate(go, duration)
+
+
+def fd_dispatch(duration, fds=100, make=thor.loop.make):
+    "Dispatch 'writable' events for fds sockets."
+    loop = make(0.1)
+    counts = {'events': 0}
+    socks = []
+    def writable():
+        counts['events'] += 1
+    for i in xrange(fds):
+        a, b = socket.socketpair()
+        socks.extend([a, b])
+        source = EventSource(loop)
+        source.register_fd(a.fileno(), 'writable')
+        source.on('writable', writable)
+    loop.schedule(duration, loop.stop)
+    start = systime.time()
+    loop.run()
+    elapsed = systime.time() - start
+    for sock in socks:
+        sock.close()
+    return counts['events'] / elapsed
+
+
+def benchmarks(duration):
+    "Return results for the benchmark suite."
+    return {
+        'loop_timers_cancelled': result(
+            timers_cancelled(duration), "timers/sec"),
+        'loop_timers_fired': result(timers_fired(duration), "timers/sec"),
+        'loop_fd_dispatch': result(fd_dispatch(duration), "events/sec"),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report(benchmarks(float(args and args.pop(0) or 2)))
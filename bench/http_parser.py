@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+HTTP parser benchmark
+
+Feeds messages to an HttpMessageHandler that does nothing with them, and
+reports how many messages per second it parses: simple requests,
+pipelined requests, chunked responses and requests with large headers.
+
+Usage: http_parser.py [seconds]
+"""
+
+import sys
+
+from thor.http.common import HttpMessageHandler
+
+from benchlib import rate, report, result
+
+
+class NullParser(HttpMessageHandler):
+    "Parses messages and throws them away."
+
+    def __init__(self):
+        HttpMessageHandler.__init__(self)
+        self.messages = 0
+
+    def input_start(self, top_line, hdr_tuples, conn_tokens,
+        transfer_codes, content_length):
+        return bool(content_length or transfer_codes)
+
+    def input_body(self, chunk):
+        pass
+
+    def input_end(self, trailers):
+        self.messages += 1
+
+    def input_error(self, err):
+        raise AssertionError(err)
+
+
+simple = "GET /index.html HTTP/1.1\r\nHost: www.example.com\r\n" \
+         "User-Agent: bench\r\nAccept: */*\r\n\r\n"
+pipelined = simple * 10
+chunked = "HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n" \
+          "Transfer-Encoding: chunked\r\n\r\n" + \
+          "%x\r\n%s\r\n" % (100, "x" * 100) * 10 + "0\r\n\r\n"
+large_headers = "GET /index.html HTTP/1.1\r\nHost: www.example.com\r\n" + \
+    "".join(["X-Header-%s: %s\r\n" % (i, "v" * 100) for i in range(50)]) + \
+    "\r\n"
+messages = [
+    ('simple', simple, 1),
+    ('pipelined', pipelined, 10),
+    ('chunked', chunked, 1),
+    ('large_headers', large_headers, 1),
+]
+
+
+def parse_rate(data, count, duration, batch=1000):
+    "Return messages per second parsed from data (holding count messages)."
+    parser = NullParser()
+    def go():
+        for i in xrange(batch):
+            parser.handle_input(data)
+        return batch * count
+    ops = rate(go, duration)
+    assert parser.messages > 0
+    return ops
+
+
+def benchmarks(duration):
+    "Return results for the benchmark suite."
+    results = {}
+    for name, data, count in messages:
+        results['http_parse_%s' % name] = result(
+            parse_rate(data, count, duration), "msgs/sec")
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report(benchmarks(float(args and args.pop(0) or 2)))
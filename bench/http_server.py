@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+HTTP server and client benchmark
+
+Runs a Thor HttpServer in its own process and drives it with an HttpClient,
+reporting requests per second with a number of concurrent keep-alive
+requests, with one request at a time (so that each request reuses the
+connection pool's idle connection), and with a new connection for every
+request.
+
+Usage: http_server.py [seconds] [concurrency] [body size]
+"""
+
+import multiprocessing
+import sys
+import time as systime
+
+import thor
+from thor.events import on
+from thor.http import HttpServer
+
+from benchlib import test_host, load, percentile, report, result
+
+test_port = 8112
+
+
+def run_server(size):
+    "Serve a body of size bytes to every request."
+    body = "x" * size
+    loop = thor.loop.make()
+    server = HttpServer(test_host, test_port, loop)
+    @on(server)
+    def exchange(x):
+        @on(x)
+        def request_done(trailers):
+            x.response_start(200, "OK", [
+                ('Content-Type', 'text/plain'),
+                ('Content-Length', str(size))
+            ])
+            x.response_body(body)
+            x.response_done([])
+    loop.run()
+
+
+def benchmarks(duration, concurrency=10, size=1024):
+    "Return results for the benchmark suite."
+    proc = multiprocessing.Process(target=run_server, args=(size,))
+    proc.daemon = True
+    proc.start()
+    systime.sleep(0.5)
+    results = {}
+    try:
+        requests, nbytes, latencies, errors = \
+            load(test_port, duration, concurrency)
+        latencies.sort()
+        results['http_server_requests'] = result(
+            requests / duration, "req/sec")
+        results['http_server_p99_latency'] = result(
+            percentile(latencies, 99) * 1000, "ms", 'lower')
+        requests = load(test_port, duration, 1)[0]
+        results['http_client_pooled'] = result(
+            requests / duration, "req/sec")
+        requests = load(test_port, duration, 1, idle_timeout=0)[0]
+        results['http_client_unpooled'] = result(
+            requests / duration, "req/sec")
+    finally:
+        proc.terminate()
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    duration = float(args and args.pop(0) or 2)
+    concurrency = int(args and args.pop(0) or 10)
+    size = int(args and args.pop(0) or 1024)
+    report(benchmarks(duration, concurrency, size))
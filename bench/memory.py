@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Memory benchmark
+
+Reports roughly how many bytes each server connection (its TcpConnection,
+HttpServerConnection and one HttpServerExchange) and each client exchange
+uses: the objects themselves, plus the dictionaries, lists and bound
+methods that belong to them (listener storage, buffers and so on).
+
+Usage: memory.py [connections]
+"""
+
+from collections import deque
+import gc
+import socket
+import sys
+import types
+
+import thor.loop
+from thor.http import HttpClient, HttpServer
+from thor.http.client import HttpClientExchange
+
+from benchlib import test_host, report, result
+
+test_port = 8113
+
+_containers = (dict, list, set, deque, tuple)
+
+
+def footprint(obj):
+    """
+    Return the bytes used by obj and the containers and bound methods
+    that only it refers to (not the other objects they refer to).
+    """
+    seen = set([id(obj)])
+    size = sys.getsizeof(obj)
+    todo = gc.get_referents(obj)
+    while todo:
+        ref = todo.pop()
+        if id(ref) in seen:
+            continue
+        if isinstance(ref, _containers):
+            todo.extend(gc.get_referents(ref))
+        elif not (isinstance(ref, types.MethodType) and ref.im_self is obj):
+            continue
+        seen.add(id(ref))
+        size += sys.getsizeof(ref)
+    return size
+
+
+def server_conns(count):
+    "Return the mean bytes used by a server connection with one exchange."
+    loop = thor.loop.make()
+    server = HttpServer(test_host, test_port, loop=loop)
+    exchanges = []
+    server.on('exchange', exchanges.append)
+    socks = []
+    total = 0
+    for i in xrange(count):
+        a, b = socket.socketpair()
+        socks.extend([a, b])
+        tcp_conn = thor.tcp.TcpConnection(a, test_host, 0, loop=loop)
+        server.handle_conn(tcp_conn)
+        http_conn = tcp_conn.protocol
+        http_conn.handle_input("GET / HTTP/1.1\r\nHost: %s\r\n\r\n" % test_host)
+        total += footprint(tcp_conn) + footprint(http_conn) + \
+                 footprint(exchanges[-1])
+    server.shutdown()
+    for sock in socks:
+        sock.close()
+    return total / float(count)
+
+
+def client_exchanges(count):
+    "Return the mean bytes used by a client exchange."
+    client = HttpClient(thor.loop.make())
+    total = 0
+    for i in xrange(count):
+        exchange = HttpClientExchange(client)
+        exchange.on('response_start', lambda *args: None)
+        exchange.on('response_body', lambda *args: None)
+        exchange.on('response_done', lambda *args: None)
+        total += footprint(exchange)
+    return total / float(count)
+
+
+def benchmarks(duration, count=100):
+    "Return results for the benchmark suite."
+    return {
+        'memory_server_conn': result(
+            server_conns(count), "bytes", better='lower'),
+        'memory_client_exchange': result(
+            client_exchanges(count), "bytes", better='lower'),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report(benchmarks(0, int(args and args.pop(0) or 100)))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+HTTP proxy benchmark
+
+Runs a Thor origin server and an HttpProxy in front of it (each in its
+own process), then drives them from an HttpClient with a fixed number of
+concurrent keep-alive requests, reporting requests per second, body
+throughput and latency percentiles, both directly against the origin and
+through the proxy.
+
+Usage: proxy.py [seconds] [concurrency] [body size]
+"""
+
+import multiprocessing
+import sys
+import time as systime
+
+import thor
+from thor.events import on
+from thor.http import HttpServer, HttpProxy
+
+from benchlib import test_host, load, percentile, result
+
+origin_port = 8101
+proxy_port = 8102
+
+
+def run_origin(size):
+    "Serve a body of size bytes to every request."
+    body = "x" * size
+    loop = thor.loop.make()
+    server = HttpServer(test_host, origin_port, loop)
+    @on(server)
+    def exchange(x):
+        @on(x)
+        def request_done(trailers):
+            x.response_start(200, "OK", [
+                ('Content-Type', 'text/plain'),
+                ('Content-Length', str(size))
+            ])
+            x.response_body(body)
+            x.response_done([])
+    loop.run()
+
+
+def run_proxy():
+    "Relay everything to the origin."
+    loop = thor.loop.make()
+    server = HttpServer(test_host, proxy_port, loop)
+    HttpProxy(server, "http://%s:%s" % (test_host, origin_port))
+    loop.run()
+
+
+def report(name, duration, requests, nbytes, latencies, errors):
+    latencies.sort()
+    print "%-7s %8.0f req/sec %8.2f MB/sec  " \
+          "p50 %6.2fms  p90 %6.2fms  p99 %6.2fms  (%s errors)" % (
+        name,
+        requests / duration,
+        nbytes / duration / (1024 * 1024),
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 90) * 1000,
+        percentile(latencies, 99) * 1000,
+        errors
+    )
+
+
+def start_servers(size):
+    "Start the origin and proxy processes; returns them."
+    procs = [
+        multiprocessing.Process(target=run_origin, args=(size,)),
+        multiprocessing.Process(target=run_proxy)
+    ]
+    for proc in procs:
+        proc.daemon = True
+        proc.start()
+    systime.sleep(0.5)
+    return procs
+
+
+def benchmarks(duration, concurrency=10, size=1024):
+    "Return results for the benchmark suite."
+    procs = start_servers(size)
+    results = {}
+    try:
+        requests, nbytes, latencies, errors = \
+            load(proxy_port, duration, concurrency)
+    finally:
+        for proc in procs:
+            proc.terminate()
+    latencies.sort()
+    results['proxy_requests'] = result(requests / duration, "req/sec")
+    results['proxy_p99_latency'] = result(
+        percentile(latencies, 99) * 1000, "ms", 'lower')
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    duration = float(args and args.pop(0) or 5)
+    concurrency = int(args and args.pop(0) or 10)
+    size = int(args and args.pop(0) or 1024)
+    procs = start_servers(size)
+    try:
+        for name, port in [('direct', origin_port), ('proxy', proxy_port)]:
+            report(name, duration, *load(port, duration, concurrency))
+    finally:
+        for proc in procs:
+            proc.terminate()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Run the benchmark suite
+
+Runs the benchmarks in this directory (or just the named suites), prints
+the results, and optionally writes them to a JSON file and compares them
+to a baseline written earlier; the exit status is 1 if anything is worse
+than the baseline by more than the tolerance.
+
+Usage: run.py [options] [suite ...]
+"""
+
+from optparse import OptionParser
+import sys
+
+import benchlib
+
+suites = ['evloop', 'tcp', 'http_parser', 'http_server', 'proxy', 'udp',
+          'memory', 'aio']
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options] [suite ...]",
+        description="Suites: %s" % ", ".join(suites))
+    parser.add_option("-d", "--duration", type="float", default=2,
+        help="seconds to run each benchmark for (default 2)")
+    parser.add_option("-o", "--output", metavar="FILE",
+        help="write the results to FILE as JSON")
+    parser.add_option("-b", "--baseline", metavar="FILE",
+        help="compare the results to those in FILE")
+    parser.add_option("-t", "--tolerance", type="float", default=0.1,
+        help="how much worse than the baseline is a regression "
+             "(default 0.1, i.e. 10%)")
+    options, names = parser.parse_args(argv)
+    for name in names:
+        if name not in suites:
+            parser.error("unknown suite %s" % name)
+    results = {}
+    for name in names or suites:
+        sys.stderr.write("running %s...\n" % name)
+        suite = __import__(name)
+        results.update(suite.benchmarks(options.duration))
+    benchlib.report(results)
+    if options.output:
+        benchlib.save(results, options.output)
+    if options.baseline:
+        baseline = benchlib.load_results(options.baseline)
+        regressions = 0
+        print
+        print "Compared to %s:" % options.baseline
+        for name, old, new, change, regressed in \
+          benchlib.compare(results, baseline, options.tolerance):
+            print "%-32s %14.1f -> %14.1f %+7.1f%%%s" % (
+                name, old, new, change * 100,
+                regressed and "  REGRESSION" or ""
+            )
+            regressions += regressed
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
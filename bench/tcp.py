@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+TCP echo benchmark
+
+Runs a TcpServer that echoes everything it receives and a TcpClient that
+keeps a window of data in flight to it (both on one loop, over loopback),
+and reports how many bytes per second make the round trip.
+
+Usage: tcp.py [seconds] [chunk size]
+"""
+
+import sys
+import time as systime
+
+import thor.loop
+from thor.tcp import TcpClient, TcpServer
+
+from benchlib import test_host, report, result
+
+test_port = 8111
+
+
+def echo(duration, size=64 * 1024, window=16):
+    "Return bytes per second echoed, writing chunks of size bytes."
+    loop = thor.loop.make(0.1)
+    server = TcpServer(test_host, test_port, loop=loop)
+    def server_conn(conn):
+        conn.on('data', conn.write)
+        conn.pause(False)
+    server.on('connect', server_conn)
+    chunk = "x" * size
+    counts = {'received': 0, 'sent': 0}
+    times = {}
+    def client_conn(conn):
+        def top_up():
+            while counts['sent'] - counts['received'] < size * window:
+                conn.write(chunk)
+                counts['sent'] += size
+        def data(data):
+            counts['received'] += len(data)
+            top_up()
+        conn.on('data', data)
+        conn.pause(False)
+        times['start'] = systime.time()
+        top_up()
+        loop.schedule(duration, loop.stop)
+    client = TcpClient(loop)
+    client.on('connect', client_conn)
+    client.connect(test_host, test_port)
+    loop.run()
+    elapsed = systime.time() - times['start']
+    server.shutdown()
+    return counts['received'] / elapsed
+
+
+def benchmarks(duration):
+    "Return results for the benchmark suite."
+    return {
+        'tcp_echo': result(echo(duration) / (1024 * 1024), "MB/sec"),
+        'tcp_echo_small': result(
+            echo(duration, 512) / (1024 * 1024), "MB/sec"),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    duration = float(args and args.pop(0) or 2)
+    if args:
+        size = int(args.pop(0))
+        print "%.1f MB/sec" % (echo(duration, size) / (1024 * 1024))
+    else:
+        report(benchmarks(duration))
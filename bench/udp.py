@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+UDP receive benchmark
+
+Blasts datagrams at a UdpEndpoint from a loopback sender in another
+process, and reports how many packets per second the endpoint delivers,
+both one 'datagram' event at a time and in 'datagrams' batches, along
+with how many it handles per second of its own CPU time. When the sender
+and receiver share a CPU, the delivered rate mostly shows how the two
+are scheduled; the CPU rate is what the receive path costs.
+
+Usage: udp.py [seconds] [datagram size]
+"""
+
+import multiprocessing
+import os
+import socket
+import sys
+import time as systime
+
+import thor.loop
+from thor.udp import UdpEndpoint
+
+from benchlib import test_host, result
+
+test_port = 9102
+
+
+def sender(host, port, size, duration):
+    "Send datagrams of size bytes to host:port for duration seconds."
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram = "x" * size
+    deadline = systime.time() + duration
+    while systime.time() < deadline:
+        for i in xrange(100):
+            try:
+                sock.sendto(datagram, (host, port))
+            except socket.error:
+                pass # receiver is behind; keep going.
+    sock.close()
+
+
+def run(mode, duration, size):
+    """
+    Receive for duration seconds in mode; return packets per second,
+    wakeups and packets per CPU second.
+    """
+    loop = thor.loop.make(0.1)
+    ep = UdpEndpoint(loop)
+    ep.bind(test_host, test_port)
+    ep.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    counts = {'packets': 0, 'wakeups': 0}
+    if mode == 'datagrams':
+        def handle(batch):
+            counts['wakeups'] += 1
+            counts['packets'] += len(batch)
+        ep.on('datagrams', handle)
+    else:
+        def handle(data, host, port):
+            counts['packets'] += 1
+        ep.on('datagram', handle)
+    proc = multiprocessing.Process(
+        target=sender, args=(test_host, test_port, size, duration)
+    )
+    ep.pause(False)
+    proc.start()
+    start = systime.time()
+    start_cpu = sum(os.times()[:2])
+    loop.schedule(duration, loop.stop)
+    loop.run()
+    elapsed = systime.time() - start
+    cpu = sum(os.times()[:2]) - start_cpu
+    proc.join()
+    ep.shutdown()
+    return counts['packets'] / elapsed, counts['wakeups'], \
+        counts['packets'] / max(cpu, 0.01)
+
+
+def benchmarks(duration, size=64):
+    "Return results for the benchmark suite."
+    results = {}
+    for mode in ['datagram', 'datagrams']:
+        pps, wakeups, cpu_pps = run(mode, duration, size)
+        results['udp_%s' % mode] = result(pps, "packets/sec")
+        results['udp_%s_cpu' % mode] = result(cpu_pps, "packets/cpu-sec")
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    duration = float(args and args.pop(0) or 5)
+    size = int(args and args.pop(0) or 64)
+    for mode in ['datagram', 'datagrams']:
+        pps, wakeups, cpu_pps = run(mode, duration, size)
+        print "%-10s %10.0f packets/sec %10.0f packets/cpu-sec" % (
+            mode, pps, cpu_pps),
+        if wakeups:
+            print "(%.1f per wakeup)" % (pps * duration / wakeups)
+        else:
+            print
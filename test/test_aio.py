@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import socket
+import unittest
+
+import framework
+
+import thor
+from thor.aio import asyncio, AsyncioLoop, ThorEventLoop
+
+needs_asyncio = unittest.skipIf(asyncio is None, "needs asyncio or trollius")
+
+
+@needs_asyncio
+class TestAsyncioLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.aio_loop = asyncio.new_event_loop()
+        self.loop = AsyncioLoop(aio_loop=self.aio_loop)
+
+    def tearDown(self):
+        self.aio_loop.close()
+
+    def test_schedule(self):
+        calls = []
+        self.loop.schedule(0.02, calls.append, 2)
+        self.loop.schedule(0.01, calls.append, 1)
+        self.loop.schedule(0.015, calls.append, 3).delete()
+        self.loop.schedule(0.05, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(calls, [1, 2])
+        self.assertFalse(self.loop.running)
+
+    def test_stop_leaves_aio_loop(self):
+        calls = []
+        def go():
+            self.loop.run() # aio_loop is already running
+            self.loop.schedule(0.01, calls.append, 1)
+            self.loop.stop()
+        self.aio_loop.call_soon(go)
+        self.aio_loop.call_later(0.05, calls.append, 2)
+        self.aio_loop.call_later(0.06, self.aio_loop.stop)
+        self.aio_loop.run_forever()
+        self.assertEqual(calls, [2])
+        self.assertFalse(self.loop.running)
+
+    def test_tcp(self):
+        a, b = socket.socketpair()
+        conn = thor.tcp.TcpConnection(a, "localhost", 0, loop=self.loop)
+        received = []
+        def data(chunk):
+            received.append(chunk)
+            conn.write(chunk.upper())
+            self.loop.stop()
+        conn.on('data', data)
+        conn.pause(False)
+        b.send("hello")
+        self.loop.schedule(2, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(received, ["hello"])
+        conn.handle_write()
+        self.assertEqual(b.recv(5), "HELLO")
+        a.close()
+        b.close()
+
+
+@needs_asyncio
+class TestThorEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.thor_loop = thor.loop.make(precision=.01)
+        self.loop = ThorEventLoop(self.thor_loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_call_soon(self):
+        calls = []
+        self.loop.call_soon(calls.append, 1)
+        self.loop.call_soon(calls.append, 2).cancel()
+        self.loop.call_soon(calls.append, 3)
+        self.assertEqual(calls, [])
+        self.loop.call_later(0.05, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(calls, [1, 3])
+
+    def test_run_until_complete(self):
+        future = self.loop.create_future()
+        self.loop.call_later(0.02, future.set_result, "done")
+        self.assertEqual(self.loop.run_until_complete(future), "done")
+
+    def test_reader(self):
+        a, b = socket.socketpair()
+        future = self.loop.create_future()
+        def readable():
+            self.loop.remove_reader(a)
+            future.set_result(a.recv(5))
+        self.loop.add_reader(a, readable)
+        b.send("hello")
+        self.assertEqual(self.loop.run_until_complete(future), "hello")
+        a.close()
+        b.close()
+
+    def test_restart(self):
+        calls = []
+        self.loop.call_later(0.05, calls.append, "timer")
+        a, b = socket.socketpair()
+        self.loop.add_reader(a, lambda: calls.append(a.recv(5)))
+        first = self.loop.create_future()
+        self.loop.call_later(0.01, first.set_result, None)
+        self.loop.run_until_complete(first)
+        self.assertEqual(calls, [])
+        b.send("hello")
+        self.loop.call_later(0.1, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(sorted(calls), ["hello", "timer"])
+        self.loop.remove_reader(a)
+        a.close()
+        b.close()
+
+    def test_run_in_executor(self):
+        future = self.loop.run_in_executor(None, sum, [1, 2, 3])
+        self.assertEqual(self.loop.run_until_complete(future), 6)
+        self.thor_loop.pool.shutdown()
+
+    def test_getaddrinfo(self):
+        future = self.loop.getaddrinfo("127.0.0.1", 80,
+                                       type=socket.SOCK_STREAM)
+        infos = self.loop.run_until_complete(future)
+        self.assertEqual(infos[0][4], ("127.0.0.1", 80))
+        self.thor_loop.pool.shutdown()
+
+    def test_sock(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+        listener.setblocking(False)
+        client = socket.socket()
+        client.setblocking(False)
+        accepted = self.loop.sock_accept(listener)
+        self.loop.run_until_complete(
+            self.loop.sock_connect(client, listener.getsockname()))
+        server, address = self.loop.run_until_complete(accepted)
+        self.assertEqual(address, client.getsockname())
+        data = "x" * (1024 * 1024) # more than the socket buffers hold
+        sent = self.loop.sock_sendall(client, data)
+        received = []
+        while len(received) < len(data):
+            received.extend(self.loop.run_until_complete(
+                self.loop.sock_recv(server, 65536)))
+        self.assertEqual("".join(received), data)
+        self.assertTrue(sent.done())
+        for sock in [listener, client, server]:
+            sock.close()
+
+    def test_sock_connect_refused(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        address = listener.getsockname()
+        listener.close()
+        client = socket.socket()
+        client.setblocking(False)
+        self.assertRaises(socket.error, self.loop.run_until_complete,
+                          self.loop.sock_connect(client, address))
+        client.close()
+
+    def test_connection(self):
+        loop = self.loop
+        events = []
+        class Echo(asyncio.Protocol):
+            def connection_made(self, transport):
+                self.transport = transport
+            def data_received(self, data):
+                self.transport.write(data.upper())
+            def eof_received(self):
+                self.transport.close()
+        class Client(asyncio.Protocol):
+            def __init__(self):
+                self.done = loop.create_future()
+            def connection_made(self, transport):
+                events.append('made')
+                transport.write("hello")
+                transport.write_eof()
+            def data_received(self, data):
+                events.append(data)
+            def eof_received(self):
+                events.append('eof')
+            def connection_lost(self, exc):
+                events.append(exc)
+                self.done.set_result(None)
+        server = loop.run_until_complete(
+            loop.create_server(Echo, "127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        transport, protocol = loop.run_until_complete(
+            loop.create_connection(Client, "127.0.0.1", port))
+        self.assertEqual(transport.get_extra_info('peername'),
+                         ("127.0.0.1", port))
+        loop.run_until_complete(protocol.done)
+        self.assertEqual(events, ['made', "HELLO", 'eof', None])
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        self.assertEqual(server.sockets, None)
+        self.thor_loop.pool.shutdown()
+
+    def test_connection_refused(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        self.assertRaises(socket.error, self.loop.run_until_complete,
+            self.loop.create_connection(asyncio.Protocol, "127.0.0.1", port))
+        self.thor_loop.pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,24 @@
 #!/usr/bin/env python
 
+import pickle
 import sys
 import unittest
 
 from thor.events import EventEmitter, on
 
+
+class Slotted(EventEmitter):
+    __slots__ = ('a', '__b')
+    def __init__(self):
+        EventEmitter.__init__(self)
+        self.a = 1
+        self.__b = 2
+        self.c = 3
+        self.on('foo', self.__init__)
+    def b(self):
+        return self.__b
+
+
 class TestEventEmitter(unittest.TestCase):
     def setUp(self):
         class Thing(EventEmitter):
@@ -129,6 +143,44 @@ class TestEventEmitter(unittest.TestCase):
         self.assertEquals(self.t.foo_count, 0)
         self.assertEquals(self.t.rem1_count, 2)
         
+    def test_lazy(self):
+        e = EventEmitter()
+        self.assertEquals(e.events(), [])
+        self.assertEquals(e.listeners('foo'), [])
+        e.emit('foo')
+        e.removeListener('foo', self.fail)
+        e.removeListeners('foo')
+        self.assertFalse(hasattr(e, '__dict__') and e.__dict__)
+
+    def test_slots(self):
+        class Slotted(EventEmitter):
+            __slots__ = ('a',)
+        s = Slotted()
+        s.a = 1
+        s.b = 2 # still allowed
+        self.assertEquals(s.a + s.b, 3)
+        self.assertEquals(s.__dict__, {'b': 2})
+
+    def test_sink_cached(self):
+        class TestSink(object):
+            count = 0
+            def bam(self):
+                self.count += 1
+        s = TestSink()
+        self.t.sink(s)
+        self.t.emit('bam')
+        TestSink.bam = lambda self: self.fail("looked up again")
+        self.t.emit('bam')
+        self.assertEquals(s.count, 2)
+        self.t.sink(s) # resets the cache
+        self.assertRaises(AttributeError, self.t.emit, 'bam')
+
+    def test_pickle(self):
+        for proto in [0, 2]:
+            s = pickle.loads(pickle.dumps(Slotted(), proto))
+            self.assertEquals((s.a, s.b(), s.c), (1, 2, 3))
+            self.assertEquals(s.listeners('foo'), [])
+
     def test_removeListener_recursion(self):
         """
         Removing a later listener specifically for 
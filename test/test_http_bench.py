@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import json
+import pickle
+import unittest
+from StringIO import StringIO
+
+import framework
+
+import thor
+from thor.http import HttpServer
+from thor.http.bench import LatencyHistogram, Load, report, as_json
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentile(self):
+        hist = LatencyHistogram()
+        for i in range(1, 1001):
+            hist.record(i / 1000.0)
+        self.assertEqual(hist.count, 1000)
+        self.assertAlmostEqual(hist.percentile(50), 0.5, delta=0.005)
+        self.assertAlmostEqual(hist.percentile(99), 0.99, delta=0.01)
+        self.assertEqual(hist.percentile(100), 1.0)
+        self.assertAlmostEqual(hist.mean(), 0.5005)
+
+    def test_empty(self):
+        hist = LatencyHistogram()
+        self.assertEqual(hist.percentile(99), 0)
+        self.assertEqual(hist.mean(), 0)
+
+    def test_merge(self):
+        a = LatencyHistogram()
+        b = LatencyHistogram()
+        a.record(0.001, 10)
+        b.record(0.1, 10)
+        a.merge(pickle.loads(pickle.dumps(b)))
+        self.assertEqual(a.count, 20)
+        self.assertEqual(a.max, 0.1)
+        self.assertAlmostEqual(a.percentile(50), 0.001, delta=0.00001)
+        self.assertAlmostEqual(a.percentile(51), 0.1, delta=0.001)
+
+    def test_corrected(self):
+        hist = LatencyHistogram()
+        hist.record(0.001, 99)
+        hist.record(1.0)
+        # a 1s stall with requests due every 10ms hid ~99 slow requests
+        corrected = hist.corrected(0.01)
+        self.assertEqual(hist.count, 100)
+        self.assertTrue(195 <= corrected.count <= 200, corrected.count)
+        self.assertTrue(hist.percentile(90) < 0.002)
+        self.assertTrue(corrected.percentile(90) > 0.5)
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make(0.001)
+        self.server = HttpServer(framework.test_host, framework.test_port,
+                                 loop=self.loop)
+        def exchange(x):
+            @thor.on(x)
+            def request_done(trailers):
+                x.response_start("200", "OK",
+                                 [('Content-Type', 'text/plain')])
+                x.response_body("hello")
+                x.response_done([])
+        self.server.on('exchange', exchange)
+        self.uri = "http://%s:%s/" % (framework.test_host, framework.test_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def check(self, load):
+        results = load.run().results()
+        self.assertEqual(results['errors'], 0)
+        self.assertTrue(results['requests'] > 0)
+        self.assertEqual(results['bytes'], results['requests'] * 5)
+        self.assertEqual(results['latency'].count >= results['requests'], True)
+        self.assertEqual(results['service'].count, results['requests'])
+        return results
+
+    def test_closed(self):
+        self.check(Load(self.uri, concurrency=3, duration=0.3, loop=self.loop))
+
+    def test_open(self):
+        results = self.check(Load(self.uri, concurrency=3, duration=0.5,
+                                  rate=100, loop=self.loop))
+        self.assertTrue(40 <= results['requests'] <= 50, results['requests'])
+        self.assertEqual(results['latency'].count, results['requests'])
+
+    def test_pipelined(self):
+        self.check(Load(self.uri, concurrency=2, duration=0.3, pipeline=4,
+                        loop=self.loop))
+
+    def test_no_keepalive(self):
+        self.check(Load(self.uri, concurrency=2, duration=0.3,
+                        keepalive=False, loop=self.loop))
+
+    def test_report(self):
+        results = self.check(Load(self.uri, concurrency=2, duration=0.2,
+                                  loop=self.loop))
+        out = StringIO()
+        report(results, out)
+        self.assertTrue("Requests/sec:" in out.getvalue())
+        self.assertEqual(json.loads(as_json(results))['requests'],
+                         results['requests'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import thread
+import threading
+import time
+import unittest
+from email.utils import formatdate
+
+import framework
+from framework import test_host, test_port
+
+import thor
+from thor.events import on
+from thor.http import HttpClient, HttpServer
+from thor.http.cache import HttpCache, CacheEntry, parse_cc
+from thor.http.diskstore import DiskStore
+
+
+class TestFreshness(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = HttpCache(HttpClient(loop=thor.loop.make()))
+
+    def entry(self, res_hdrs, status='200', age=0):
+        now = time.time()
+        return CacheEntry("http://example.com/", (), status, "OK",
+                          res_hdrs, "", now - age, now - age)
+
+    def test_parse_cc(self):
+        self.assertEqual(parse_cc([
+            ('Cache-Control', 'max-age="60", no-cache'),
+            ('Cache-Control', 'Public')
+        ]), {'max-age': '60', 'no-cache': None, 'public': None})
+
+    def test_max_age(self):
+        entry = self.entry([('Cache-Control', 'max-age=60, s-maxage=30')])
+        self.assertEqual(self.cache.freshness_lifetime(entry), 30)
+        self.assertTrue(self.cache.is_fresh(entry, []))
+        self.assertFalse(self.cache.is_fresh(entry,
+            [('Cache-Control', 'max-age=0')]
+        ))
+        self.assertFalse(self.cache.is_fresh(entry,
+            [('Cache-Control', 'no-cache')]
+        ))
+
+    def test_expires(self):
+        now = time.time()
+        entry = self.entry([
+            ('Date', formatdate(now)),
+            ('Expires', formatdate(now + 100)),
+        ])
+        self.assertEqual(self.cache.freshness_lifetime(entry), 100)
+        entry = self.entry([('Expires', '0')])
+        self.assertEqual(self.cache.freshness_lifetime(entry), 0)
+
+    def test_age(self):
+        entry = self.entry([
+            ('Cache-Control', 'max-age=60'), ('Age', '50')
+        ], age=20)
+        self.assertTrue(self.cache.current_age(entry) >= 70)
+        self.assertFalse(self.cache.is_fresh(entry, []))
+
+    def test_heuristic(self):
+        now = time.time()
+        hdrs = [
+            ('Date', formatdate(now)),
+            ('Last-Modified', formatdate(now - 1000)),
+        ]
+        self.assertEqual(
+            self.cache.freshness_lifetime(self.entry(hdrs)), 100
+        )
+        self.assertEqual(
+            self.cache.freshness_lifetime(self.entry(hdrs, '302')), 0
+        )
+
+    def test_storable(self):
+        storable = self.cache.storable
+        self.assertTrue(storable("GET", [], "200",
+            [('Cache-Control', 'max-age=5')]))
+        self.assertTrue(storable("GET", [], "200", [('ETag', '"a"')]))
+        self.assertFalse(storable("GET", [], "200", []))
+        self.assertFalse(storable("POST", [], "200",
+            [('Cache-Control', 'max-age=5')]))
+        self.assertFalse(storable("GET", [], "200",
+            [('Cache-Control', 'max-age=5, private')]))
+        self.assertFalse(storable("GET", [], "200",
+            [('Cache-Control', 'max-age=5'), ('Vary', '*')]))
+        self.assertFalse(storable("GET", [('Authorization', 'x')], "200",
+            [('Cache-Control', 'max-age=5')]))
+        self.assertTrue(storable("GET", [('Authorization', 'x')], "200",
+            [('Cache-Control', 's-maxage=5')]))
+
+
+class TestCacheStore(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = HttpCache(HttpClient(loop=thor.loop.make()),
+                               max_size=1000)
+
+    def store(self, path, size):
+        entry = CacheEntry("http://example.com%s" % path, (), "200", "OK",
+                           [], "x" * size, 0, 0)
+        self.cache.store(entry)
+        return entry
+
+    def test_lru(self):
+        self.store("/a", 300)
+        self.store("/b", 300)
+        self.store("/c", 300)
+        self.assertTrue(self.cache.lookup("http://example.com/a", []))
+        self.store("/d", 300)
+        self.assertTrue(self.cache.size <= 1000)
+        self.assertFalse(self.cache.lookup("http://example.com/b", []))
+        self.assertTrue(self.cache.lookup("http://example.com/a", []))
+        self.assertTrue(self.cache.lookup("http://example.com/d", []))
+
+    def test_replace(self):
+        self.store("/a", 300)
+        entry = self.store("/a", 400)
+        self.assertEqual(self.cache.size, entry.size)
+        self.assertEqual(self.cache.lookup("http://example.com/a", []), entry)
+
+    def test_too_big(self):
+        self.store("/a", 2000)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_vary(self):
+        hdrs = [('Vary', 'Accept-Language')]
+        for lang in ['en', 'fr']:
+            req_hdrs = [('Accept-Language', lang)]
+            self.cache.store(CacheEntry(
+                "http://example.com/", self.cache._selecting(hdrs, req_hdrs),
+                "200", "OK", hdrs, lang, 0, 0
+            ))
+        for lang in ['en', 'fr']:
+            entry = self.cache.lookup(
+                "http://example.com/", [('Accept-Language', lang)]
+            )
+            self.assertEqual(entry.body, lang)
+        self.assertEqual(self.cache.lookup("http://example.com/", []), None)
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.server = HttpServer(test_host, test_port, loop=self.loop)
+        self.cache = HttpCache(HttpClient(loop=self.loop))
+        self.origin_reqs = []
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        self.server.shutdown()
+        if self.loop.pool:
+            self.loop.pool.shutdown()
+
+    def origin(self, respond):
+        """
+        Answer requests to the server with respond(exchange, method, path,
+        headers).
+        """
+        @on(self.server)
+        def exchange(x):
+            @on(x)
+            def request_start(method, uri, hdrs):
+                self.origin_reqs.append((method, uri, hdrs))
+                x.req = (method, uri, hdrs)
+            @on(x)
+            def request_done(trailers):
+                respond(x, *x.req)
+
+    def send(self, x, status, hdrs, body):
+        x.response_start(status, "OK",
+            hdrs + [('Content-Length', str(len(body)))]
+        )
+        if body:
+            x.response_body(body)
+        x.response_done([])
+
+    def fetch(self, requests):
+        """
+        Make each (method, path, headers) request in turn through the cache,
+        and run the loop until they're done. Returns a list of results.
+        """
+        results = []
+        requests = list(requests)
+        finished = []
+        def next_fetch():
+            if not requests:
+                finished.append(True)
+                self.loop.stop()
+                return
+            method, path, hdrs = requests.pop(0)
+            res = {'body': ""}
+            results.append(res)
+            exchange = self.cache.exchange()
+            @on(exchange)
+            def response_start(status, phrase, headers):
+                res['status'] = status
+                res['headers'] = headers
+            @on(exchange)
+            def response_body(chunk):
+                res['body'] += str(chunk)
+            @on(exchange)
+            def response_done(trailers):
+                res['cache'] = exchange.cache_status
+                next_fetch()
+            @on(exchange)
+            def error(err):
+                res['error'] = err
+                next_fetch()
+            exchange.request_start(method,
+                "http://%s:%s%s" % (test_host, test_port, path), hdrs
+            )
+            exchange.request_done([])
+        next_fetch()
+        if not finished: # hits can finish straight away
+            self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return results
+
+    def wait_for_disk(self):
+        "Run the loop until the cache has finished writing to disk."
+        def check():
+            if self.cache._disk_busy or self.cache._disk_queue:
+                self.loop.schedule(0.05, check)
+            else:
+                self.loop.stop()
+        self.loop.schedule(0.05, check)
+        self.loop.run()
+
+    def test_hit(self):
+        def respond(x, method, path, hdrs):
+            self.send(x, "200", [('Cache-Control', 'max-age=60')], "hi")
+        self.origin(respond)
+        results = self.fetch([("GET", "/", [])] * 3)
+        self.assertEqual(len(self.origin_reqs), 1)
+        self.assertEqual([r['cache'] for r in results],
+                         ['miss', 'hit', 'hit'])
+        for res in results:
+            self.assertEqual(res['status'], "200")
+            self.assertEqual(res['body'], "hi")
+        self.assertTrue('age' in [n.lower() for n, v in results[1]['headers']])
+        self.assertFalse('connection' in
+            [n.lower() for n, v in results[1]['headers']])
+
+    def test_no_store(self):
+        def respond(x, method, path, hdrs):
+            self.send(x, "200", [('Cache-Control', 'no-store')], "hi")
+        self.origin(respond)
+        results = self.fetch([("GET", "/", [])] * 2)
+        self.assertEqual(len(self.origin_reqs), 2)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_revalidate(self):
+        def respond(x, method, path, hdrs):
+            if '"abc"' in [v.strip() for n, v in hdrs
+                           if n.lower() == 'if-none-match']:
+                self.send(x, "304", [('ETag', '"abc"'), ('X-New', '1')], "")
+            else:
+                self.send(x, "200", [
+                    ('Cache-Control', 'max-age=0'), ('ETag', '"abc"')
+                ], "hi")
+        self.origin(respond)
+        results = self.fetch([("GET", "/", [])] * 2)
+        self.assertEqual(len(self.origin_reqs), 2)
+        self.assertEqual(results[1]['cache'], 'revalidated')
+        self.assertEqual(results[1]['status'], "200")
+        self.assertEqual(results[1]['body'], "hi")
+        self.assertTrue(('X-New', '1') in results[1]['headers'])
+
+    def test_vary(self):
+        def respond(x, method, path, hdrs):
+            lang = [v.strip() for n, v in hdrs
+                    if n.lower() == 'accept-language'][0]
+            self.send(x, "200", [
+                ('Cache-Control', 'max-age=60'), ('Vary', 'Accept-Language')
+            ], lang)
+        self.origin(respond)
+        results = self.fetch([
+            ("GET", "/", [('Accept-Language', 'en')]),
+            ("GET", "/", [('Accept-Language', 'fr')]),
+            ("GET", "/", [('Accept-Language', 'en')]),
+        ])
+        self.assertEqual(len(self.origin_reqs), 2)
+        self.assertEqual([r['body'] for r in results], ['en', 'fr', 'en'])
+
+    def test_invalidate(self):
+        def respond(x, method, path, hdrs):
+            self.send(x, "200", [('Cache-Control', 'max-age=60')], method)
+        self.origin(respond)
+        results = self.fetch([
+            ("GET", "/", []), ("POST", "/", []), ("GET", "/", [])
+        ])
+        self.assertEqual(len(self.origin_reqs), 3)
+        self.assertEqual(results[1]['cache'], 'pass')
+        self.assertEqual(results[2]['cache'], 'miss')
+
+    def test_disk(self):
+        disk_dir = tempfile.mkdtemp()
+        try:
+            self.cache = HttpCache(HttpClient(loop=self.loop),
+                max_entry_size=10, disk=DiskStore(disk_dir))
+            writers = []
+            put = self.cache.disk.put
+            def threaded_put(*args):
+                writers.append(thread.get_ident())
+                return put(*args)
+            self.cache.disk.put = threaded_put
+            body = "0123456789" * 100
+            def respond(x, method, path, hdrs):
+                self.send(x, "200", [('Cache-Control', 'max-age=60')], body)
+            self.origin(respond)
+            results = self.fetch([("GET", "/", [])])
+            self.wait_for_disk()
+            # written off the loop's thread
+            self.assertEqual(len(writers), 1)
+            self.assertNotEqual(writers[0], thread.get_ident())
+            # and the index was saved when the loop stopped
+            index = json.load(open(os.path.join(disk_dir, "index")))
+            self.assertEqual(len(index['entries']), 1)
+            results += self.fetch([("GET", "/", [])])
+            self.assertEqual(len(self.origin_reqs), 1)
+            self.assertEqual([r['cache'] for r in results], ['miss', 'hit'])
+            self.assertEqual(results[1]['body'], body)
+            self.assertEqual(self.cache.size, 0)
+            # after a restart
+            self.cache.close()
+            self.cache = HttpCache(HttpClient(loop=self.loop),
+                max_entry_size=10, disk=DiskStore(disk_dir))
+            results = self.fetch([("GET", "/", [])])
+            self.assertEqual(len(self.origin_reqs), 1)
+            self.assertEqual(results[0]['cache'], 'hit')
+            self.assertEqual(results[0]['body'], body)
+        finally:
+            shutil.rmtree(disk_dir)
+
+    def test_disk_invalidated(self):
+        disk_dir = tempfile.mkdtemp()
+        try:
+            self.cache = HttpCache(HttpClient(loop=self.loop),
+                max_entry_size=10, disk=DiskStore(disk_dir))
+            writing = threading.Event()
+            written = threading.Event()
+            put = self.cache.disk.put
+            def slow_put(*args):
+                writing.set()
+                written.wait(5)
+                return put(*args)
+            self.cache.disk.put = slow_put
+            def respond(x, method, path, hdrs):
+                self.send(x, "200", [('Cache-Control', 'max-age=60')],
+                          "0123456789" * 100)
+            self.origin(respond)
+            self.fetch([("GET", "/", [])])
+            writing.wait(5)
+            uri = "http://%s:%s/" % (test_host, test_port)
+            self.cache.invalidate(uri)
+            written.set()
+            self.wait_for_disk()
+            self.assertEqual(self.cache.lookup(uri, []), None)
+            self.assertEqual(self.cache.disk.items(), [])
+        finally:
+            shutil.rmtree(disk_dir)
+
+    def test_coalesce(self):
+        waiting = []
+        def respond(x, method, path, hdrs):
+            waiting.append(x)
+        self.origin(respond)
+        results = []
+        def done():
+            if len([r for r in results if 'done' in r]) == 3:
+                self.loop.stop()
+        for i in range(3):
+            exchange = self.cache.exchange()
+            res = {'body': ""}
+            results.append(res)
+            exchange.on('response_body', lambda c, res=res: \
+                res.__setitem__('body', res['body'] + c))
+            exchange.on('response_done', lambda t, res=res: \
+                (res.__setitem__('done', True), done()))
+            exchange.request_start("GET",
+                "http://%s:%s/" % (test_host, test_port), []
+            )
+            exchange.request_done([])
+        def answer():
+            for x in waiting:
+                self.send(x, "200", [('Cache-Control', 'max-age=60')], "hi")
+        self.loop.schedule(1, answer)
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        self.assertEqual(len(self.origin_reqs), 1)
+        self.assertEqual([r['body'] for r in results], ['hi'] * 3)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import socket
 import SocketServer
 import sys
 import time
@@ -9,7 +10,7 @@ import framework
 from framework import test_host, test_port
 
 import thor
-from thor.events import on
+from thor.events import EventEmitter, on
 from thor.http import HttpClient
 
 thor.loop.debug = True
@@ -18,6 +19,17 @@ class LittleServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
     allow_reuse_address = True
 
 
+def read_until(sock, marker):
+    "Read from sock until marker has been seen, returning all of it."
+    data = ""
+    while marker not in data:
+        chunk = sock.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
 class TestHttpClient(framework.ClientServerTestCase):
 
     def create_server(self, test_host, test_port, server_side):
@@ -390,7 +402,77 @@ Connection: close
 12345""")
             conn.request.close()
         self.go([server_side], [client_side])
-        
+
+    def test_read_timeout(self):
+        def client_side(client):
+            client.read_timeout = 1
+            exchange = client.exchange()
+
+            @on(exchange)
+            def error(err_msg):
+                self.assertEqual(
+                    err_msg.__class__,
+                    thor.http.error.ReadTimeoutError
+                )
+                self.assertEqual(err_msg.detail, 'body')
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("GET", req_uri, [])
+            exchange.request_done([])
+
+        def server_side(conn):
+            read_until(conn.request, "\r\n\r\n")
+            conn.request.send("""\
+HTTP/1.1 200 OK
+Content-Type: text/plain
+Content-Length: 10
+Connection: close
+
+12345""")
+            time.sleep(2)
+            conn.request.close()
+        self.go([server_side], [client_side])
+
+    def test_read_timeout_slow_body(self):
+        def client_side(client):
+            client.read_timeout = 1
+            exchange = client.exchange()
+            self.check_exchange(exchange, {
+                'status': "200",
+                'body': "12345",
+            })
+            timers = []
+
+            @on(exchange)
+            def response_body(chunk):
+                timers.append(exchange._read_timeout_ev)
+
+            @on(exchange)
+            def response_done(trailers):
+                # the timer is re-armed now and then, not for every chunk
+                self.assertTrue(len(set(timers)) < len(timers))
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("GET", req_uri, [])
+            exchange.request_done([])
+
+        def server_side(conn):
+            read_until(conn.request, "\r\n\r\n")
+            conn.request.send("""\
+HTTP/1.1 200 OK
+Content-Type: text/plain
+Content-Length: 5
+Connection: close
+
+""")
+            for char in "12345":
+                time.sleep(0.4)
+                conn.request.send(char)
+            conn.request.close()
+        self.go([server_side], [client_side])
+
 
     def test_conn_reuse(self):
         self.conn_checked = False
@@ -612,6 +694,350 @@ Connection: close
             conn.request.close()
         self.go([server_side], [client_side])   
 
+    def test_prewarm(self):
+        self.conn_num = 0
+        def client_side(client):
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            origin = ('http', test_host, test_port)
+            client.prewarm(req_uri, 2)
+            def check():
+                idle = client._idle_conns[origin]
+                self.assertEqual(len(idle), 2)
+                self.assertTrue(idle[0].tcp_connected)
+                self.assertEqual(self.conn_num, 2)
+                self.loop.stop()
+            self.loop.schedule(1, check)
+
+        def server_side(conn):
+            self.conn_num += 1
+            conn.request.recv(1) # wait for the client to close
+            conn.request.close()
+        self.go([server_side], [client_side])
+
+    def test_stale_conn(self):
+        self.conn_num = 0
+        def client_side(client):
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange1 = client.exchange()
+            self.check_exchange(exchange1, {'status': "200"})
+
+            @on(exchange1)
+            def response_done(trailers):
+                self.conn1 = exchange1.tcp_conn or \
+                    client._idle_conns[('http', test_host, test_port)][0]
+                exchange2 = client.exchange()
+                self.check_exchange(exchange2, {'status': "200"})
+                def start2():
+                    exchange2.request_start("GET", req_uri, [])
+                    exchange2.request_done([])
+                self.loop.schedule(1, start2)
+
+                @on(exchange2)
+                def response_start(*args):
+                    self.assertFalse(exchange2.tcp_conn is self.conn1)
+                    self.assertEqual(exchange2._retries, 0)
+
+                @on(exchange2)
+                def response_done(trailers):
+                    self.loop.stop()
+
+            exchange1.request_start("GET", req_uri, [])
+            exchange1.request_done([])
+
+        def server_side(conn):
+            self.conn_num += 1
+            conn.request.recv(1024)
+            conn.request.sendall("""\
+HTTP/1.1 200 OK
+Content-Type: text/plain
+Content-Length: 5
+
+12345""")
+            if self.conn_num == 1:
+                time.sleep(0.2) # then drop it, as if it had timed out
+            conn.request.close()
+        self.go([server_side], [client_side])
+        self.assertEqual(self.conn_num, 2)
+
+    def test_expect_continue(self):
+        def client_side(client):
+            exchange = client.exchange()
+            self.check_exchange(exchange, {
+                'status': "200",
+                'body': "got foo!"
+            })
+            self.nonfinal = []
+            exchange.on('response_nonfinal',
+                lambda *args: self.nonfinal.append(args[0]))
+
+            @on(exchange)
+            def response_done(trailers):
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("PUT", req_uri, [
+                ('Content-Length', '4'),
+                ('Expect', '100-continue')
+            ])
+            exchange.request_body("foo!")
+            exchange.request_done([])
+
+        def server_side(conn):
+            head = read_until(conn.request, "\r\n\r\n")
+            self.assertFalse("foo!" in head)
+            conn.request.sendall("HTTP/1.1 100 Continue\r\n\r\n")
+            body = read_until(conn.request, "foo!")
+            conn.request.sendall("""\
+HTTP/1.1 200 OK
+Content-Length: 8
+Connection: close
+
+got %s""" % body[-4:])
+            conn.request.close()
+        self.go([server_side], [client_side])
+        self.assertEqual(self.nonfinal, ['100'])
+
+    def test_expect_refused(self):
+        def client_side(client):
+            exchange = client.exchange()
+            self.check_exchange(exchange, {
+                'status': "417",
+                'body': "no"
+            })
+
+            @on(exchange)
+            def response_done(trailers):
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("PUT", req_uri, [
+                ('Content-Length', '4'),
+                ('Expect', '100-continue')
+            ])
+            exchange.request_body("foo!")
+            exchange.request_done([])
+
+        def server_side(conn):
+            read_until(conn.request, "\r\n\r\n")
+            conn.request.sendall("""\
+HTTP/1.1 417 Expectation Failed
+Content-Length: 2
+
+no""")
+            time.sleep(0.5)
+            conn.request.settimeout(0.5)
+            try:
+                self.late_body = conn.request.recv(1024)
+            except socket.timeout:
+                self.late_body = None
+            conn.request.close()
+        self.go([server_side], [client_side])
+        self.assertFalse(self.late_body)
+
+    def test_body_producer(self):
+        chunks = ["aaa", "bbb", "ccc", ""]
+        def client_side(client):
+            exchange = client.exchange()
+            self.check_exchange(exchange, {
+                'status': "200",
+            })
+            self.pauses = []
+            exchange.on('pause', self.pauses.append)
+
+            @on(exchange)
+            def response_done(trailers):
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("POST", req_uri, [])
+            exchange.request_body_producer(lambda: chunks.pop(0))
+            self.assertEqual(len(chunks), 4) # nothing pulled yet
+
+        def server_side(conn):
+            self.req = read_until(conn.request, "0\r\n\r\n")
+            conn.request.sendall("""\
+HTTP/1.1 200 OK
+Content-Length: 0
+Connection: close
+
+""")
+            conn.request.close()
+        self.go([server_side], [client_side])
+        self.assertEqual(self.pauses[:2], [True, False])
+        self.assertEqual(self.req.split("\r\n\r\n", 1)[1],
+            "3\r\naaa\r\n3\r\nbbb\r\n3\r\nccc\r\n0\r\n\r\n")
+
+    def test_body_push_paused(self):
+        def client_side(client):
+            exchange = client.exchange()
+            self.check_exchange(exchange, {
+                'status': "200",
+            })
+            self.pauses = []
+            exchange.on('pause', self.pauses.append)
+
+            @on(exchange)
+            def response_done(trailers):
+                self.loop.stop()
+
+            req_uri = "http://%s:%s/" % (test_host, test_port)
+            exchange.request_start("POST", req_uri, [])
+            # pushed while paused: held, not dropped or refused.
+            exchange.request_body("aaa")
+            exchange.request_body("bbb")
+            self.assertEqual(self.pauses, [True])
+            self.assertEqual(exchange._held_body, ["aaa", "bbb"])
+            exchange.request_done([])
+
+        def server_side(conn):
+            self.req = read_until(conn.request, "0\r\n\r\n")
+            conn.request.sendall("""\
+HTTP/1.1 200 OK
+Content-Length: 0
+Connection: close
+
+""")
+            conn.request.close()
+        self.go([server_side], [client_side])
+        self.assertEqual(self.pauses[:2], [True, False])
+        self.assertEqual(self.req.split("\r\n\r\n", 1)[1],
+            "3\r\naaa\r\n3\r\nbbb\r\n0\r\n\r\n")
+
+
+class DummyConn(EventEmitter):
+    "Just enough of a TcpConnection to live in the pool."
+    def __init__(self, host, port):
+        EventEmitter.__init__(self)
+        self.host = host
+        self.port = port
+        self.tcp_connected = True
+
+    def handle_close(self):
+        self.tcp_connected = False
+
+    def peek_closed(self):
+        return not self.tcp_connected
+
+    def pause(self, paused):
+        pass
+
+    def close(self):
+        self.handle_close()
+
+
+class DummyClient(EventEmitter):
+    "A TcpClient that records connection attempts instead of making them."
+    attempts = []
+
+    def __init__(self, loop=None):
+        EventEmitter.__init__(self)
+
+    def connect(self, host, port, connect_timeout=None):
+        self.attempts.append(self)
+
+
+class TestHttpClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.client = HttpClient(loop=self.loop)
+
+    def release(self, host):
+        conn = DummyConn(host, 80)
+        self.client._conn_counts[('http', host, 80)] += 1
+        self.client._release_conn(conn, 'http')
+        return conn
+
+    def test_origin_cap(self):
+        self.client.max_idle_per_origin = 2
+        conns = [self.release('a') for i in range(3)]
+        self.assertFalse(conns[0].tcp_connected)
+        self.assertEqual(self.client._idle_conns[('http', 'a', 80)],
+                         conns[1:])
+        self.assertEqual(self.client._idle_count, 2)
+
+    def test_global_lru(self):
+        self.client.max_idle_conns = 2
+        a, b = self.release('a'), self.release('b')
+        self.client._attach_conn(('http', 'a', 80), lambda c, r: None,
+                                 None, None)
+        self.release('a')
+        self.release('c')
+        self.assertFalse(b.tcp_connected)
+        self.assertEqual(sorted(self.client._idle_conns.keys()),
+                         [('http', 'a', 80), ('http', 'c', 80)])
+        self.assertEqual(self.client._conn_counts[('http', 'b', 80)], 0)
+
+    def test_server_close(self):
+        conn = self.release('a')
+        conn.emit('close')
+        self.assertEqual(self.client._idle_count, 0)
+        self.assertFalse(('http', 'a', 80) in self.client._idle_conns)
+
+    def test_close_conns(self):
+        conns = [self.release('a'), self.release('a'), self.release('b')]
+        self.loop.stop()
+        self.assertEqual([c.tcp_connected for c in conns], [False] * 3)
+        self.assertEqual(self.client._idle_count, 0)
+        self.assertEqual(self.client._idle_entries, {})
+
+    def test_sweeper(self):
+        self.client.idle_timeout = 1
+        conns = [self.release('a')]
+        sweeper = self.client._sweeper
+        self.loop.schedule(0.5, lambda: conns.append(self.release('b')))
+        def check_first():
+            self.assertFalse(self.client._sweeper is sweeper)
+            self.assertFalse(conns[0].tcp_connected)
+            self.assertTrue(conns[1].tcp_connected)
+        def check_all():
+            self.assertFalse(conns[1].tcp_connected)
+            self.assertEqual(self.client._idle_count, 0)
+            self.loop.stop()
+        self.loop.schedule(1.25, check_first)
+        self.loop.schedule(2.5, check_all)
+        self.loop.run()
+
+    def test_prewarm_cap(self):
+        self.client.tcp_client_class = DummyClient
+        DummyClient.attempts = []
+        self.client.max_server_conn = 3
+        self.client._conn_counts[('http', 'a', 80)] = 2 # busy elsewhere
+        self.client.prewarm("http://a/", 4)
+        self.assertEqual(len(DummyClient.attempts), 1)
+        self.assertEqual(self.client._conn_counts[('http', 'a', 80)], 3)
+
+    def test_prewarm_backoff(self):
+        self.client.tcp_client_class = DummyClient
+        DummyClient.attempts = []
+        retries = []
+        class Event(object):
+            def __init__(self, entry):
+                self.entry = entry
+            def delete(self):
+                retries.remove(self.entry)
+        def schedule(delay, callback, *args):
+            retries.append((delay, callback))
+            return Event(retries[-1])
+        self.loop.schedule = schedule
+        origin = ('http', 'a', 80)
+        self.client.prewarm("http://a/", 2)
+        delays = []
+        for i in range(4):
+            self.assertEqual(len(DummyClient.attempts), 2)
+            for attempt in DummyClient.attempts:
+                attempt.emit('connect_error', socket.error, 111, "refused")
+            self.assertEqual(len(retries), 1) # one retry for both errors
+            self.client._replenish(origin) # waits for the retry
+            DummyClient.attempts = []
+            delay, callback = retries.pop()
+            delays.append(delay)
+            callback()
+        self.assertEqual(delays, [0.5, 1, 2, 4])
+        self.client.prewarm("http://a/", 0)
+        self.assertEqual(self.client._warm_retries, {})
+        self.assertEqual(self.client._conn_counts[origin], 2)
+
 
 # TODO:
 #    def test_req_body(self):
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+import gzip
+import socket
+import tempfile
+import threading
+import unittest
+import zlib
+from StringIO import StringIO
+
+import framework
+
+import thor
+from thor.events import on
+from thor.http import HttpServer, HttpClient
+from thor.http.server import HttpServerExchange
+from thor.http.compress import Compressor, Decompressor, VariantCache, \
+    negotiate, compressible, variant_etag
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+def unchunk(data):
+    "Split a chunked body off the start of data; return it and the rest."
+    body = []
+    while True:
+        size, rest = data.split("\r\n", 1)
+        size = int(size, 16)
+        if size == 0:
+            return "".join(body), rest.split("\r\n", 1)[1]
+        body.append(rest[:size])
+        data = rest[size + 2:]
+
+
+class TestNegotiate(unittest.TestCase):
+
+    def test_none(self):
+        self.assertEqual(negotiate([]), None)
+
+    def test_gzip(self):
+        self.assertEqual(
+            negotiate([('Accept-Encoding', 'gzip, deflate')]), 'gzip')
+
+    def test_qvalues(self):
+        self.assertEqual(negotiate(
+            [('Accept-Encoding', 'gzip;q=0.5, deflate')]), 'deflate')
+        self.assertEqual(negotiate(
+            [('Accept-Encoding', 'gzip;q=0, deflate;q=0')]), None)
+
+    def test_star(self):
+        self.assertEqual(negotiate([('Accept-Encoding', '*')]), 'gzip')
+        self.assertEqual(negotiate(
+            [('Accept-Encoding', '*, gzip;q=0')]), 'deflate')
+
+    def test_identity(self):
+        self.assertEqual(negotiate([('Accept-Encoding', 'identity')]), None)
+
+
+class TestCompressible(unittest.TestCase):
+
+    def test_text(self):
+        self.assertTrue(compressible(
+            [('Content-Type', 'text/html; charset=utf-8')]))
+
+    def test_no_type(self):
+        self.assertFalse(compressible([]))
+
+    def test_precompressed(self):
+        for ctype in ['image/png', 'video/mp4', 'application/zip']:
+            self.assertFalse(compressible([('Content-Type', ctype)]))
+        self.assertTrue(compressible([('Content-Type', 'image/svg+xml')]))
+
+    def test_encoded(self):
+        self.assertFalse(compressible([
+            ('Content-Type', 'text/plain'), ('Content-Encoding', 'br')
+        ]))
+
+    def test_no_transform(self):
+        self.assertFalse(compressible([
+            ('Content-Type', 'text/plain'),
+            ('Cache-Control', 'max-age=60, no-transform')
+        ]))
+
+    def test_etag(self):
+        self.assertEqual(variant_etag('"abc"', 'gzip'), '"abc-gzip"')
+        self.assertEqual(variant_etag('W/"abc"', 'gzip'), 'W/"abc-gzip"')
+
+
+class TestCodecs(unittest.TestCase):
+
+    data = "".join(["line %s of some text\n" % i for i in range(5000)])
+
+    def stream(self, coding):
+        compressor = Compressor(coding)
+        out = [compressor.compress(self.data[i:i + 1000])
+               for i in range(0, len(self.data), 1000)]
+        out.append(compressor.flush())
+        return "".join(out)
+
+    def test_gzip(self):
+        body = self.stream('gzip')
+        self.assertTrue(len(body) < len(self.data) / 4)
+        self.assertEqual(gunzip(body), self.data)
+
+    def test_deflate(self):
+        self.assertEqual(zlib.decompress(self.stream('deflate')), self.data)
+
+    def test_sync_flush(self):
+        compressor = Compressor('gzip')
+        decompressor = Decompressor('gzip')
+        head = compressor.compress("hello") + compressor.flush(False)
+        self.assertEqual(decompressor.decompress(head), "hello")
+
+    def test_sync(self):
+        compressor = Compressor('gzip', sync=True)
+        decompressor = Decompressor('gzip')
+        self.assertEqual(decompressor.decompress(compressor.compress("a")),
+                         "a")
+        self.assertEqual(compressor.compress(""), "")
+        body = compressor.compress("b") + compressor.flush()
+        self.assertEqual(decompressor.decompress(body), "b")
+
+    def test_decompress(self):
+        for coding in ['gzip', 'deflate']:
+            body = self.stream(coding)
+            decompressor = Decompressor(coding)
+            out = [decompressor.decompress(body[i:i + 100])
+                   for i in range(0, len(body), 100)]
+            out.append(decompressor.flush())
+            self.assertEqual("".join(out), self.data)
+
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(self.data) + compressor.flush()
+        decompressor = Decompressor('deflate')
+        out = decompressor.decompress(body) + decompressor.flush()
+        self.assertEqual(out, self.data)
+
+
+class TestVariantCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = VariantCache(10)
+        cache.put('a', "aaaa")
+        cache.put('b', "bbbb")
+        self.assertEqual(cache.get('a'), "aaaa")
+        cache.put('c', "cccc")
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), "aaaa")
+        self.assertEqual(cache.size, 8)
+
+    def test_too_big(self):
+        cache = VariantCache(10)
+        cache.put('a', "x" * 11)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+
+class TestCompression(unittest.TestCase):
+
+    text = "".join(["line %s of some text\n" % i for i in range(5000)])
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.server = HttpServer(
+            framework.test_host, framework.test_port, loop=self.loop
+        )
+        self.server.compress_level = 6
+        self.client = HttpClient(loop=self.loop)
+        self.file = tempfile.TemporaryFile()
+        self.file.write(self.text)
+        self.file.flush()
+        self.res_hdrs = [('Content-Type', 'text/plain'), ('ETag', '"abc"')]
+        @on(self.server)
+        def exchange(x):
+            @on(x)
+            def request_done(trailers):
+                if x.uri.endswith("/file"):
+                    x.response_file(self.file, res_hdrs=self.res_hdrs)
+                    return
+                x.response_start("200", "OK", self.res_hdrs)
+                for i in range(0, len(self.text), 4096):
+                    x.response_body(self.text[i:i + 4096])
+                x.response_done([])
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.file.close()
+
+    def fetch(self, hdrs, path="/", count=1):
+        results = []
+        def go():
+            res = {'body': ""}
+            results.append(res)
+            exchange = self.client.exchange()
+            @on(exchange)
+            def response_start(status, phrase, headers):
+                res['status'] = status
+                res['headers'] = dict(
+                    [(n.lower(), v.strip()) for (n, v) in headers]
+                )
+            @on(exchange)
+            def response_body(chunk):
+                res['body'] += chunk
+            @on(exchange)
+            def response_done(trailers):
+                if len(results) < count:
+                    go()
+                else:
+                    self.loop.stop()
+            @on(exchange)
+            def error(err):
+                res['error'] = err
+                self.loop.stop()
+            exchange.request_start("GET", "http://%s:%s%s" % (
+                framework.test_host, framework.test_port, path
+            ), hdrs)
+            exchange.request_done([])
+        go()
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return results
+
+    def test_gzip(self):
+        res = self.fetch([('Accept-Encoding', 'gzip')])[0]
+        self.assertEqual(res['headers']['content-encoding'], 'gzip')
+        self.assertEqual(res['headers']['transfer-encoding'], 'chunked')
+        self.assertEqual(res['headers']['vary'], 'Accept-Encoding')
+        self.assertEqual(res['headers']['etag'], '"abc-gzip"')
+        self.assertTrue(len(res['body']) < len(self.text) / 4)
+        self.assertEqual(gunzip(res['body']), self.text)
+
+    def test_not_accepted(self):
+        res = self.fetch([])[0]
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertEqual(res['headers']['vary'], 'Accept-Encoding')
+        self.assertEqual(res['body'], self.text)
+
+    def test_precompressed(self):
+        self.res_hdrs = [('Content-Type', 'image/png')]
+        res = self.fetch([('Accept-Encoding', 'gzip')])[0]
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertEqual(res['body'], self.text)
+
+    def test_small(self):
+        self.res_hdrs = [('Content-Type', 'text/plain'),
+                         ('Content-Length', str(len(self.text)))]
+        self.server.compress_min_size = len(self.text) + 1
+        res = self.fetch([('Accept-Encoding', 'gzip')])[0]
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertEqual(res['body'], self.text)
+
+    def test_file(self):
+        self.server.compress_chunk_size = 10000 # in a few steps
+        results = self.fetch([('Accept-Encoding', 'deflate')], "/file", 2)
+        for res in results:
+            self.assertEqual(res['headers']['content-encoding'], 'deflate')
+            self.assertEqual(zlib.decompress(res['body']), self.text)
+        # the first is streamed as it's compressed, the second is cached.
+        self.assertEqual(results[0]['headers']['transfer-encoding'],
+                         'chunked')
+        self.assertEqual(int(results[1]['headers']['content-length']),
+                         len(results[1]['body']))
+        self.assertEqual(len(self.server.compressed_files._bodies), 1)
+
+    def test_file_too_big(self):
+        self.server.compress_chunk_size = 10000
+        self.server.compressed_files.max_size = 1000
+        steps = []
+        compress_file = HttpServerExchange._compress_file
+        def counted(x, *args):
+            steps.append(args[-1])
+            return compress_file(x, *args)
+        HttpServerExchange._compress_file = counted
+        try:
+            results = self.fetch([('Accept-Encoding', 'gzip')], "/file", 2)
+        finally:
+            HttpServerExchange._compress_file = compress_file
+        # compressed a piece at a time, each time.
+        self.assertEqual(steps.count(0), 2)
+        self.assertTrue(len(steps) > 2 * (len(self.text) / 10000))
+        for res in results:
+            self.assertEqual(res['headers']['content-encoding'], 'gzip')
+            self.assertEqual(res['headers']['transfer-encoding'], 'chunked')
+            self.assertEqual(gunzip(res['body']), self.text)
+        self.assertEqual(len(self.server.compressed_files._bodies), 0)
+
+    def test_file_bad_range(self):
+        res = self.fetch([
+            ('Accept-Encoding', 'gzip'), ('Range', 'bytes=9-0')
+        ], "/file")[0]
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(res['headers']['content-encoding'], 'gzip')
+        self.assertEqual(gunzip(res['body']), self.text)
+
+    def test_file_pipelined(self):
+        self.server.compress_chunk_size = 10000 # in a few steps
+        got = []
+        def client():
+            sock = socket.create_connection(
+                (framework.test_host, framework.test_port)
+            )
+            sock.sendall(
+                "GET /file HTTP/1.1\r\nHost: x\r\n"
+                "Accept-Encoding: gzip\r\n\r\n"
+                "GET / HTTP/1.0\r\nHost: x\r\n\r\n"
+            )
+            data = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data.append(chunk)
+            sock.close()
+            got.append("".join(data))
+        thread = threading.Thread(target=client)
+        thread.start()
+        def check():
+            if got:
+                self.loop.stop()
+            else:
+                self.loop.schedule(.1, check)
+        check()
+        self.loop.run()
+        thread.join()
+        self.assertFalse(self.timeout_hit)
+        # the second response waits for the first to finish.
+        hdrs, rest = got[0].split("\r\n\r\n", 1)
+        self.assertTrue("Content-Encoding: gzip" in hdrs)
+        body, rest = unchunk(rest)
+        self.assertEqual(gunzip(body), self.text)
+        hdrs, rest = rest.split("\r\n\r\n", 1)
+        self.assertTrue(hdrs.startswith("HTTP/1.1 200 OK"))
+        self.assertEqual(rest, self.text)
+
+    def test_flush(self):
+        self.text = "hello"
+        self.res_hdrs = [('Content-Type', 'text/plain')]
+        body = []
+        self.server.removeListeners('exchange')
+        @on(self.server)
+        def exchange(x):
+            x.response_start("200", "OK", self.res_hdrs)
+            x.response_body(self.text) # and never finish
+        exchange = self.client.exchange()
+        decompressor = Decompressor('gzip')
+        @on(exchange)
+        def response_body(chunk):
+            body.append(decompressor.decompress(chunk))
+            if "".join(body) == "hello":
+                self.loop.stop()
+        exchange.request_start("GET", "http://%s:%s/" % (
+            framework.test_host, framework.test_port
+        ), [('Accept-Encoding', 'gzip')])
+        exchange.request_done([])
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+
+    def test_file_range(self):
+        res = self.fetch([
+            ('Accept-Encoding', 'gzip'), ('Range', 'bytes=0-9')
+        ], "/file")[0]
+        self.assertEqual(res['status'], "206")
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertEqual(res['body'], self.text[:10])
+
+    def test_client_decompress(self):
+        self.client.decompress = True
+        res = self.fetch([])[0]
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertEqual(res['body'], self.text)
+
+    def test_client_decompress_file(self):
+        self.client.decompress = True
+        res = self.fetch([], "/file")[0]
+        self.assertFalse('content-encoding' in res['headers'])
+        self.assertFalse('content-length' in res['headers'])
+        self.assertEqual(res['body'], self.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
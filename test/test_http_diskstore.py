@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import framework
+
+from thor.http.diskstore import DiskStore
+
+
+class TestDiskStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = DiskStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def reopen(self, **args):
+        "Make a new store on the same directory, as if after a restart."
+        self.store = DiskStore(self.dir, **args)
+
+    def body(self, key):
+        chunks = self.store.get(key)
+        if chunks is None:
+            return None
+        return "".join([str(chunk) for chunk in chunks])
+
+    def test_put_get(self):
+        self.assertTrue(self.store.put("a", {'x': 1}, ["hello ", "world"]))
+        chunks = self.store.get("a")
+        self.assertTrue(isinstance(chunks[0], buffer))
+        self.assertEqual(self.body("a"), "hello world")
+        self.assertEqual(self.store.items(), [("a", {'x': 1, 'key': "a"})])
+        self.assertEqual(self.store.get("b"), None)
+
+    def test_chunks(self):
+        self.store.chunk_size = 10
+        self.store.put("a", {}, ["x" * 25])
+        self.assertEqual([len(c) for c in self.store.get("a")], [10, 10, 5])
+
+    def test_delete(self):
+        self.store.put("a", {}, ["hello"])
+        self.store.delete("a")
+        self.assertFalse(self.store.has("a"))
+        self.reopen()
+        self.assertFalse(self.store.has("a"))
+
+    def test_replace(self):
+        self.store.put("a", {}, ["one"])
+        self.store.put("a", {}, ["two"])
+        self.assertEqual(self.body("a"), "two")
+
+    def test_restart(self):
+        self.store.put("a", {'x': 1}, ["hello"])
+        self.store.close()
+        self.reopen()
+        self.assertEqual(self.body("a"), "hello")
+        self.assertEqual(self.store.items()[0][1]['x'], 1)
+
+    def test_recover(self):
+        self.store.put("a", {}, ["saved"])
+        self.store.close()
+        self.reopen()
+        self.store.put("b", {}, ["not in the index"])
+        # no close(); the index doesn't know about b.
+        self.reopen()
+        self.assertEqual(self.body("a"), "saved")
+        self.assertEqual(self.body("b"), "not in the index")
+
+    def test_truncated(self):
+        self.store.put("a", {}, ["complete"])
+        segment = self.store._active
+        size = self.store._segments[segment]
+        fh = open(self.store._segment_path(segment), 'ab')
+        fh.write("THR1\0\0")
+        fh.close()
+        self.reopen()
+        self.assertEqual(self.body("a"), "complete")
+        self.assertEqual(self.store.size, size)
+        self.store.put("b", {}, ["after"])
+        self.assertEqual(self.body("b"), "after")
+
+    def test_segments(self):
+        self.reopen(max_size=3000, segment_size=1000)
+        for i in range(10):
+            self.assertTrue(self.store.put(str(i), {}, ["x" * 400]))
+        self.assertTrue(self.store.size <= 3000)
+        self.assertFalse(self.store.has("0"))
+        self.assertTrue(self.store.has("9"))
+        self.assertFalse(self.store.put("big", {}, ["x" * 2000]))
+        segments = [n for n in os.listdir(self.dir)
+                    if n.startswith("segment-")]
+        self.assertEqual(len(segments), len(self.store._segments))
+
+    def test_clear(self):
+        self.store.put("a", {}, ["hello"])
+        self.store.clear()
+        self.assertFalse(self.store.has("a"))
+        self.assertEqual(self.store.size, 0)
+        self.reopen()
+        self.assertFalse(self.store.has("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import unittest
+
+from thor.http.error import FormError
+from thor.http.forms import MultipartParser, UrlEncodedParser, \
+    FormCollector, form_parser, parse_params
+
+
+body = "\r\n".join([
+    "preamble",
+    "--xyz",
+    'Content-Disposition: form-data; name="a"',
+    "",
+    "1",
+    "--xyz",
+    'Content-Disposition: form-data; name="b"; filename="b \\"2\\".txt"',
+    "Content-Type: text/plain",
+    "",
+    "line one\r\nline two\r\n--xy",
+    "--xyz--",
+    "epilogue",
+])
+
+
+class Recorder(object):
+    "Records what a parser emits."
+    def __init__(self, parser):
+        self.events = []
+        for event in ['field', 'part_start', 'part_done', 'done', 'error']:
+            parser.on(event, self.record(event))
+        parser.on('part_body', self.part_body)
+
+    def record(self, event):
+        return lambda *args: self.events.append((event,) + args)
+
+    def part_body(self, chunk):
+        if self.events[-1][0] == 'part_body':
+            chunk = self.events.pop()[1] + chunk
+        self.events.append(('part_body', chunk))
+
+
+def feed(parser, data, size):
+    for i in range(0, len(data), size):
+        parser.feed(data[i:i + size])
+    parser.close()
+
+
+class TestMultipartParser(unittest.TestCase):
+
+    expected = [
+        ('part_start',
+         [('Content-Disposition', 'form-data; name="a"')], 'a', None),
+        ('part_body', '1'),
+        ('part_done',),
+        ('part_start',
+         [('Content-Disposition',
+           'form-data; name="b"; filename="b \\"2\\".txt"'),
+          ('Content-Type', 'text/plain')], 'b', 'b "2".txt'),
+        ('part_body', 'line one\r\nline two\r\n--xy'),
+        ('part_done',),
+        ('done',),
+    ]
+
+    def parse(self, data, size, boundary="xyz"):
+        parser = MultipartParser(boundary)
+        recorder = Recorder(parser)
+        feed(parser, data, size)
+        return recorder.events
+
+    def test_whole(self):
+        self.assertEqual(self.parse(body, len(body)), self.expected)
+
+    def test_chunks(self):
+        for size in [1, 2, 3, 7, 16]:
+            self.assertEqual(self.parse(body, size), self.expected, size)
+
+    def test_bounded(self):
+        parser = MultipartParser("xyz")
+        parser.feed(body.split("line one")[0])
+        for i in range(1000):
+            parser.feed("x" * 1000)
+            self.assertTrue(len(parser._buffer) < 1000)
+
+    def test_no_start_boundary(self):
+        data = '--xyz\r\n\r\nno headers\r\n--xyz--'
+        self.assertEqual(self.parse(data, 5), [
+            ('part_start', [], None, None),
+            ('part_body', 'no headers'),
+            ('part_done',),
+            ('done',),
+        ])
+
+    def test_truncated(self):
+        events = self.parse(body[:100], 10)
+        self.assertEqual(events[-1][0], 'error')
+        self.assertEqual(events[-1][1].__class__, FormError)
+
+    def test_bad_header(self):
+        events = self.parse('--xyz\r\nnot a header\r\n\r\n--xyz--', 100)
+        self.assertEqual(events[-1][0], 'error')
+
+    def test_huge_header(self):
+        parser = MultipartParser("xyz", max_header_size=100)
+        recorder = Recorder(parser)
+        parser.feed('--xyz\r\nX-Big: ' + "x" * 200)
+        self.assertEqual(recorder.events[-1][0], 'error')
+
+
+class TestUrlEncodedParser(unittest.TestCase):
+
+    def test_chunks(self):
+        data = "a=1&b=two+words&c=%26%3D&d&=e&&f="
+        for size in [1, 3, len(data)]:
+            parser = UrlEncodedParser()
+            recorder = Recorder(parser)
+            feed(parser, data, size)
+            self.assertEqual(recorder.events, [
+                ('field', 'a', '1'),
+                ('field', 'b', 'two words'),
+                ('field', 'c', '&='),
+                ('field', 'd', ''),
+                ('field', '', 'e'),
+                ('field', 'f', ''),
+                ('done',),
+            ])
+
+    def test_huge_field(self):
+        parser = UrlEncodedParser(max_field_size=10)
+        recorder = Recorder(parser)
+        feed(parser, "a=1&b=" + "x" * 20, 4)
+        self.assertEqual(recorder.events[0], ('field', 'a', '1'))
+        self.assertEqual(recorder.events[1][0], 'error')
+        self.assertEqual(len(recorder.events), 2)
+
+
+class TestFormCollector(unittest.TestCase):
+
+    def collect(self, parser, data, **args):
+        collector = FormCollector(parser, **args)
+        res = {}
+        collector.on('done', lambda fields, files: res.update(
+            fields=fields, files=files))
+        collector.on('error', lambda err: res.update(error=err))
+        feed(parser, data, 5)
+        return res
+
+    def test_collect(self):
+        res = self.collect(MultipartParser("xyz"), body)
+        self.assertEqual(res['fields'], [('a', '1')])
+        self.assertEqual(len(res['files']), 1)
+        form_file = res['files'][0]
+        self.assertEqual(form_file.name, 'b')
+        self.assertEqual(form_file.filename, 'b "2".txt')
+        self.assertEqual(form_file.size, 24)
+        self.assertEqual(form_file.file.read(), 'line one\r\nline two\r\n--xy')
+
+    def test_spool(self):
+        res = self.collect(MultipartParser("xyz"), body, spool_size=10)
+        self.assertTrue(res['files'][0].file._rolled)
+        res = self.collect(MultipartParser("xyz"), body)
+        self.assertFalse(res['files'][0].file._rolled)
+
+    def test_huge_field(self):
+        res = self.collect(MultipartParser("xyz"),
+            '--xyz\r\nContent-Disposition: form-data; name="a"\r\n\r\n' +
+            "x" * 100 + '\r\n--xyz--', max_field_size=50)
+        self.assertEqual(res.keys(), ['error'])
+
+    def test_urlencoded(self):
+        res = self.collect(UrlEncodedParser(), "a=1&b=2")
+        self.assertEqual(res['fields'], [('a', '1'), ('b', '2')])
+        self.assertEqual(res['files'], [])
+
+
+class TestFormParser(unittest.TestCase):
+
+    def test_params(self):
+        self.assertEqual(
+            parse_params('Multipart/Form-Data; Boundary="a;b"; x=y'),
+            ('multipart/form-data', {'boundary': 'a;b', 'x': 'y'})
+        )
+
+    def test_form_parser(self):
+        self.assertEqual(form_parser([]), None)
+        self.assertEqual(form_parser([('Content-Type', 'text/plain')]), None)
+        self.assertTrue(isinstance(form_parser([('Content-Type',
+            'application/x-www-form-urlencoded; charset=utf-8')]),
+            UrlEncodedParser))
+        parser = form_parser([('Content-Type',
+            'multipart/form-data; boundary=xyz')])
+        self.assertEqual(parser.boundary, 'xyz')
+        self.assertRaises(FormError, form_parser,
+                          [('Content-Type', 'multipart/form-data')])
+
+
+if __name__ == '__main__':
+    unittest.main()
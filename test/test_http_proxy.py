@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import unittest
+
+import framework
+from framework import test_host, test_port
+
+import thor
+from thor.events import on
+from thor.http import HttpClient, HttpServer, HttpProxy
+from thor.http.proxy import strip_hop_by_hop
+
+origin_port = test_port + 1
+
+
+class TestStripHopByHop(unittest.TestCase):
+
+    def test_strip(self):
+        self.assertEqual(strip_hop_by_hop([
+            ('Connection', 'X-Hop, close'),
+            ('X-Hop', 'a'),
+            ('Keep-Alive', '300'),
+            ('Content-Type ', ' text/plain'),
+        ]), [('Content-Type', 'text/plain')])
+
+
+class TestHttpProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.origin = HttpServer(test_host, origin_port, loop=self.loop)
+        self.front = HttpServer(test_host, test_port, loop=self.loop)
+        self.proxy = HttpProxy(
+            self.front, "http://%s:%s" % (test_host, origin_port)
+        )
+        self.client = HttpClient(loop=self.loop)
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        self.origin.shutdown()
+        self.front.shutdown()
+
+    def fetch(self, method, path, hdrs, body=None):
+        "Make a request through the proxy and run the loop until it's done."
+        res = {'body': ""}
+        exchange = self.client.exchange()
+        @on(exchange)
+        def response_start(status, phrase, headers):
+            res['status'] = status
+            res['headers'] = headers
+        @on(exchange)
+        def response_body(chunk):
+            res['body'] += chunk
+        @on(exchange)
+        def response_done(trailers):
+            self.loop.stop()
+        @on(exchange)
+        def error(err):
+            res['error'] = err
+            self.loop.stop()
+        exchange.request_start(
+            method, "http://%s:%s%s" % (test_host, test_port, path), hdrs
+        )
+        for chunk in body or []:
+            exchange.request_body(chunk)
+        exchange.request_done([])
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return res
+
+    def test_get(self):
+        @on(self.origin)
+        def exchange(x):
+            @on(x)
+            def request_start(method, uri, hdrs):
+                self.req = (method, uri, [n.lower() for n, v in hdrs])
+                x.response_start(200, "OK", [
+                    ('Content-Type', 'text/plain'),
+                ])
+                x.response_body("hello, ")
+                x.response_body("world")
+                x.response_done([])
+        res = self.fetch("GET", "/foo?bar", [('X-Foo', 'a')])
+        self.assertEqual(res['status'], '200')
+        self.assertEqual(res['body'], "hello, world")
+        self.assertEqual(self.req[:2], ("GET", "/foo?bar"))
+        self.assertTrue('x-foo' in self.req[2])
+
+    def test_post(self):
+        self.req_body = ""
+        @on(self.origin)
+        def exchange(x):
+            @on(x)
+            def request_body(chunk):
+                self.req_body += chunk
+            @on(x)
+            def request_done(trailers):
+                x.response_start(201, "Created", [('Content-Length', '0')])
+                x.response_done([])
+        res = self.fetch("POST", "/", [], ["abc", "def", "ghi"])
+        self.assertEqual(res['status'], '201')
+        self.assertEqual(self.req_body, "abcdefghi")
+
+    def test_rewrite(self):
+        def rewrite_response(status, phrase, hdrs):
+            return hdrs + [('Via', '1.1 test')]
+        self.proxy.rewrite_response = rewrite_response
+        @on(self.origin)
+        def exchange(x):
+            @on(x)
+            def request_start(*args):
+                x.response_start(200, "OK", [('Content-Length', '2')])
+                x.response_body("ok")
+                x.response_done([])
+        res = self.fetch("GET", "/", [])
+        self.assertTrue(
+            ('Via', '1.1 test') in [(n, v.strip()) for n, v in res['headers']]
+        )
+
+    def test_upstream_down(self):
+        self.origin.shutdown()
+        self.proxy.client.retry_limit = 0
+        res = self.fetch("GET", "/", [])
+        self.assertEqual(res['status'], '504')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 
 import socket
 import sys
+import tempfile
 import time
 import unittest
 
@@ -9,7 +10,8 @@ import framework
 
 import thor
 from thor.events import on
-from thor.http import HttpServer
+from thor.http import HttpServer, HttpClient
+from thor.http.server import parse_range
 
 class TestHttpServer(framework.ClientServerTestCase):
             
@@ -187,6 +189,245 @@ Content-Length: 5
 
 
 
+
+class TestParseRange(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-200", 100), (0, 99))
+        self.assertEqual(parse_range("bytes=100-", 100), None)
+        self.assertEqual(parse_range("bytes=-0", 100), None)
+
+    def test_ignored(self):
+        for value in ["bytes=0-1,5-6", "items=0-1", "bytes=5-1", "bytes=a-",
+                      "bytes=1", "0-1"]:
+            self.assertRaises(ValueError, parse_range, value, 100)
+
+
+class TestResponseFile(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.server = HttpServer(
+            framework.test_host, framework.test_port, loop=self.loop
+        )
+        self.client = HttpClient(loop=self.loop)
+        self.data = "".join([chr(i % 256) for i in range(100000)])
+        self.file = tempfile.TemporaryFile()
+        self.file.write(self.data)
+        self.file.flush()
+        self.offset = 0
+        @on(self.server)
+        def exchange(x):
+            @on(x)
+            def request_done(trailers):
+                x.response_file(self.file, self.offset, res_hdrs=[
+                    ('Content-Type', 'application/octet-stream'),
+                    ('ETag', '"abc"')
+                ])
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.file.close()
+
+    def fetch(self, method, hdrs):
+        res = {'body': ""}
+        exchange = self.client.exchange()
+        @on(exchange)
+        def response_start(status, phrase, headers):
+            res['status'] = status
+            res['headers'] = dict(
+                [(n.lower(), v.strip()) for (n, v) in headers]
+            )
+        @on(exchange)
+        def response_body(chunk):
+            res['body'] += chunk
+        @on(exchange)
+        def response_done(trailers):
+            self.loop.stop()
+        @on(exchange)
+        def error(err):
+            res['error'] = err
+            self.loop.stop()
+        exchange.request_start(method, "http://%s:%s/" % (
+            framework.test_host, framework.test_port
+        ), hdrs)
+        exchange.request_done([])
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return res
+
+    def test_whole(self):
+        res = self.fetch("GET", [])
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(res['headers']['content-length'], "100000")
+        self.assertEqual(res['headers']['accept-ranges'], "bytes")
+        self.assertEqual(res['body'], self.data)
+
+    def test_range(self):
+        res = self.fetch("GET", [('Range', 'bytes=70000-70009')])
+        self.assertEqual(res['status'], "206")
+        self.assertEqual(res['headers']['content-range'],
+                         "bytes 70000-70009/100000")
+        self.assertEqual(res['body'], self.data[70000:70010])
+
+    def test_if_range(self):
+        res = self.fetch("GET", [
+            ('Range', 'bytes=0-9'), ('If-Range', '"def"')
+        ])
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(res['body'], self.data)
+
+    def test_unsatisfiable(self):
+        res = self.fetch("GET", [('Range', 'bytes=200000-')])
+        self.assertEqual(res['status'], "416")
+        self.assertEqual(res['headers']['content-range'], "bytes */100000")
+        self.assertEqual(res['body'], "")
+
+    def test_head(self):
+        res = self.fetch("HEAD", [])
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(res['headers']['content-length'], "100000")
+        self.assertEqual(res['body'], "")
+
+    def test_offset_past_end(self):
+        self.offset = 200000
+        res = self.fetch("GET", [])
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(res['headers']['content-length'], "0")
+        self.assertEqual(res['body'], "")
+
+
+class TestRequestBody(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make(.1)
+        self.server = HttpServer(
+            framework.test_host, framework.test_port, loop=self.loop
+        )
+        self.client = HttpClient(loop=self.loop)
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def post(self, body, hdrs=None):
+        res = {'body': ""}
+        exchange = self.client.exchange()
+        @on(exchange)
+        def response_start(status, phrase, headers):
+            res['status'] = status
+        @on(exchange)
+        def response_body(chunk):
+            res['body'] += chunk
+        @on(exchange)
+        def response_done(trailers):
+            self.loop.stop()
+        @on(exchange)
+        def error(err):
+            res['error'] = err
+            self.loop.stop()
+        exchange.request_start("POST", "http://%s:%s/" % (
+            framework.test_host, framework.test_port
+        ), hdrs or [])
+        exchange.request_body(body)
+        exchange.request_done([])
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return res
+
+    def respond(self, x, body):
+        x.response_start("200", "OK", [('Content-Length', str(len(body)))])
+        x.response_body(body)
+        x.response_done([])
+
+    def test_credit(self):
+        data = "x" * 500000
+        got = {'body': "", 'allowed': 0, 'paused': False}
+        @on(self.server)
+        def exchange(x):
+            def allow():
+                got['paused'] = got['paused'] or \
+                    x.http_conn.tcp_conn._input_paused
+                got['allowed'] += 50000
+                x.request_body_credit(50000)
+            @on(x)
+            def request_start(*args):
+                allow()
+            @on(x)
+            def request_body(chunk):
+                got['body'] += chunk
+                self.assertTrue(len(got['body']) <= got['allowed'])
+                if len(got['body']) == got['allowed']:
+                    self.loop.schedule(.1, allow)
+            @on(x)
+            def request_done(trailers):
+                self.respond(x, "ok")
+        res = self.post(data, [('Content-Length', str(len(data)))])
+        self.assertEqual(res['status'], "200")
+        self.assertEqual(got['body'], data)
+        self.assertTrue(got['paused'])
+
+    def test_too_large(self):
+        self.server.max_body_size = 1000
+        started = []
+        self.server.on('exchange', started.append)
+        res = self.post("x" * 5000, [('Content-Length', '5000')])
+        self.assertEqual(res['status'], "413")
+        self.assertEqual(started, [])
+
+    def test_too_large_chunked(self):
+        self.server.max_body_size = 1000
+        errors = []
+        @on(self.server)
+        def exchange(x):
+            x.on('error', errors.append)
+        res = self.post("x" * 5000)
+        self.assertEqual(res['status'], "413")
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].__class__,
+                         thor.http.error.BodyTooLargeError)
+
+    def test_too_large_then_respond(self):
+        self.server.max_body_size = 1000
+        res = {}
+        @on(self.server)
+        def exchange(x):
+            @on(x)
+            def error(err):
+                # the application doesn't know the connection is gone.
+                def respond():
+                    self.respond(x, "too late")
+                    res['responded'] = True
+                    self.loop.stop()
+                self.loop.schedule(.1, respond)
+        exchange = self.client.exchange()
+        @on(exchange)
+        def response_start(status, phrase, headers):
+            res['status'] = status
+        exchange.request_start("POST", "http://%s:%s/" % (
+            framework.test_host, framework.test_port
+        ), [])
+        exchange.request_body("x" * 5000)
+        exchange.request_done([])
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        self.assertEqual(res['status'], "413")
+        self.assertTrue(res.get('responded'))
+
+
 #    def test_conn_close(self):
 #    def test_req_nobody(self):
 #    def test_res_nobody(self):
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import unittest
+
+import framework
+from framework import test_host, test_port
+
+import thor
+from thor.events import on
+from thor.http import HttpClient, HttpServer
+from thor.http.error import ConnectError, ReadTimeoutError
+from thor.http.upstream import Backend, RoundRobin, LeastOutstanding, \
+    PowerOfTwo, ConsistentHash
+
+dead_port = test_port + 9 # nothing listens here
+
+
+class TestStrategies(unittest.TestCase):
+
+    def setUp(self):
+        self.backends = [Backend('10.0.0.%s' % i, 80) for i in range(4)]
+
+    def test_round_robin(self):
+        strategy = RoundRobin()
+        picked = [strategy.pick(self.backends, None) for i in range(8)]
+        self.assertEqual(set(picked[:4]), set(self.backends))
+        self.assertEqual(picked[:4], picked[4:])
+
+    def test_least_outstanding(self):
+        strategy = LeastOutstanding()
+        for i, backend in enumerate(self.backends):
+            backend.outstanding = 4 - i
+        for i in range(4):
+            self.assertEqual(
+                strategy.pick(self.backends, None), self.backends[3]
+            )
+
+    def test_power_of_two(self):
+        strategy = PowerOfTwo()
+        self.backends[0].outstanding = 100
+        for i in range(50):
+            self.assertNotEqual(
+                strategy.pick(self.backends, None), self.backends[0]
+            )
+
+    def test_consistent_hash(self):
+        strategy = ConsistentHash()
+        keys = ["/thing/%s" % i for i in range(100)]
+        before = dict([(k, strategy.pick(self.backends, k)) for k in keys])
+        self.assertEqual(len(set(before.values())), 4)
+        for k in keys:
+            self.assertEqual(strategy.pick(self.backends, k), before[k])
+        # take one away; only its keys should move.
+        gone = self.backends.pop()
+        for k in keys:
+            if before[k] is not gone:
+                self.assertEqual(strategy.pick(self.backends, k), before[k])
+
+
+class TestUpstream(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.client = HttpClient(loop=self.loop)
+        self.upstream = self.client.upstream(
+            "pool", [('a', 80), ('b', 80)]
+        )
+        self.ejected = []
+        self.restored = []
+        self.upstream.on('eject', self.ejected.append)
+        self.upstream.on('restore', self.restored.append)
+
+    def test_eject(self):
+        a, b = self.upstream.backends
+        for i in range(self.upstream.max_fails):
+            self.assertEqual(self.upstream.available(), [a, b])
+            self.upstream.pick(None)
+            self.upstream.done(a, ConnectError("nope"))
+        self.assertEqual(self.ejected, [a])
+        self.assertEqual(self.upstream.available(), [b])
+        for i in range(4):
+            self.assertEqual(self.upstream.pick(None), b)
+
+    def test_success_resets(self):
+        a, b = self.upstream.backends
+        for i in range(self.upstream.max_fails * 2):
+            self.upstream.done(a, ReadTimeoutError("body"))
+            self.upstream.done(a)
+        self.assertEqual(self.ejected, [])
+
+    def test_restore(self):
+        a, b = self.upstream.backends
+        self.upstream.eject_time = 0
+        for i in range(self.upstream.max_fails):
+            self.upstream.done(a, ConnectError("nope"))
+        self.assertEqual(self.ejected, [a])
+        self.assertEqual(self.upstream.available(), [a, b])
+        self.assertEqual(self.restored, [a])
+
+    def test_release(self):
+        a, b = self.upstream.backends
+        a.failures = 1
+        self.upstream.pick(None)
+        self.upstream.release(b)
+        self.assertEqual(b.outstanding, 0)
+        self.assertEqual(a.failures, 1)
+
+    def test_all_ejected(self):
+        for backend in self.upstream.backends:
+            for i in range(self.upstream.max_fails):
+                self.upstream.done(backend, ConnectError("nope"))
+        self.assertEqual(self.upstream.available(), [])
+        self.assertTrue(self.upstream.pick(None) in self.upstream.backends)
+
+
+class TestHttpUpstream(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        self.servers = []
+        for i in range(2):
+            server = HttpServer(test_host, test_port + i, loop=self.loop)
+            self.answer(server, str(i))
+            self.servers.append(server)
+        self.client = HttpClient(loop=self.loop)
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+
+    def answer(self, server, body):
+        @on(server)
+        def exchange(x):
+            @on(x)
+            def request_done(trailers):
+                x.response_start("200", "OK", [
+                    ('Content-Length', str(len(body)))
+                ])
+                x.response_body(body)
+                x.response_done([])
+
+    def fetch(self, uri, count):
+        """
+        Fetch uri count times, one after another, and run the loop until
+        they're done. Returns a list of results.
+        """
+        results = []
+        def next_fetch():
+            if len(results) == count:
+                self.loop.stop()
+                return
+            res = {'body': ""}
+            results.append(res)
+            exchange = self.client.exchange()
+            @on(exchange)
+            def response_start(status, phrase, headers):
+                res['status'] = status
+            @on(exchange)
+            def response_body(chunk):
+                res['body'] += chunk
+            @on(exchange)
+            def response_done(trailers):
+                next_fetch()
+            @on(exchange)
+            def error(err):
+                res['error'] = err
+                next_fetch()
+            exchange.request_start("GET", uri, [])
+            exchange.request_done([])
+        next_fetch()
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return results
+
+    def test_balance(self):
+        upstream = self.client.upstream("pool", [
+            (test_host, test_port), (test_host, test_port + 1)
+        ])
+        bodies = [res['body'] for res in self.fetch("http://pool/", 4)]
+        self.assertEqual(sorted(bodies), ['0', '0', '1', '1'])
+        for backend in upstream.backends:
+            self.assertEqual(backend.outstanding, 0)
+
+    def test_passive_eject(self):
+        upstream = self.client.upstream("pool", [
+            (test_host, test_port), (test_host, dead_port)
+        ])
+        dead = upstream.backends[1]
+        errors = 0
+        for res in self.fetch("http://pool/", upstream.max_fails * 2 + 4):
+            if 'error' in res:
+                self.assertTrue(isinstance(res['error'], ConnectError))
+                errors += 1
+            else:
+                self.assertEqual(res['body'], '0')
+        self.assertEqual(errors, upstream.max_fails)
+        self.assertEqual(upstream.available(), [upstream.backends[0]])
+        self.assertEqual(dead.outstanding, 0)
+
+    def silence(self, server):
+        "Make server take requests without answering; returns them."
+        exchanges = []
+        server.removeListeners('exchange')
+        server.on('exchange', exchanges.append)
+        return exchanges
+
+    def test_abort(self):
+        upstream = self.client.upstream("pool", [(test_host, test_port)])
+        received = self.silence(self.servers[0])
+        backend = upstream.backends[0]
+        events = []
+        exchange = self.client.exchange()
+        for event in ['response_start', 'response_done', 'error']:
+            exchange.on(event, lambda *args: events.append(args))
+        exchange.request_start("GET", "http://pool/", [])
+        exchange.request_done([])
+        def check_received():
+            self.assertEqual(len(received), 1)
+            self.assertEqual(backend.outstanding, 1)
+            exchange.abort()
+            self.assertEqual(backend.outstanding, 0)
+            self.loop.schedule(0.2, self.loop.stop)
+        self.loop.schedule(0.2, check_received)
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        self.assertEqual(events, [])
+        self.assertEqual(backend.failures, 0)
+        self.assertEqual(received[0].http_conn.tcp_conn, None)
+
+    def test_check_timeout(self):
+        upstream = self.client.upstream("pool", [(test_host, test_port)])
+        upstream.max_fails = 1
+        received = self.silence(self.servers[0])
+        @on(upstream)
+        def eject(backend):
+            self.loop.schedule(0.2, self.loop.stop)
+        upstream.start_checks("/", interval=10, timeout=0.2)
+        self.loop.run()
+        upstream.stop_checks()
+        self.assertFalse(self.timeout_hit)
+        self.assertEqual(upstream.available(), [])
+        # the check's connection was closed when it timed out.
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].http_conn.tcp_conn, None)
+
+    def test_active_checks(self):
+        upstream = self.client.upstream("pool", [
+            (test_host, test_port), (test_host, dead_port)
+        ])
+        upstream.max_fails = 1
+        @on(upstream)
+        def eject(backend):
+            self.assertEqual(backend.port, dead_port)
+            self.loop.stop()
+        upstream.start_checks("/", interval=10, timeout=2)
+        self.loop.run()
+        upstream.stop_checks()
+        self.assertFalse(self.timeout_hit)
+        self.assertEqual(upstream.available(), [upstream.backends[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
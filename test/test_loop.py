@@ -5,7 +5,9 @@ import os
 import socket
 import sys
 import tempfile
+import threading
 import time as systime
+import traceback
 import unittest
 
 from framework import make_fifo
@@ -92,6 +94,24 @@ class TestLoop(unittest.TestCase):
         self.loop.schedule(run_time, check_time, systime.time())
         self.loop.run()
         
+    def test_schedule_zero(self):
+        loop = thor.loop.make(precision=10)
+        steps = []
+        def step():
+            steps.append(len(traceback.extract_stack()))
+            if len(steps) < 2000:
+                loop.schedule(0, step)
+            else:
+                loop.stop()
+        loop.schedule(0, step)
+        self.assertEqual(steps, [])
+        start = systime.time()
+        loop.schedule(5, loop.stop)
+        loop.run()
+        self.assertEqual(len(steps), 2000)
+        self.assertEqual(len(set(steps)), 1) # none of them nested
+        self.assertTrue(systime.time() - start < 2)
+
     def test_schedule_delete(self):
         def not_good():
             assert Exception, "this event should not have happened."
@@ -110,6 +130,117 @@ class TestLoop(unittest.TestCase):
         self.loop.schedule(run_time, check_time)
         self.loop.run()
 
+    def test_monotonic_threads(self):
+        backwards = []
+        def check():
+            last = thor.loop.monotonic()
+            for i in xrange(20000):
+                now = thor.loop.monotonic()
+                if now < last:
+                    backwards.append((last, now))
+                last = now
+        threads = [threading.Thread(target=check) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(backwards, [])
+
+    def test_now(self):
+        def check_now():
+            now = self.loop.now()
+            self.assertTrue(abs(thor.loop.monotonic() - now) <= 0.1)
+            systime.sleep(0.1)
+            self.assertEqual(self.loop.now(), now)
+            self.loop.update_time()
+            self.assertTrue(self.loop.now() - now >= 0.1)
+            self.loop.stop()
+        self.loop.schedule(0.5, check_now)
+        self.loop.run()
+
+    def test_clock_change(self):
+        wall_time = systime.time
+        fired = []
+        def change_clock():
+            systime.time = lambda: wall_time() - 3600
+        def check():
+            fired.append(thor.loop.monotonic() - start)
+            self.loop.stop()
+        self.loop.schedule(0.1, change_clock)
+        self.loop.schedule(1, check)
+        # in case check never fires
+        guard = threading.Timer(
+            5, self.loop.call_soon_threadsafe, [self.loop.stop])
+        guard.start()
+        start = thor.loop.monotonic()
+        try:
+            self.loop.run()
+        finally:
+            systime.time = wall_time
+            guard.cancel()
+        self.assertEqual(len(fired), 1)
+        self.assertTrue(fired[0] < 1 + self.loop.precision * 2)
+
+    def test_call_soon_threadsafe(self):
+        loop = thor.loop.make(precision=10)
+        called = []
+        def call(sent):
+            called.append((systime.time() - sent, loop.thread_id))
+            if len(called) == 2:
+                loop.stop()
+        def other_thread():
+            systime.sleep(0.1)
+            loop.call_soon_threadsafe(call, systime.time())
+            loop.call_soon_threadsafe(call, systime.time())
+        threading.Thread(target=other_thread).start()
+        loop.schedule(5, loop.stop)
+        loop.run()
+        self.assertEqual(len(called), 2)
+        # the loop didn't wait for its 10 second poll timeout
+        self.assertTrue(called[1][0] < 0.5)
+        self.assertEqual(called[0][1], threading.current_thread().ident)
+
+    def test_call_soon_threadsafe_not_running(self):
+        called = []
+        self.loop.call_soon_threadsafe(called.append, 1)
+        self.assertEqual(called, [])
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop.run()
+        self.assertEqual(called, [1])
+        self.assertEqual(self.loop.fd_count(), 0)
+
+    def test_loop_per_thread(self):
+        self.assertTrue(thor.loop.get_loop() is thor.loop._loop)
+        results = []
+        def work(name):
+            loop = thor.loop.get_loop()
+            server = thor.TcpServer('127.0.0.1', 0)
+            server.on('start', lambda: results.append(
+                (name, server._loop is loop, thor.loop.get_loop() is loop)))
+            thor.loop.schedule(0.1, thor.loop.stop)
+            thor.loop.run()
+            server.shutdown()
+            results.append(loop)
+        threads = [threading.Thread(target=work, args=(i,)) for i in [1, 2]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        loops = [r for r in results if not isinstance(r, tuple)]
+        starts = sorted(r for r in results if isinstance(r, tuple))
+        self.assertEqual(starts, [(1, True, True), (2, True, True)])
+        self.assertEqual(len(loops), 2)
+        self.assertTrue(loops[0] is not loops[1])
+        self.assertTrue(thor.loop._loop not in loops)
+
+    def test_set_loop(self):
+        thor.loop.set_loop(self.loop)
+        try:
+            self.assertTrue(thor.loop.get_loop() is self.loop)
+            self.assertTrue(thor.loop.EventSource()._loop is self.loop)
+        finally:
+            thor.loop.set_loop(thor.loop._loop)
+
 
 class TestEventSource(unittest.TestCase):
 
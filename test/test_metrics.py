@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import unittest
+
+import framework
+
+import thor
+from thor import metrics
+from thor.events import on
+from thor.http import HttpServer, HttpClient, MetricsServer
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("things_total", "Things.")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.value, 3)
+        self.assertTrue(self.registry.counter("things_total", "") is counter)
+
+    def test_kind_clash(self):
+        self.registry.counter("things", "Things.")
+        self.assertRaises(ValueError, self.registry.histogram, "things", "")
+
+    def test_gauge(self):
+        gauge = self.registry.gauge("depth", "Depth.", lambda: 7)
+        self.assertEqual(gauge.value, 7)
+
+    def test_histogram(self):
+        hist = self.registry.histogram("size", "Size.", [1, 10])
+        for value in [0.5, 1, 5, 50]:
+            hist.observe(value)
+        self.assertEqual(hist.count, 4)
+        self.assertEqual(hist.sum, 56.5)
+        self.assertEqual(hist.cumulative(),
+                         [(1, 2), (10, 3), (float('inf'), 4)])
+
+    def test_prometheus(self):
+        self.registry.counter("b_total", "B.").inc(2)
+        self.registry.histogram("a", "A.", [1]).observe(0.5)
+        self.assertEqual(
+            metrics.prometheus_text(self.registry.collect()),
+            "# HELP a A.\n"
+            "# TYPE a histogram\n"
+            'a_bucket{le="1"} 1\n'
+            'a_bucket{le="+Inf"} 1\n'
+            "a_sum 0.5\n"
+            "a_count 1\n"
+            "# HELP b_total B.\n"
+            "# TYPE b_total counter\n"
+            "b_total 2\n"
+        )
+
+    def test_sink(self):
+        loop = thor.loop.make(precision=.01)
+        exported = []
+        self.registry.counter("things_total", "Things.").inc()
+        def sink(collected):
+            exported.append(collected)
+            if len(exported) == 2:
+                self.registry.remove_sink(sink)
+                loop.schedule(.05, loop.stop)
+        self.registry.add_sink(sink, .01, loop)
+        loop.run()
+        self.assertEqual(len(exported), 2)
+        self.assertEqual(exported[0][0].name, "things_total")
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make()
+        metrics.registry.reset()
+        metrics.enabled = True
+        self.server = HttpServer(
+            framework.test_host, framework.test_port, loop=self.loop
+        )
+        self.metrics_server = MetricsServer(
+            framework.test_host, framework.test_port + 1, loop=self.loop
+        )
+        self.client = HttpClient(loop=self.loop)
+        @on(self.server)
+        def exchange(x):
+            @on(x)
+            def request_done(trailers):
+                x.response_start("200", "OK", [('Content-Length', '5')])
+                x.response_body("hello")
+                x.response_done([])
+        self.timeout_hit = False
+        def timeout():
+            self.timeout_hit = True
+            self.loop.stop()
+        self.loop.schedule(5, timeout)
+
+    def tearDown(self):
+        metrics.enabled = False
+        self.server.shutdown()
+        self.metrics_server.shutdown()
+
+    def fetch(self, uris):
+        results = []
+        def go():
+            res = {'body': ""}
+            results.append(res)
+            exchange = self.client.exchange()
+            @on(exchange)
+            def response_start(status, phrase, headers):
+                res['status'] = status
+            @on(exchange)
+            def response_body(chunk):
+                res['body'] += chunk
+            @on(exchange)
+            def response_done(trailers):
+                if len(results) < len(uris):
+                    go()
+                else:
+                    self.loop.stop()
+            @on(exchange)
+            def error(err):
+                res['error'] = err
+                self.loop.stop()
+            exchange.request_start("GET", uris[len(results) - 1], [])
+            exchange.request_done([])
+        go()
+        self.loop.run()
+        self.assertFalse(self.timeout_hit)
+        return results
+
+    def test_metrics(self):
+        origin = "http://%s:%s" % (framework.test_host, framework.test_port)
+        results = self.fetch([origin + "/", origin + "/",
+            "http://%s:%s/metrics" % (
+                framework.test_host, framework.test_port + 1
+            )
+        ])
+        self.assertEqual(results[1]['body'], "hello")
+        self.assertEqual(metrics.http_client_pool_misses.value, 2)
+        self.assertEqual(metrics.http_client_pool_hits.value, 1)
+        self.assertTrue(metrics.tcp_bytes_read.value > 0)
+        self.assertTrue(metrics.tcp_bytes_written.value > 0)
+        self.assertTrue(metrics.http_parse_time.count >= 4)
+        self.assertEqual(metrics.http_server_outstanding.count, 3)
+        self.assertTrue(metrics.loop_busy.count > 0)
+        self.assertTrue(metrics.loop_fd_events.count > 0)
+        text = results[2]['body']
+        self.assertEqual(results[2]['status'], "200")
+        self.assertTrue("# TYPE thor_tcp_read_bytes_total counter" in text)
+        self.assertTrue("thor_http_client_pool_hits_total 1\n" in text)
+
+    def test_not_found(self):
+        results = self.fetch(["http://%s:%s/other" % (
+            framework.test_host, framework.test_port + 1
+        )])
+        self.assertEqual(results[0]['status'], "404")
+
+    def test_disabled(self):
+        metrics.enabled = False
+        self.fetch(["http://%s:%s/" % (
+            framework.test_host, framework.test_port
+        )])
+        self.assertEqual(metrics.tcp_bytes_read.value, 0)
+        self.assertEqual(metrics.loop_busy.count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
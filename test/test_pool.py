@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+import unittest
+
+import framework
+
+import thor
+from thor.pool import ThreadPool, ProcessPool, PoolFullError
+
+
+def pid():
+    return os.getpid()
+
+def fail(message):
+    raise ValueError(message)
+
+def unpicklable():
+    return lambda: None
+
+
+class TestThreadPool(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make(precision=1)
+        self.pool = ThreadPool(self.loop, workers=2, max_queue=4)
+        self.loop.pool = self.pool
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_done(self):
+        results = []
+        def done(result):
+            results.append((result, threading.current_thread().ident))
+            self.loop.stop()
+        job = self.loop.run_in_pool(threading.current_thread)
+        job.on('done', done)
+        self.loop.schedule(5, self.loop.stop)
+        start = time.time()
+        self.loop.run()
+        self.assertTrue(time.time() - start < 0.5)
+        worker, thread_id = results[0]
+        self.assertNotEqual(worker.ident, self.loop.thread_id)
+        self.assertEqual(thread_id, self.loop.thread_id)
+        self.assertEqual(self.pool.outstanding, 0)
+
+    def test_error(self):
+        errors = []
+        def error(err):
+            errors.append(err)
+            self.loop.stop()
+        self.loop.run_in_pool(fail, "oops").on('error', error)
+        self.loop.schedule(5, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(errors[0].__class__, ValueError)
+        self.assertEqual(str(errors[0]), "oops")
+
+    def test_default_pool(self):
+        loop = thor.loop.make()
+        self.assertEqual(loop.pool, None)
+        loop.run_in_pool(pid)
+        self.assertEqual(loop.pool.__class__, ThreadPool)
+        loop.pool.shutdown()
+
+    def test_backpressure(self):
+        go = threading.Event()
+        pauses = []
+        done = []
+        def job_done(result):
+            done.append(result)
+            if len(done) == 6:
+                self.loop.stop()
+        self.pool.on('pause', pauses.append)
+        for i in range(2 + 4): # two running, four queued
+            self.pool.submit(go.wait).on('done', job_done)
+        self.assertEqual(self.pool.queued(), 4)
+        self.assertEqual(pauses, [True])
+        self.assertRaises(PoolFullError, self.pool.submit, pid)
+        self.loop.schedule(0.1, go.set)
+        self.loop.schedule(5, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(pauses, [True, False])
+        self.assertEqual(len(done), 6)
+
+
+class TestProcessPool(unittest.TestCase):
+
+    def test_done(self):
+        loop = thor.loop.make(precision=1)
+        pool = ProcessPool(loop, workers=1)
+        results = []
+        def done(result):
+            results.append(result)
+            loop.stop()
+        pool.submit(pid).on('done', done)
+        loop.schedule(10, loop.stop)
+        loop.run()
+        pool.shutdown()
+        self.assertEqual(len(results), 1)
+        self.assertNotEqual(results[0], os.getpid())
+
+    def test_unpicklable(self):
+        loop = thor.loop.make(precision=1)
+        pool = ProcessPool(loop, workers=1)
+        errors = []
+        def error(err):
+            errors.append(err)
+            if len(errors) == 2:
+                loop.stop()
+        pool.submit(lambda: None).on('error', error)
+        pool.submit(unpicklable).on('error', error)
+        loop.schedule(10, loop.stop)
+        loop.run()
+        pool.shutdown()
+        self.assertEqual(len(errors), 2)
+        for err in errors:
+            self.assertTrue(isinstance(err, Exception), err)
+        self.assertEqual(pool.outstanding, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
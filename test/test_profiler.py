@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import os
+import signal
+import socket
+import time
+import unittest
+from StringIO import StringIO
+
+import framework
+
+import thor
+from thor.events import EventEmitter
+from thor.profiler import Profiler, Watchdog, describe
+
+
+def slow():
+    time.sleep(0.05)
+
+def quick():
+    pass
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = thor.loop.make(precision=.01)
+        self.profiler = Profiler(self.loop, top=3)
+
+    def test_describe(self):
+        self.assertTrue(describe(slow).startswith(
+            "%s.slow (test_profiler.py:" % __name__))
+        self.assertTrue(describe(self.setUp).startswith(
+            "%s.TestProfiler.setUp (" % __name__))
+
+    def test_timers(self):
+        self.loop.schedule(0.01, slow)
+        for i in range(5):
+            self.loop.schedule(0.01, quick)
+        self.loop.schedule(0.1, self.loop.stop)
+        self.loop.run()
+        stats = dict([(s[0].split(" ")[0], s) for s in
+                      self.profiler.stats.values()])
+        self.assertEqual(stats[__name__ + '.quick'][1], 5)
+        self.assertTrue(stats[__name__ + '.slow'][2] >= 0.05)
+        self.assertEqual(len(self.profiler.slowest), 3)
+        self.assertTrue(max(self.profiler.slowest)[1].startswith(
+            __name__ + ".slow"))
+        report = self.profiler.report()
+        self.assertTrue("By total time:" in report)
+        self.assertTrue(__name__ + ".slow" in report.split("\n")[4])
+
+    def test_fd_events(self):
+        a, b = socket.socketpair()
+        conn = thor.tcp.TcpConnection(a, "localhost", 0, loop=self.loop)
+        received = []
+        def data(chunk):
+            received.append(chunk)
+            self.loop.stop()
+        conn.on('data', data)
+        conn.pause(False)
+        b.send("hello")
+        self.loop.run()
+        b.close()
+        conn.close()
+        self.assertEqual(received, ["hello"])
+        names = [s[0] for s in self.profiler.stats.values()]
+        self.assertTrue([n for n in names
+                         if n.startswith("thor.tcp.TcpConnection.handle_read")])
+
+    def test_sink(self):
+        emitter = EventEmitter()
+        class Sink(object):
+            called = False
+            def thing(self):
+                self.called = True
+        sink = Sink()
+        emitter.sink(sink)
+        self.profiler.emit(emitter, 'thing')
+        self.assertTrue(sink.called)
+
+    def test_stop(self):
+        self.profiler.stop()
+        self.assertEqual(self.loop.profiler, None)
+        self.loop.schedule(0.01, quick)
+        self.loop.schedule(0.02, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(self.profiler.stats, {})
+
+    def test_dump_on(self):
+        out = StringIO()
+        self.profiler.record(quick, 0.001)
+        self.profiler.dump_on(signal.SIGUSR1, out)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+        finally:
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        self.assertTrue(out.getvalue().startswith(
+            "Thor loop profile: 1 calls"))
+
+
+class TestWatchdog(unittest.TestCase):
+
+    def test_stall(self):
+        loop = thor.loop.make(precision=.01)
+        stalls = []
+        watchdog = Watchdog(loop, 0.1, lambda *args: stalls.append(args))
+        def blocker():
+            time.sleep(0.3)
+        loop.schedule(0.05, blocker)
+        loop.schedule(0.5, loop.stop)
+        loop.run()
+        watchdog.stop()
+        self.assertEqual(len(stalls), 1)
+        self.assertTrue("in blocker" in stalls[0][0])
+        self.assertTrue(stalls[0][1] >= 0.1)
+
+    def test_no_stall(self):
+        loop = thor.loop.make(precision=.01)
+        stalls = []
+        watchdog = Watchdog(loop, 0.1, lambda *args: stalls.append(args))
+        loop.schedule(0.3, loop.stop)
+        loop.run()
+        watchdog.stop()
+        self.assertEqual(stalls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 
 import errno
+import mmap
+import os
 import socket
 import SocketServer
 import sys
+import tempfile
 import threading
 import unittest
 
-from thor import loop
-from thor.tcp import TcpClient
+from thor import loop, tcp
+from thor.tcp import TcpClient, TcpConnection
 
 test_host = "127.0.0.1"
 test_port = 9002
@@ -101,6 +104,127 @@ class TestTcpClientConnect(unittest.TestCase):
         self.assertEqual(self.last_error, errno.ETIMEDOUT)
         self.assertEqual(self.timeout_hit, False)
 
+
+class TestTcpConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = loop.make()
+        sock, self.other = socket.socketpair()
+        sock.setblocking(False)
+        self.conn = TcpConnection(sock, test_host, test_port, self.loop)
+
+    def tearDown(self):
+        self.other.close()
+        if self.conn.tcp_connected:
+            self.conn.close()
+
+    def test_peek_open(self):
+        self.assertFalse(self.conn.peek_closed())
+
+    def test_peek_closed(self):
+        self.other.close()
+        self.assertTrue(self.conn.peek_closed())
+
+    def test_peek_data(self):
+        self.other.send("x")
+        self.assertTrue(self.conn.peek_closed())
+        self.assertEqual(self.conn.socket.recv(1), "x")
+
+    def test_write_buffers(self):
+        data = "0123456789" * 1000
+        self.conn.write("a")
+        self.conn.write("b")
+        self.conn.write(buffer(data, 10))
+        self.conn.write("c")
+        while self.conn._write_buffer:
+            self.conn.handle_write()
+        received = ""
+        while len(received) < len(data) - 10 + 3:
+            received += self.other.recv(65536)
+        self.assertEqual(received, "ab" + data[10:] + "c")
+
+    def write_file(self, data, offset, length):
+        "Write part of a file with data in it, and return what's received."
+        fileobj = tempfile.TemporaryFile()
+        fileobj.write(data)
+        fileobj.flush()
+        self.conn.write("<")
+        self.conn.write_file(fileobj, offset, length)
+        self.conn.write(">")
+        fileobj.close() # it's safe to close it straight away
+        while self.conn._write_buffer:
+            self.conn.handle_write()
+        received = ""
+        while len(received) < length + 2:
+            received += self.other.recv(65536)
+        return received
+
+    def test_write_file_mmap(self):
+        orig_sendfile = tcp.sendfile
+        tcp.sendfile = None
+        try:
+            data = os.urandom(mmap.ALLOCATIONGRANULARITY * 3)
+            offset = mmap.ALLOCATIONGRANULARITY + 5
+            self.assertEqual(self.write_file(data, offset, 5000),
+                             "<" + data[offset:offset + 5000] + ">")
+        finally:
+            tcp.sendfile = orig_sendfile
+
+    def test_write_file_sendfile(self):
+        calls = []
+        def fake_sendfile(out_fd, in_fd, offset, count):
+            # only send a bit at a time, to check that it carries on.
+            calls.append((offset, count))
+            os.lseek(in_fd, offset, 0)
+            return os.write(out_fd, os.read(in_fd, min(count, 1000)))
+        orig_sendfile = tcp.sendfile
+        tcp.sendfile = fake_sendfile
+        try:
+            data = os.urandom(5000)
+            self.assertEqual(self.write_file(data, 100, 4500),
+                             "<" + data[100:4600] + ">")
+            self.assertEqual(calls[0], (100, 4500))
+            self.assertEqual(calls[-1], (4100, 500))
+        finally:
+            tcp.sendfile = orig_sendfile
+
+    def test_protocol(self):
+        calls = []
+        class Protocol(object):
+            def data_received(self, data):
+                calls.append(('data', data))
+            def connection_lost(self):
+                calls.append(('lost',))
+            def pause_writing(self, paused):
+                calls.append(('pause', paused))
+        self.conn.protocol = Protocol()
+        self.conn.on('data', lambda data: calls.append(('data event',)))
+        self.conn.on('pause', lambda paused: calls.append(('pause event',)))
+        self.conn.on('close', lambda: calls.append(('close event',)))
+        self.other.send("hi")
+        self.conn.handle_read()
+        for i in range(self.conn.write_bufsize + 1):
+            self.conn.write("x")
+        while self.conn._write_buffer:
+            self.conn.handle_write()
+        self.other.close()
+        self.conn.handle_read()
+        self.assertEqual(calls, [
+            ('data', "hi"),
+            ('pause', True), ('pause event',),
+            ('pause', False), ('pause event',),
+            ('lost',), ('close event',)
+        ])
+
+    def test_protocol_local_close(self):
+        lost = []
+        class Protocol(object):
+            def connection_lost(self):
+                lost.append(True)
+        self.conn.protocol = Protocol()
+        self.conn.close()
+        self.assertEqual(lost, [])
+
 # TODO:
 #   def test_pause(self):
 
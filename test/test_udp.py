@@ -66,6 +66,69 @@ class TestUdpEndpoint(unittest.TestCase):
         self.loop.schedule(4, check)
         self.loop.run()
 
+    def test_datagrams(self):
+        batches = []
+        def input_batch(batch):
+            batches.append([(data.tobytes(), addr) for data, addr in batch])
+        self.ep1.on('datagrams', input_batch)
+        self.loop.schedule(1, self.ep2.send_many,
+            ['foo!', 'bar!', 'baz!'], test_host, test_port
+        )
+
+        def check():
+            got = sum(batches, [])
+            self.assertEqual([d for d, a in got], ['foo!', 'bar!', 'baz!'])
+            self.assertEqual(got[0][1][0], test_host)
+            self.assertEqual(self.datagrams, [])
+            self.loop.stop()
+        self.loop.schedule(2, check)
+        self.loop.run()
+
+    def test_datagrams_copy(self):
+        # what Python 2.6, which has no memoryview, gets
+        batches = []
+        self.ep1.on('datagrams', batches.append)
+        self.ep1._handle_batch_copy()
+        self.assertEqual(batches, [])
+        self.ep2.send('foo!', test_host, test_port)
+        self.ep2.send('bar!', test_host, test_port)
+        def check():
+            got = sum(batches, [])
+            self.assertEqual([d for d, a in got], ['foo!', 'bar!'])
+            self.assertEqual(got[0][1][0], test_host)
+            self.loop.stop()
+        self.loop.schedule(1, check)
+        self.ep1._handle_batch = self.ep1._handle_batch_copy
+        self.loop.run()
+
+    def test_send_many_blocked(self):
+        ep = UdpEndpoint(self.loop)
+        ep.send_bufsize = 2
+        pauses = []
+        ep.on('pause', pauses.append)
+        real_sendto = ep.sock.sendto
+        self.blocked = False
+        def sendto(datagram, addr):
+            if self.blocked:
+                raise socket.error(errno.EAGAIN, "blocked")
+            # the first goes out, then the socket buffer is full
+            self.blocked = True
+            return real_sendto(datagram, addr)
+        ep.sock.sendto = sendto
+        ep.send_many(['a', 'b', 'c', 'd'], test_host, test_port)
+        self.assertEqual(pauses, [True])
+        self.assertEqual([d for d, a in ep._send_queue], ['b', 'c', 'd'])
+        ep.sock.sendto = real_sendto
+
+        def check():
+            self.assertEqual(pauses, [True, False])
+            self.assertEqual([d[0] for d in self.datagrams],
+                             ['a', 'b', 'c', 'd'])
+            ep.shutdown()
+            self.loop.stop()
+        self.loop.schedule(1, check)
+        self.loop.run()
+
 #   def test_pause(self):
 
 
@@ -0,0 +1,873 @@
+#!/usr/bin/env python
+
+"""
+Thor asyncio Bridge
+
+Lets Thor and asyncio (or trollius, its Python 2 port) code share a process
+and a thread:
+
+* AsyncioLoop is a Thor loop that runs on an asyncio event loop, so Thor
+  connections, servers and clients can be used alongside asyncio libraries.
+
+* ThorEventLoop is an asyncio event loop that runs on a Thor loop, so
+  coroutines and asyncio libraries can be used alongside Thor code.
+
+Both need asyncio or trollius to be installed.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from collections import deque
+import errno
+import logging
+import os
+import socket
+import thread
+import time as systime
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio # for Python 2
+    except ImportError:
+        asyncio = None
+
+import thor
+from thor.loop import LoopBase, EventSource
+
+logger = logging.getLogger(__name__)
+
+
+def _check():
+    if asyncio is None:
+        raise ImportError("thor.aio needs asyncio or trollius")
+
+
+class _Timer(object):
+    "What AsyncioLoop.schedule returns."
+    def __init__(self, handle, timers):
+        self._handle = handle
+        self._timers = timers
+
+    def delete(self):
+        self._handle.cancel()
+        self._timers.discard(self._handle)
+
+
+class AsyncioLoop(LoopBase):
+    """
+    A Thor loop that runs on aio_loop (by default, asyncio's current
+    event loop).
+
+    File descriptors are watched with aio_loop's add_reader and
+    add_writer, and scheduled events use its call_later, so their
+    precision is aio_loop's, not precision's.
+    """
+
+    def __init__(self, precision=None, aio_loop=None):
+        _check()
+        LoopBase.__init__(self, precision)
+        self.aio_loop = aio_loop or asyncio.get_event_loop()
+        self._timers = set()
+        self._runs_aio_loop = False # whether run() started aio_loop
+
+    def run(self):
+        "Start the loop (and aio_loop, if it isn't already running)."
+        self.running = True
+        self.thread_id = thread.get_ident()
+        self.emit('start')
+        if self.running and not self.aio_loop.is_running():
+            self._runs_aio_loop = True
+            try:
+                self.aio_loop.run_forever()
+            finally:
+                self._runs_aio_loop = False
+
+    def stop(self):
+        """
+        Stop the loop (and aio_loop, if run() started it), forgetting its
+        fds and events.
+        """
+        for handle in self._timers:
+            handle.cancel()
+        self._timers = set()
+        self.running = False
+        for fd in self._fd_targets.keys():
+            self.unregister_fd(fd)
+        if self._runs_aio_loop:
+            self.aio_loop.stop()
+        self.emit('stop')
+
+    def register_fd(self, fd, events, target):
+        self._fd_targets[fd] = target
+        for event in events:
+            self.event_add(fd, event)
+
+    def unregister_fd(self, fd):
+        self.aio_loop.remove_reader(fd)
+        self.aio_loop.remove_writer(fd)
+        del self._fd_targets[fd]
+
+    def event_add(self, fd, event):
+        # asyncio doesn't report 'close' or 'error' separately; sockets
+        # become readable and the read fails instead.
+        if event == 'readable':
+            self.aio_loop.add_reader(fd, self._dispatch, event, fd)
+        elif event == 'writable':
+            self.aio_loop.add_writer(fd, self._dispatch, event, fd)
+
+    def event_del(self, fd, event):
+        if event == 'readable':
+            self.aio_loop.remove_reader(fd)
+        elif event == 'writable':
+            self.aio_loop.remove_writer(fd)
+
+    def _dispatch(self, event, fd):
+        self.iterations += 1
+        self._fd_event(event, fd)
+
+    def schedule(self, delta, callback, *args):
+        def cb():
+            self._timers.discard(handle)
+            self.iterations += 1
+            if self.profiler:
+                self.profiler.run(callback, *args)
+            else:
+                callback(*args)
+        cb.__name__ = callback.__name__
+        cb.callback = callback
+        handle = self.aio_loop.call_later(max(delta, 0), cb)
+        self._timers.add(handle)
+        return _Timer(handle, self._timers)
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.aio_loop.call_soon_threadsafe(callback, *args)
+
+    def time(self):
+        return systime.time()
+
+    def now(self):
+        return self.aio_loop.time()
+
+    def update_time(self):
+        pass
+
+
+class _FdWatcher(EventSource):
+    "Emits events for a file descriptor that a ThorEventLoop is watching."
+    def __init__(self, loop, fd):
+        EventSource.__init__(self, loop)
+        self.handles = {} # event: asyncio Handle
+        self.register_fd(fd)
+
+    def watch(self, event, handle):
+        self.handles[event] = handle
+        self.removeListeners(event)
+        self.on(event, handle._run)
+        self.event_add(event)
+
+    def unwatch(self, event):
+        "Stop watching for event; returns False if it wasn't being watched."
+        handle = self.handles.pop(event, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        self.removeListeners(event)
+        self.event_del(event)
+        if not self.handles:
+            self.unregister_fd()
+        return True
+
+
+if asyncio is not None:
+    _AbstractEventLoop = asyncio.AbstractEventLoop
+    _ensure_future = getattr(asyncio, 'ensure_future', None) or \
+                     getattr(asyncio, 'async')
+    _Transport = asyncio.Transport
+    _AbstractServer = asyncio.AbstractServer
+else:
+    _AbstractEventLoop = _Transport = _AbstractServer = object
+
+
+class ThorEventLoop(_AbstractEventLoop):
+    """
+    An asyncio event loop that runs on loop (by default, Thor's default
+    loop), so that Thor and asyncio code can run together:
+
+    > asyncio.set_event_loop(ThorEventLoop(loop))
+
+    Callbacks and timers run between Thor's own events, and readers and
+    writers are watched by Thor.
+
+    Note that stopping it stops the Thor loop, which forgets everything
+    that's scheduled or being watched; asyncio's own timers, readers and
+    writers are put back when it's run again, but Thor's aren't.
+    """
+
+    def __init__(self, loop=None):
+        _check()
+        self.thor_loop = loop or thor.loop.get_loop()
+        self._ready = deque() # asyncio Handles to run
+        self._waking = False # whether _run_ready is due to run
+        self._timers = {} # TimerHandle: thor event
+        self._watchers = {} # fd: _FdWatcher
+        self._closed = False
+        self._debug = False
+        self._exception_handler = None
+        self._executor = None
+
+    def __repr__(self):
+        return "<%s.%s on %r at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.thor_loop, id(self))
+
+    # running and stopping
+
+    def run_forever(self):
+        if self._closed:
+            raise RuntimeError("Event loop is closed")
+        if self.thor_loop.running:
+            raise RuntimeError("Event loop is running.")
+        self._restore()
+        self.thor_loop.run()
+
+    def run_until_complete(self, future):
+        future = _ensure_future(future, loop=self)
+        future.add_done_callback(lambda fut: self.stop())
+        self.run_forever()
+        if not future.done():
+            raise RuntimeError("Event loop stopped before Future completed.")
+        return future.result()
+
+    def _restore(self):
+        "Put back the watchers and timers that stopping the Thor loop forgot."
+        for fd, watcher in self._watchers.items():
+            if self.thor_loop._fd_targets.get(fd) is not watcher:
+                self._watchers[fd] = _FdWatcher(self.thor_loop, fd)
+                for event, handle in watcher.handles.items():
+                    self._watchers[fd].watch(event, handle)
+        now = self.time()
+        for handle, event in self._timers.items():
+            event.delete() # in case the Thor loop wasn't stopped
+            self._timers[handle] = self.thor_loop.schedule(
+                max(handle._when - now, 0), self._run_timer, handle)
+
+    def stop(self):
+        self.thor_loop.stop()
+
+    def is_running(self):
+        return self.thor_loop.running
+
+    def is_closed(self):
+        return self._closed
+
+    def close(self):
+        if self.is_running():
+            raise RuntimeError("Cannot close a running event loop")
+        self._closed = True
+        self._ready.clear()
+        for event in self._timers.values():
+            event.delete()
+        self._timers.clear()
+        for watcher in self._watchers.values():
+            for event in watcher.handles.keys():
+                watcher.unwatch(event)
+        self._watchers.clear()
+
+    # callbacks and timers
+
+    def time(self):
+        return self.thor_loop.now()
+
+    def call_soon(self, callback, *args):
+        handle = asyncio.Handle(callback, args, self)
+        self._ready.append(handle)
+        if not self._waking:
+            self._waking = True
+            # runs on the next trip around the Thor loop, never right away
+            self.thor_loop.call_soon_threadsafe(self._run_ready)
+        return handle
+
+    def call_soon_threadsafe(self, callback, *args):
+        handle = asyncio.Handle(callback, args, self)
+        self.thor_loop.call_soon_threadsafe(self._run_handle, handle)
+        return handle
+
+    def _run_ready(self):
+        "Run the callbacks that were ready when this was called."
+        self._waking = False
+        ready = self._ready
+        for i in xrange(len(ready)):
+            handle = ready.popleft()
+            if not handle._cancelled:
+                handle._run()
+        if ready and not self._waking:
+            self._waking = True
+            self.thor_loop.call_soon_threadsafe(self._run_ready)
+
+    def _run_handle(self, handle):
+        if not handle._cancelled:
+            handle._run()
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        handle = asyncio.TimerHandle(when, callback, args, self)
+        self._timers[handle] = self.thor_loop.schedule(
+            max(when - self.time(), 0), self._run_timer, handle)
+        return handle
+
+    def _run_timer(self, handle):
+        self._timers.pop(handle, None)
+        if not handle._cancelled:
+            handle._run()
+
+    def _timer_handle_cancelled(self, handle):
+        event = self._timers.pop(handle, None)
+        if event is not None:
+            event.delete()
+
+    # futures and tasks
+
+    def create_future(self):
+        return asyncio.Future(loop=self)
+
+    def create_task(self, coro):
+        return asyncio.Task(coro, loop=self)
+
+    def run_in_executor(self, executor, func, *args):
+        """
+        Run func on executor (a concurrent.futures executor) or, if it's
+        None, the Thor loop's pool (see thor.loop.run_in_pool).
+        """
+        executor = executor or self._executor
+        if executor is not None:
+            return asyncio.wrap_future(
+                executor.submit(func, *args), loop=self)
+        future = self.create_future()
+        def done(result):
+            if not future.cancelled():
+                future.set_result(result)
+        def error(err):
+            if not future.cancelled():
+                future.set_exception(err)
+        job = self.thor_loop.run_in_pool(func, *args)
+        job.on('done', done)
+        job.on('error', error)
+        return future
+
+    def set_default_executor(self, executor):
+        self._executor = executor
+
+    # file descriptors
+
+    def _watch(self, fd, event, callback, args):
+        fd = getattr(fd, 'fileno', lambda: fd)()
+        watcher = self._watchers.get(fd)
+        # stopping the Thor loop makes it forget about watchers.
+        if watcher is None or \
+          self.thor_loop._fd_targets.get(fd) is not watcher:
+            watcher = self._watchers[fd] = _FdWatcher(self.thor_loop, fd)
+        watcher.watch(event, asyncio.Handle(callback, args, self))
+
+    def _unwatch(self, fd, event):
+        fd = getattr(fd, 'fileno', lambda: fd)()
+        watcher = self._watchers.get(fd)
+        if watcher is None:
+            return False
+        removed = watcher.unwatch(event)
+        if not watcher.handles:
+            del self._watchers[fd]
+        return removed
+
+    def add_reader(self, fd, callback, *args):
+        self._watch(fd, 'readable', callback, args)
+
+    def remove_reader(self, fd):
+        return self._unwatch(fd, 'readable')
+
+    def add_writer(self, fd, callback, *args):
+        self._watch(fd, 'writable', callback, args)
+
+    def remove_writer(self, fd):
+        return self._unwatch(fd, 'writable')
+
+    # sockets
+
+    _block_errs = set([errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR])
+
+    def _sock_io(self, sock, event, attempt, wait=False):
+        """
+        Return a future for the result of attempt(), which is called right
+        away (unless wait is True) and then whenever sock is event
+        ('readable' or 'writable'), until it returns (True, result) or
+        raises an error.
+        """
+        future = self.create_future()
+        watching = [False]
+        def step():
+            if future.cancelled():
+                self._unwatch(sock, event)
+                return
+            try:
+                done, result = attempt()
+            except Exception, why:
+                if isinstance(why, socket.error) and \
+                  why[0] in self._block_errs:
+                    done, result = False, None
+                else:
+                    self._unwatch(sock, event)
+                    future.set_exception(why)
+                    return
+            if done:
+                if watching[0]:
+                    self._unwatch(sock, event)
+                future.set_result(result)
+            elif not watching[0]:
+                watching[0] = True
+                self._watch(sock, event, step, ())
+        if wait:
+            watching[0] = True
+            self._watch(sock, event, step, ())
+        else:
+            step()
+        return future
+
+    def sock_recv(self, sock, nbytes):
+        return self._sock_io(sock, 'readable',
+                             lambda: (True, sock.recv(nbytes)))
+
+    def sock_sendall(self, sock, data):
+        remaining = [data]
+        def send():
+            sent = sock.send(remaining[0])
+            remaining[0] = remaining[0][sent:]
+            return not remaining[0], None
+        return self._sock_io(sock, 'writable', send)
+
+    def sock_connect(self, sock, address):
+        """
+        Connect sock to address, which has to be resolved already (see
+        getaddrinfo).
+        """
+        err = sock.connect_ex(address)
+        if err in [errno.EINPROGRESS, errno.EWOULDBLOCK]:
+            def connected():
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise socket.error(err, os.strerror(err))
+                return True, None
+            return self._sock_io(sock, 'writable', connected, wait=True)
+        future = self.create_future()
+        if err:
+            future.set_exception(socket.error(err, os.strerror(err)))
+        else:
+            future.set_result(None)
+        return future
+
+    def sock_accept(self, sock):
+        def accept():
+            conn, address = sock.accept()
+            conn.setblocking(False)
+            return True, (conn, address)
+        return self._sock_io(sock, 'readable', accept)
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        "Look up host and port with run_in_executor."
+        return self.run_in_executor(None, socket.getaddrinfo,
+                                    host, port, family, type, proto, flags)
+
+    def getnameinfo(self, sockaddr, flags=0):
+        return self.run_in_executor(None, socket.getnameinfo, sockaddr, flags)
+
+    def _chain(self, future, callback, result):
+        """
+        When future is done, call callback with its result; if it fails,
+        or callback raises an error, fail result with the error.
+        """
+        def done(future):
+            if result.cancelled():
+                return
+            try:
+                callback(future.result())
+            except Exception, why:
+                if not result.done():
+                    result.set_exception(why)
+        future.add_done_callback(done)
+
+    def create_connection(self, protocol_factory, host=None, port=None,
+                          ssl=None, family=0, proto=0, flags=0, sock=None,
+                          local_addr=None, server_hostname=None):
+        """
+        Connect to host and port (or use the connected sock), trying each
+        of its addresses in turn, and return a future for a (transport,
+        protocol) tuple. SSL isn't supported.
+        """
+        if ssl:
+            raise NotImplementedError("ThorEventLoop doesn't support SSL")
+        result = self.create_future()
+        def attach(sock):
+            sock.setblocking(False)
+            protocol = protocol_factory()
+            transport = _SocketTransport(self, sock, protocol)
+            result.set_result((transport, protocol))
+        if sock is not None:
+            attach(sock)
+            return result
+        def try_next(infos, last_err):
+            if not infos:
+                result.set_exception(last_err or socket.error(
+                    "getaddrinfo returned an empty list"))
+                return
+            af, socktype, proto, cname, address = infos[0]
+            sock = socket.socket(af, socktype, proto)
+            sock.setblocking(False)
+            def connected(future):
+                if result.cancelled():
+                    sock.close()
+                elif future.exception() is not None:
+                    sock.close()
+                    try_next(infos[1:], future.exception())
+                else:
+                    attach(sock)
+            try:
+                if local_addr is not None:
+                    sock.bind(local_addr)
+                self.sock_connect(sock, address).add_done_callback(connected)
+            except socket.error, why:
+                sock.close()
+                try_next(infos[1:], why)
+        self._chain(self.getaddrinfo(host, port, family, socket.SOCK_STREAM,
+                                     proto, flags),
+                    lambda infos: try_next(infos, None), result)
+        return result
+
+    def create_server(self, protocol_factory, host=None, port=None,
+                      family=socket.AF_UNSPEC, flags=socket.AI_PASSIVE,
+                      sock=None, backlog=100, ssl=None, reuse_address=None):
+        """
+        Listen on host and port (every interface, if host is None) or the
+        listening sock, and return a future for a server; each connection
+        accepted gets a protocol from protocol_factory. SSL isn't supported.
+        """
+        if ssl:
+            raise NotImplementedError("ThorEventLoop doesn't support SSL")
+        result = self.create_future()
+        if sock is not None:
+            result.set_result(_Server(self, [sock], protocol_factory))
+            return result
+        if reuse_address is None:
+            reuse_address = os.name == 'posix'
+        def listen(infos):
+            socks = []
+            try:
+                for af, socktype, proto, cname, address in set(infos):
+                    sock = socket.socket(af, socktype, proto)
+                    socks.append(sock)
+                    if reuse_address:
+                        sock.setsockopt(
+                            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if af == getattr(socket, 'AF_INET6', None):
+                        sock.setsockopt(socket.IPPROTO_IPV6,
+                                        socket.IPV6_V6ONLY, 1)
+                    sock.bind(address)
+                    sock.listen(backlog)
+            except Exception:
+                for sock in socks:
+                    sock.close()
+                raise
+            result.set_result(_Server(self, socks, protocol_factory))
+        self._chain(self.getaddrinfo(host, port, family, socket.SOCK_STREAM,
+                                     0, flags),
+                    listen, result)
+        return result
+
+    # errors and debugging
+
+    def get_exception_handler(self):
+        return self._exception_handler
+
+    def set_exception_handler(self, handler):
+        self._exception_handler = handler
+
+    def default_exception_handler(self, context):
+        message = context.get('message') or "Unhandled exception in event loop"
+        exception = context.get('exception')
+        if exception is not None:
+            exc_info = (type(exception), exception,
+                        getattr(exception, '__traceback__', None))
+        else:
+            exc_info = False
+        details = ["%s: %r" % (key, context[key]) for key in sorted(context)
+                   if key not in ['message', 'exception']]
+        logger.error("\n".join([message] + details), exc_info=exc_info)
+
+    def call_exception_handler(self, context):
+        if self._exception_handler is None:
+            self.default_exception_handler(context)
+        else:
+            try:
+                self._exception_handler(self, context)
+            except Exception:
+                logger.error("Exception in event loop's exception handler",
+                             exc_info=True)
+
+    def get_debug(self):
+        return self._debug
+
+    def set_debug(self, enabled):
+        self._debug = enabled
+
+
+class _SocketTransport(_Transport):
+    "What ThorEventLoop.create_connection and create_server make."
+
+    max_size = 256 * 1024 # bytes to read at a time
+
+    def __init__(self, loop, sock, protocol):
+        _Transport.__init__(self)
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._extra = {'socket': sock}
+        try:
+            self._extra['sockname'] = sock.getsockname()
+            self._extra['peername'] = sock.getpeername()
+        except socket.error:
+            pass
+        self._buffer = deque()
+        self._buffer_size = 0
+        self._high_water = 64 * 1024
+        self._low_water = 16 * 1024
+        self._protocol_paused = False
+        self._reading = True
+        self._closing = False
+        self._eof = False
+        self._conn_lost = False
+        loop.call_soon(protocol.connection_made, self)
+        loop.call_soon(self._start_reading)
+
+    def __repr__(self):
+        return "<%s.%s for %s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self._extra.get('peername'), id(self))
+
+    def get_extra_info(self, name, default=None):
+        return self._extra.get(name, default)
+
+    def is_closing(self):
+        return self._closing
+
+    # reading
+
+    def _start_reading(self):
+        if self._reading and not self._closing:
+            self._loop.add_reader(self._sock, self._read_ready)
+
+    def pause_reading(self):
+        self._reading = False
+        self._loop.remove_reader(self._sock)
+
+    def resume_reading(self):
+        if not self._reading:
+            self._reading = True
+            self._start_reading()
+
+    def _read_ready(self):
+        try:
+            data = self._sock.recv(self.max_size)
+        except socket.error, why:
+            if why[0] not in ThorEventLoop._block_errs:
+                self._force_close(why)
+            return
+        if data:
+            self._protocol.data_received(data)
+            return
+        self._loop.remove_reader(self._sock)
+        if not self._protocol.eof_received():
+            self.close()
+
+    # writing
+
+    def write(self, data):
+        if self._eof:
+            raise RuntimeError("Cannot call write() after write_eof()")
+        if not data or self._conn_lost:
+            return
+        if not self._buffer:
+            try:
+                sent = self._sock.send(data)
+            except socket.error, why:
+                if why[0] not in ThorEventLoop._block_errs:
+                    self._force_close(why)
+                    return
+                sent = 0
+            data = data[sent:]
+            if not data:
+                return
+            self._loop.add_writer(self._sock, self._write_ready)
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if not self._protocol_paused and \
+          self._buffer_size > self._high_water:
+            self._protocol_paused = True
+            self._protocol.pause_writing()
+
+    def _write_ready(self):
+        data = "".join(self._buffer)
+        self._buffer.clear()
+        try:
+            sent = self._sock.send(data)
+        except socket.error, why:
+            if why[0] not in ThorEventLoop._block_errs:
+                self._buffer_size = 0
+                self._force_close(why)
+                return
+            sent = 0
+        data = data[sent:]
+        self._buffer_size = len(data)
+        if data:
+            self._buffer.append(data)
+        if self._protocol_paused and self._buffer_size <= self._low_water:
+            self._protocol_paused = False
+            self._protocol.resume_writing()
+        if data:
+            return
+        self._loop.remove_writer(self._sock)
+        if self._closing:
+            self._call_connection_lost(None)
+        elif self._eof:
+            self._sock.shutdown(socket.SHUT_WR)
+
+    def get_write_buffer_size(self):
+        return self._buffer_size
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if high is None:
+            high = 64 * 1024 if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError("high (%r) must be >= low (%r) must be >= 0" %
+                             (high, low))
+        self._high_water, self._low_water = high, low
+
+    def can_write_eof(self):
+        return True
+
+    def write_eof(self):
+        if self._eof:
+            return
+        self._eof = True
+        if not self._buffer:
+            self._sock.shutdown(socket.SHUT_WR)
+
+    # closing
+
+    def close(self):
+        "Close once everything written so far has been sent."
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._sock)
+        if not self._buffer:
+            self._conn_lost = True
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self._force_close(None)
+
+    def _force_close(self, exc):
+        if self._conn_lost:
+            return
+        self._conn_lost = True
+        self._closing = True
+        self._buffer.clear()
+        self._buffer_size = 0
+        self._loop.remove_reader(self._sock)
+        self._loop.remove_writer(self._sock)
+        self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc):
+        self._conn_lost = True
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._sock.close()
+            self._sock = self._protocol = None
+
+
+class _Server(_AbstractServer):
+    "What ThorEventLoop.create_server returns."
+
+    def __init__(self, loop, sockets, protocol_factory):
+        self._loop = loop
+        self.sockets = sockets
+        self._protocol_factory = protocol_factory
+        self._waiters = []
+        for sock in sockets:
+            sock.setblocking(False)
+            loop.add_reader(sock, self._accept, sock)
+
+    def __repr__(self):
+        return "<%s.%s on %s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__,
+            [sock.getsockname() for sock in self.sockets or []], id(self))
+
+    def _accept(self, sock):
+        try:
+            conn, address = sock.accept()
+        except socket.error, why:
+            if why[0] in ThorEventLoop._block_errs or \
+              why[0] == errno.ECONNABORTED:
+                return
+            self._loop.call_exception_handler({
+                'message': "Error accepting a connection",
+                'exception': why,
+                'socket': sock,
+            })
+            return
+        conn.setblocking(False)
+        _SocketTransport(self._loop, conn, self._protocol_factory())
+
+    def close(self):
+        "Stop listening; connections already accepted stay open."
+        if self.sockets is None:
+            return
+        for sock in self.sockets:
+            self._loop.remove_reader(sock)
+            sock.close()
+        self.sockets = None
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+    def wait_closed(self):
+        waiter = self._loop.create_future()
+        if self.sockets is None:
+            waiter.set_result(None)
+        else:
+            self._waiters.append(waiter)
+        return waiter
@@ -30,28 +30,55 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-from collections import defaultdict
-
-
 class EventEmitter(object):
     """
     An event emitter, in the style of Node.JS.
+
+    Listeners are stored in a dictionary that's only created when the first
+    one is added. Subclasses that are created in large numbers can define
+    __slots__ for their own attributes; other attributes can still be set,
+    but they're kept in a dictionary that's only created when needed.
     """
 
+    __slots__ = ('__events', '__sink', '__sink_methods',
+                 '__dict__', '__weakref__')
+
     def __init__(self):
-        self.__events = defaultdict(list)
+        self.__events = None # event: [listener, ...]
         self.__sink = None
+        self.__sink_methods = None # event: sink method (or None)
 
     def __getstate__(self):
-        state = self.__dict__.copy()
-        del state["_EventEmitter__events"]
+        state = {}
+        for cls in self.__class__.__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name.startswith('__') and not name.endswith('__'):
+                    name = "_%s%s" % (cls.__name__.lstrip('_'), name)
+                if hasattr(self, name) and name not in state:
+                    state[name] = getattr(self, name)
+        for name in ['__dict__', '__weakref__', '_EventEmitter__events',
+                     '_EventEmitter__sink', '_EventEmitter__sink_methods']:
+            state.pop(name, None)
+        state.update(getattr(self, '__dict__', {}))
         return state
 
+    def __setstate__(self, state):
+        EventEmitter.__init__(self)
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def on(self, event, listener):
         """
         Call listener when event is emitted.
         """
-        self.__events[event].append(listener)
+        events = self.__events
+        if events is None:
+            events = self.__events = {}
+        listeners = events.get(event)
+        if listeners is None:
+            events[event] = [listener]
+        else:
+            listeners.append(listener)
         self.emit('newListener', event, listener)
 
     def once(self, event, listener):
@@ -70,7 +97,8 @@ class EventEmitter(object):
         If called for a specific listener by a previous listener
         for the same event, that listener will not be fired.
         """
-        self.__events.get(event, [listener]).remove(listener)
+        if self.__events:
+            self.__events.get(event, [listener]).remove(listener)
 
     def removeListeners(self, *events):
         """
@@ -81,34 +109,46 @@ class EventEmitter(object):
         for that event will still be fired.
         """
         if events:
-            for event in events:
-                self.__events[event] = []
+            if self.__events:
+                for event in events:
+                    self.__events.pop(event, None)
         else:
-            self.__events = defaultdict(list)
+            self.__events = None
 
     def listeners(self, event):
         """
         Return a list of listeners for an event.
         """
-        return self.__events.get(event, [])
+        return (self.__events or {}).get(event, [])
 
     def events(self):
         """
         Return a list of events being listened for.
         """
-        return self.__events.keys()
+        return (self.__events or {}).keys()
 
     def emit(self, event, *args):
         """
         Emit the event (with any given args) to
         its listeners.
         """
-        events = self.__events.get(event, [])
-        if len(events):
-            for e in events:
-                e(*args)
-        else:
-            sink_event = getattr(self.__sink, event, None)
+        events = self.__events
+        listeners = events and events.get(event)
+        if listeners:
+            if len(listeners) == 1:
+                listeners[0](*args)
+            else:
+                for listener in listeners:
+                    listener(*args)
+        elif self.__sink is not None:
+            methods = self.__sink_methods
+            if methods is None:
+                methods = self.__sink_methods = {}
+            try:
+                sink_event = methods[event]
+            except KeyError:
+                sink_event = methods[event] = \
+                    getattr(self.__sink, event, None)
             if sink_event:
                 sink_event(*args)
 
@@ -117,8 +157,11 @@ class EventEmitter(object):
         If no listeners are found for an event, call
         the method that shares the event's name (if present)
         on the event sink.
+
+        The sink's methods are looked up once for each event.
         """
         self.__sink = sink
+        self.__sink_methods = None
 
     # TODO: event bubbling
 
@@ -2,5 +2,8 @@
 
 from thor.http.client import HttpClient
 from thor.http.server import HttpServer
+from thor.http.proxy import HttpProxy
+from thor.http.cache import HttpCache
+from thor.http.metrics import MetricsServer
 from thor.http.common import header_names, header_dict, get_header, \
   safe_methods, idempotent_methods, hop_by_hop_hdrs
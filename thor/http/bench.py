@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Load Generator
+
+This puts load on an HTTP server and reports how it copes, e.g.:
+
+  python -m thor.http.bench -c 50 -d 30 http://127.0.0.1:8000/
+
+Closed-loop load keeps a fixed number of requests outstanding; open-loop
+load (with --rate) sends requests at a constant rate, whether or not the
+server keeps up. Latencies are corrected for coordinated omission: in
+open-loop mode they're measured from when each request should have been
+sent, and in closed-loop mode, requests that the server's stalls kept us
+from sending are accounted for when reporting.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from collections import deque
+import json
+import math
+import multiprocessing
+from optparse import OptionParser
+import sys
+import time as systime
+
+import thor
+from thor.tcp import TcpClient
+from thor.http.client import HttpClient, split_uri
+from thor.http.common import HttpMessageHandler, no_body_status
+
+
+class LatencyHistogram(object):
+    """
+    Counts latencies (in seconds) in logarithmic buckets, so that any
+    percentile can be reported to within precision (as a fraction), using
+    a fixed amount of memory however many are recorded. Histograms from
+    different processes can be merged.
+    """
+
+    def __init__(self, precision=0.01):
+        self.precision = precision
+        self._log_base = math.log(1 + precision)
+        self.counts = {} # bucket: count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<%s.%s count=%s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.count, id(self))
+
+    def _bucket(self, value):
+        micros = value * 1000000
+        if micros < 1:
+            return 0
+        return int(math.log(micros) / self._log_base)
+
+    def _value(self, bucket):
+        return math.exp((bucket + 0.5) * self._log_base) / 1000000
+
+    def record(self, value, count=1):
+        "Record value, count times."
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def corrected(self, interval):
+        """
+        Return a copy corrected for coordinated omission, given that a
+        request would have been sent every interval seconds if the server
+        hadn't made us wait: for each latency longer than that, the
+        requests that weren't sent in the meantime are added, with the
+        latencies they'd have seen.
+        """
+        out = LatencyHistogram(self.precision)
+        out.merge(self)
+        if interval <= 0:
+            return out
+        for bucket, count in self.counts.items():
+            value = self._value(bucket)
+            missing = value - interval
+            while missing >= interval:
+                out.record(missing, count)
+                missing -= interval
+        return out
+
+    def merge(self, other):
+        "Add the values recorded by other."
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.count and self.total / self.count or 0
+
+    def percentile(self, pct):
+        "Return the pct percentile of the values recorded."
+        if not self.count:
+            return 0
+        wanted = max(1, int(math.ceil(self.count * pct / 100.0)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return min(self._value(bucket), self.max)
+        return self.max
+
+
+class PipelinedConnection(HttpMessageHandler):
+    """
+    Sends requests on tcp_conn without waiting for responses, and tells
+    load when each response arrives.
+    """
+
+    def __init__(self, load, tcp_conn):
+        HttpMessageHandler.__init__(self)
+        self.load = load
+        self.tcp_conn = tcp_conn
+        self.pending = deque() # (intended, sent) for each request
+        tcp_conn.on('data', self.handle_input)
+        tcp_conn.on('close', self.conn_closed)
+        tcp_conn.pause(False)
+
+    def send(self, intended):
+        self.pending.append((intended, systime.time()))
+        self.tcp_conn.write(self.load.request)
+
+    def conn_closed(self):
+        self.load.conn_lost(self)
+
+    def input_start(self, top_line, hdr_tuples, conn_tokens,
+        transfer_codes, content_length):
+        try:
+            self._status = top_line.split(None, 2)[1]
+        except IndexError:
+            raise ValueError
+        return self._status not in no_body_status
+
+    def input_body(self, chunk):
+        self.load.bytes += len(chunk)
+
+    def input_end(self, trailers):
+        intended, sent = self.pending.popleft()
+        self.load.done(intended, sent, self._status[:1] in "23")
+        self.load.next_request(self)
+
+    def input_error(self, err):
+        self.tcp_conn.close()
+        self.conn_closed()
+
+
+class Load(object):
+    """
+    Puts load on uri for duration seconds, with concurrency connections
+    (and up to pipeline requests outstanding on each).
+
+    If rate is given, rate requests are sent per second; otherwise, a new
+    request is sent as soon as each response arrives.
+    """
+
+    def __init__(self, uri, concurrency=10, duration=10, rate=None,
+                 pipeline=1, keepalive=True, headers=None, loop=None):
+        self.uri = uri
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.pipeline = pipeline
+        self.keepalive = keepalive
+        self.headers = headers or []
+        self.loop = loop or thor.loop.make(0.001)
+        self.latency = LatencyHistogram() # from when requests were due
+        self.service = LatencyHistogram() # from when requests were sent
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.elapsed = 0
+        self.outstanding = 0
+        self.grace = 5 # how long to wait for responses at the end, in secs
+        self._backlog = deque() # when requests that we couldn't send were due
+        self._conns = []
+        self._start = None
+        self._deadline = None
+        self._sent = 0
+        self._sending = True
+        self._stopping = False
+        scheme, self.host, self.port, authority, target = split_uri(uri)
+        self.request = "GET %s HTTP/1.1\r\nHost: %s\r\n%s\r\n" % (
+            target, authority,
+            "".join(["%s: %s\r\n" % hdr for hdr in self.headers])
+        )
+        self.client = HttpClient(self.loop)
+        self.client.max_idle_per_origin = concurrency
+        if not keepalive:
+            self.client.idle_timeout = 0
+
+    def run(self, start_at=None):
+        "Run the load, returning self. Starts at the time start_at, if given."
+        if self.pipeline > 1:
+            self._connect(self.concurrency)
+        else:
+            self._begin(start_at)
+        self.loop.run()
+        return self
+
+    def results(self):
+        "Return a dictionary of what happened."
+        if self.rate:
+            latency = self.latency
+        else:
+            latency = self.latency.corrected(self.service.mean())
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'elapsed': self.elapsed,
+            'latency': latency,
+            'service': self.service,
+        }
+
+    def _begin(self, start_at=None):
+        if start_at:
+            wait = start_at - systime.time()
+            if wait > 0:
+                self.loop.schedule(
+                    max(wait, self.loop.precision), self._begin)
+                return
+        self._start = systime.time()
+        self._deadline = self._start + self.duration
+        self.loop.schedule(self.duration + self.grace, self._finish)
+        if self.rate:
+            self._tick()
+        else:
+            for i in xrange(self.concurrency * self.pipeline):
+                self._issue(self._start)
+
+    def _tick(self):
+        "Send the requests that are due."
+        now = systime.time()
+        while True:
+            intended = self._start + self._sent / float(self.rate)
+            if intended > now or intended >= self._deadline:
+                break
+            self._sent += 1
+            self._issue(intended)
+        if intended < self._deadline:
+            # scheduling any sooner would make the loop step re-entrantly
+            self.loop.schedule(
+                max(intended - now, self.loop.precision), self._tick)
+        else:
+            self._sending = False
+            if self.outstanding == 0 and not self._backlog:
+                self._finish()
+
+    def _issue(self, intended):
+        "Send a request that was due at intended, if there's room for it."
+        if self.outstanding >= self.concurrency * self.pipeline or \
+          (self.pipeline > 1 and not self._conns):
+            self._backlog.append(intended)
+            return
+        self.outstanding += 1
+        if self.pipeline > 1:
+            conn = min(self._conns, key=lambda c: len(c.pending))
+            conn.send(intended)
+        else:
+            self._exchange(intended)
+
+    def _exchange(self, intended):
+        exchange = self.client.exchange()
+        sent = systime.time()
+        status = []
+        def response_start(code, phrase, headers):
+            status.append(code)
+        def response_body(chunk):
+            self.bytes += len(chunk)
+        def response_done(trailers):
+            self.done(intended, sent, status[0][:1] in "23")
+            self.next_request()
+        def error(err):
+            self.done(intended, sent, False)
+            self.next_request()
+        exchange.on('response_start', response_start)
+        exchange.on('response_body', response_body)
+        exchange.on('response_done', response_done)
+        exchange.on('error', error)
+        exchange.request_start("GET", self.uri, self.headers)
+        exchange.request_done([])
+
+    def done(self, intended, sent, ok):
+        "Record that a request finished."
+        now = systime.time()
+        self.outstanding -= 1
+        if ok:
+            self.requests += 1
+            self.latency.record(now - intended)
+            self.service.record(now - sent)
+            self.elapsed = now - self._start
+        else:
+            self.errors += 1
+
+    def next_request(self, conn=None):
+        "There's room for another request; send one if it's time."
+        now = systime.time()
+        if self._backlog:
+            self._issue(self._backlog.popleft())
+        elif not self.rate and now < self._deadline:
+            self._issue(now)
+        elif self.outstanding == 0 and not (self.rate and self._sending):
+            self._finish()
+
+    # pipelining
+
+    def _connect(self, count):
+        for i in xrange(count):
+            tcp_client = TcpClient(self.loop)
+            tcp_client.on('connect', self._connected)
+            tcp_client.on('connect_error', self._connect_error)
+            tcp_client.connect(self.host, self.port)
+
+    def _connected(self, tcp_conn):
+        self._conns.append(PipelinedConnection(self, tcp_conn))
+        if self._start is None and len(self._conns) == self.concurrency:
+            self._begin()
+
+    def _connect_error(self, err_type, err_id, err_str):
+        self.errors += 1
+        if self._start is None:
+            sys.stderr.write("Can't connect: %s\n" % err_str)
+            self.loop.stop()
+
+    def conn_lost(self, conn):
+        "A pipelined connection has closed."
+        if conn not in self._conns:
+            return
+        self._conns.remove(conn)
+        for intended, sent in conn.pending:
+            self.done(intended, sent, False)
+        conn.pending.clear()
+        if self._stopping:
+            return
+        if self._deadline and systime.time() < self._deadline:
+            self._connect(1)
+        if not self._conns:
+            self._finish()
+
+    def _finish(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        for conn in list(self._conns):
+            conn.tcp_conn.close()
+        self.loop.stop()
+
+
+def _run_process(args, start_at, queue):
+    "Run a Load in a child process, sending its results to queue."
+    queue.put(Load(**args).run(start_at).results())
+
+
+def run(uri, processes=1, **args):
+    """
+    Put load on uri from processes processes (the rate and concurrency
+    are split between them), returning the combined results.
+    """
+    if processes <= 1:
+        return Load(uri, **args).run().results()
+    concurrency = args.get('concurrency', 10)
+    args['concurrency'] = max(1, concurrency // processes)
+    if args.get('rate'):
+        args['rate'] = args['rate'] / float(processes)
+    args['uri'] = uri
+    queue = multiprocessing.Queue()
+    start_at = systime.time() + 0.5
+    procs = [multiprocessing.Process(target=_run_process,
+                                     args=(args, start_at, queue))
+             for i in xrange(processes)]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for proc in procs]
+    for proc in procs:
+        proc.join()
+    combined = results[0]
+    for res in results[1:]:
+        for key in ['requests', 'errors', 'bytes']:
+            combined[key] += res[key]
+        combined['elapsed'] = max(combined['elapsed'], res['elapsed'])
+        combined['latency'].merge(res['latency'])
+        combined['service'].merge(res['service'])
+    return combined
+
+
+percentiles = [50, 75, 90, 99, 99.9, 99.99]
+
+
+def report(results, out=sys.stdout):
+    "Write a summary of results to out."
+    elapsed = results['elapsed'] or 1
+    out.write("%s requests in %.2fs, %.2f MB read, %s errors\n" % (
+        results['requests'], elapsed, results['bytes'] / 1048576.0,
+        results['errors']
+    ))
+    out.write("Requests/sec: %.2f\n" % (results['requests'] / elapsed))
+    out.write("Transfer/sec: %.2f MB\n" % (
+        results['bytes'] / 1048576.0 / elapsed))
+    for name, hist in [
+        ("Latency (corrected for coordinated omission)", results['latency']),
+        ("Service time (uncorrected)", results['service'])
+    ]:
+        out.write("%s, ms:\n" % name)
+        out.write("  mean %11.3f\n" % (hist.mean() * 1000))
+        for pct in percentiles:
+            out.write("  p%-6s %8.3f\n" % (pct, hist.percentile(pct) * 1000))
+        out.write("  max  %11.3f\n" % (hist.max * 1000))
+
+
+def as_json(results):
+    "Return results as a JSON string."
+    out = dict([(k, v) for (k, v) in results.items()
+                if k not in ['latency', 'service']])
+    for name in ['latency', 'service']:
+        hist = results[name]
+        out[name] = dict([("p%s" % pct, hist.percentile(pct))
+                          for pct in percentiles])
+        out[name]['mean'] = hist.mean()
+        out[name]['max'] = hist.max
+    return json.dumps(out, indent=2, sort_keys=True)
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options] URL")
+    parser.add_option("-c", "--concurrency", type="int", default=10,
+        help="connections to use (default 10)")
+    parser.add_option("-d", "--duration", type="float", default=10,
+        help="seconds to put load on the server for (default 10)")
+    parser.add_option("-r", "--rate", type="float",
+        help="send this many requests per second (open-loop); by default, "
+             "send a request whenever a response arrives (closed-loop)")
+    parser.add_option("-p", "--pipeline", type="int", default=1,
+        help="requests to pipeline on each connection (default 1)")
+    parser.add_option("-k", "--no-keepalive", action="store_false",
+        dest="keepalive", default=True,
+        help="use a new connection for every request")
+    parser.add_option("-H", "--header", action="append", default=[],
+        help="add a request header (e.g., 'Accept: text/html')")
+    parser.add_option("-P", "--processes", type="int", default=1,
+        help="processes to generate load from (default 1)")
+    parser.add_option("-j", "--json", action="store_true",
+        help="write the results as JSON")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("need a URL")
+    if options.pipeline > 1 and not options.keepalive:
+        parser.error("can't pipeline without keep-alive")
+    headers = []
+    for header in options.header:
+        name, colon, value = header.partition(":")
+        if not colon:
+            parser.error("bad header %s" % header)
+        headers.append((name.strip(), value.strip()))
+    results = run(args[0], options.processes,
+        concurrency=options.concurrency,
+        duration=options.duration,
+        rate=options.rate,
+        pipeline=options.pipeline,
+        keepalive=options.keepalive,
+        headers=headers
+    )
+    if options.json:
+        print as_json(results)
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
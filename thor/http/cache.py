@@ -0,0 +1,666 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Cache
+
+This library is an in-memory HTTP cache that sits in front of an
+HttpClient. It stores responses that HTTP caching allows a shared cache to
+(as directed by Cache-Control, Expires, Vary and so on), serves them
+without going to the network while they're fresh, and revalidates them
+with conditional requests once they're stale.
+
+Concurrent requests for the same URI that miss the cache are collapsed
+into one request to the server.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from collections import deque
+from email.utils import parsedate_tz, mktime_tz
+
+from thor.events import EventEmitter, on
+from thor.http.client import HttpClient
+from thor.http.common import get_header, safe_methods, hop_by_hop_hdrs
+
+# statuses that can be cached without explicit freshness (RFC7231 6.1)
+heuristic_status = ['200', '203', '204', '300', '301', '404', '405',
+                    '410', '414', '501']
+# headers that a 304 doesn't update
+no_update_hdrs = ['content-length', 'transfer-encoding', 'connection',
+                  'content-encoding', 'content-range']
+# request headers that make us pass the request straight through
+bypass_hdrs = ['if-match', 'if-none-match', 'if-modified-since',
+               'if-unmodified-since', 'if-range', 'range']
+
+
+def parse_cc(hdr_tuples):
+    """
+    Given a list of header tuples, return a dictionary of the
+    Cache-Control directives in them; directives without arguments have a
+    value of None.
+    """
+    out = {}
+    for directive in get_header(hdr_tuples, 'cache-control'):
+        if "=" in directive:
+            name, value = directive.split("=", 1)
+            out[name.strip().lower()] = value.strip().strip('"')
+        elif directive:
+            out[directive.lower()] = None
+    return out
+
+def parse_date(hdr_tuples, name):
+    """
+    Return the value of the date header name in hdr_tuples as seconds since
+    the epoch, or None if it isn't present or can't be parsed.
+    """
+    values = [v for (n, v) in hdr_tuples if n.lower() == name]
+    if not values:
+        return None
+    date = parsedate_tz(values[-1].strip())
+    if date is None:
+        return None
+    try:
+        return mktime_tz(date)
+    except (OverflowError, ValueError):
+        return None
+
+def parse_delta(value):
+    "Return value as a number of seconds, or None if it isn't one."
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CacheEntry(object):
+    "A response stored in an HttpCache."
+
+    def __init__(self, uri, selecting, status, phrase, res_hdrs, body,
+                 request_time, response_time):
+        self.uri = uri
+        self.selecting = selecting # request header values it varies upon
+        self.status = status
+        self.phrase = phrase
+        self.res_hdrs = res_hdrs
+        self.body = body
+        self.request_time = request_time
+        self.response_time = response_time
+        self.size = 0
+        self.disk_key = None # where its body is in the disk tier, if it is
+        self._lru_token = None
+        self.update_size()
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s %s' % (self.status, self.uri))
+        status.append('%s bytes' % self.size)
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def update_size(self):
+        "Work out how many bytes the entry takes."
+        self.size = len(self.uri) + len(self.body) + sum(
+            [len(n) + len(v) for (n, v) in self.res_hdrs]
+        )
+
+    def meta(self):
+        "Return what's needed to recreate the entry, apart from its body."
+        return {
+            'uri': self.uri,
+            'selecting': self.selecting,
+            'status': self.status,
+            'phrase': self.phrase,
+            'res_hdrs': self.res_hdrs,
+            'request_time': self.request_time,
+            'response_time': self.response_time,
+        }
+
+    def validators(self):
+        "Return the request headers that would revalidate this entry."
+        out = []
+        etags = [v.strip() for (n, v) in self.res_hdrs if n.lower() == 'etag']
+        if etags:
+            out.append(('If-None-Match', etags[-1]))
+        lms = [v.strip() for (n, v) in self.res_hdrs
+               if n.lower() == 'last-modified']
+        if lms:
+            out.append(('If-Modified-Since', lms[-1]))
+        return out
+
+
+class HttpCache(object):
+    """
+    An in-memory HTTP cache in front of client (an HttpClient; one is made
+    if it isn't given). Its exchanges behave just like the client's.
+
+    It acts as a shared cache, storing up to max_size bytes of responses
+    in memory; ones whose body is bigger than max_entry_size go to disk (a
+    thor.http.diskstore.DiskStore) if it's given, and otherwise aren't
+    stored. Writes to disk happen on the loop's pool, one at a time, and
+    the disk's index is saved when the loop stops.
+    """
+
+    def __init__(self, client=None, max_size=64 * 1024 * 1024,
+                 max_entry_size=8 * 1024 * 1024, disk=None):
+        self.client = client or HttpClient()
+        self.disk = disk
+        self.loop = self.client.loop
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.heuristic_fraction = 0.1 # of the time since Last-Modified
+        self.max_heuristic = 24 * 60 * 60 # in seconds
+        self.size = 0 # bytes stored
+        self.hits = 0
+        self.misses = 0
+        self._entries = {} # uri: [entry, ...]
+        self._count = 0
+        self._lru = deque() # (token, entry), least recently used first
+        self._pending = {} # uri: exchange fetching it
+        self._disk_writes = {} # disk key: (uri, token) of its latest write
+        self._disk_queue = deque() # disk writes waiting their turn
+        self._disk_busy = False # whether a disk write is in progress
+        if disk:
+            self._load_disk()
+            self.loop.on('stop', self.disk.sync)
+
+    def close(self):
+        "Stop using the disk tier (if any), saving its index."
+        if self.disk:
+            self.loop.removeListener('stop', self.disk.sync)
+            self.disk.close()
+
+    def exchange(self):
+        return HttpCacheExchange(self)
+
+    def lookup(self, uri, req_hdrs):
+        "Return the stored entry for a request, or None."
+        for entry in self._entries.get(uri, [])[:]:
+            if entry.selecting == self._selecting(entry.res_hdrs, req_hdrs):
+                if entry.disk_key is None:
+                    self._touch(entry)
+                elif not self.disk.has(entry.disk_key):
+                    self._remove(entry) # the disk tier dropped it
+                    continue
+                return entry
+        return None
+
+    def body(self, entry):
+        """
+        Return entry's body as a list of chunks; those from the disk tier are
+        buffers, not strings.
+        """
+        if entry.disk_key is not None:
+            return self.disk.get(entry.disk_key) or []
+        if entry.body:
+            return [entry.body]
+        return []
+
+    def store(self, entry):
+        "Store entry, evicting others as necessary to make room."
+        if entry.size > self.max_size:
+            return
+        for old in self._entries.get(entry.uri, [])[:]:
+            if old.selecting == entry.selecting:
+                self._remove(old)
+        self._entries.setdefault(entry.uri, []).append(entry)
+        self._count += 1
+        self.size += entry.size
+        self._touch(entry)
+        while self.size > self.max_size:
+            token, old = self._lru.popleft()
+            if old._lru_token is token:
+                self._remove(old)
+
+    def store_disk(self, entry, chunks):
+        """
+        Store entry in the disk tier, with the list of strings chunks as its
+        body. It's written on the loop's pool, so lookups won't find it
+        until that's done.
+        """
+        for old in self._entries.get(entry.uri, [])[:]:
+            if old.selecting == entry.selecting:
+                self._remove(old)
+        key = "\n".join(
+            [entry.uri] + ["%s: %s" % pair for pair in entry.selecting]
+        )
+        token = object()
+        self._disk_writes[key] = (entry.uri, token)
+        self._disk_queue.append((key, token, entry, chunks))
+        self._next_disk_write()
+
+    def _next_disk_write(self):
+        "Start the next queued disk write, unless one is in progress."
+        while self._disk_queue and not self._disk_busy:
+            key, token, entry, chunks = self._disk_queue.popleft()
+            # skip it if it was replaced or invalidated before it started.
+            if self._disk_writes.get(key, (None, None))[1] is token:
+                self._disk_busy = True
+                self._disk_write(key, token, entry, chunks)
+
+    def _disk_write(self, key, token, entry, chunks):
+        "Write entry to the disk tier on the loop's pool."
+        job = self.loop.run_in_pool(self.disk.put, key, entry.meta(), chunks)
+        @on(job)
+        def done(stored):
+            self._disk_written(key, token, entry, stored)
+        @on(job)
+        def error(err):
+            self._disk_written(key, token, entry, False) # e.g., disk full
+
+    def _disk_written(self, key, token, entry, stored):
+        "A disk write has finished; stored is whether it was stored."
+        self._disk_busy = False
+        if self._disk_writes.get(key, (None, None))[1] is token:
+            del self._disk_writes[key]
+            if stored:
+                entry.disk_key = key
+                entry.body = ""
+                entry.update_size()
+                self._entries.setdefault(entry.uri, []).append(entry)
+        elif stored:
+            # it was replaced or invalidated while it was being written.
+            self.disk.delete(key)
+        self._next_disk_write()
+
+    def invalidate(self, uri):
+        "Remove any stored responses for uri."
+        for entry in self._entries.get(uri, [])[:]:
+            self._remove(entry)
+        for key, (write_uri, token) in self._disk_writes.items():
+            if write_uri == uri:
+                del self._disk_writes[key]
+
+    def clear(self):
+        "Remove all stored responses."
+        for entry in sum(self._entries.values(), []):
+            entry._lru_token = None
+        self._entries = {}
+        self._count = 0
+        self._lru = deque()
+        self.size = 0
+        self._disk_writes = {}
+        if self.disk:
+            self.disk.clear()
+
+    def freshness_lifetime(self, entry):
+        "Return how long entry is fresh for, in seconds."
+        cc = parse_cc(entry.res_hdrs)
+        if 'no-cache' in cc:
+            return 0
+        for directive in ['s-maxage', 'max-age']:
+            if directive in cc:
+                lifetime = parse_delta(cc[directive])
+                if lifetime is not None:
+                    return lifetime
+        date = parse_date(entry.res_hdrs, 'date') or entry.response_time
+        expires = parse_date(entry.res_hdrs, 'expires')
+        if expires is not None:
+            return max(expires - date, 0)
+        if [v for (n, v) in entry.res_hdrs if n.lower() == 'expires']:
+            return 0 # invalid Expires means already expired
+        last_modified = parse_date(entry.res_hdrs, 'last-modified')
+        if last_modified is not None and entry.status in heuristic_status:
+            return min(
+                max(date - last_modified, 0) * self.heuristic_fraction,
+                self.max_heuristic
+            )
+        return 0
+
+    def current_age(self, entry):
+        "Return how old entry is, in seconds (RFC7234 4.2.3)."
+        date = parse_date(entry.res_hdrs, 'date') or entry.response_time
+        apparent_age = max(entry.response_time - date, 0)
+        age_value = parse_delta(
+            (get_header(entry.res_hdrs, 'age') or [None])[-1]
+        ) or 0
+        response_delay = entry.response_time - entry.request_time
+        corrected_initial_age = max(apparent_age, age_value + response_delay)
+        return corrected_initial_age + self.loop.time() - entry.response_time
+
+    def is_fresh(self, entry, req_hdrs):
+        "Return whether entry can be used for a request without validation."
+        req_cc = parse_cc(req_hdrs)
+        if 'no-cache' in req_cc or \
+          'no-cache' in get_header(req_hdrs, 'pragma'):
+            return False
+        age = self.current_age(entry)
+        lifetime = self.freshness_lifetime(entry)
+        if 'max-age' in req_cc:
+            max_age = parse_delta(req_cc['max-age'])
+            if max_age is not None:
+                lifetime = min(lifetime, max_age)
+        if 'min-fresh' in req_cc:
+            age += parse_delta(req_cc['min-fresh']) or 0
+        return lifetime > age
+
+    def storable(self, method, req_hdrs, status, res_hdrs):
+        "Return whether a response can be stored."
+        if method != "GET" or status in ['206'] or status[:1] == '1':
+            return False
+        req_cc = parse_cc(req_hdrs)
+        cc = parse_cc(res_hdrs)
+        if 'no-store' in req_cc or 'no-store' in cc or 'private' in cc:
+            return False
+        if '*' in get_header(res_hdrs, 'vary'):
+            return False
+        if get_header(req_hdrs, 'authorization') and not (
+            'public' in cc or 's-maxage' in cc or 'must-revalidate' in cc
+        ):
+            return False
+        names = set([n.lower() for (n, v) in res_hdrs])
+        if 's-maxage' in cc or 'max-age' in cc or 'expires' in names:
+            return True
+        # otherwise, only worth it if it can be validated or heuristically
+        # fresh.
+        return status in heuristic_status and \
+            bool(names.intersection(['etag', 'last-modified']))
+
+    def _max_body(self):
+        "Return the biggest body that can be stored."
+        if self.disk:
+            return max(self.max_entry_size, self.disk.max_entry_size)
+        return self.max_entry_size
+
+    def _load_disk(self):
+        "Recreate the entries stored in the disk tier."
+        def enc(value):
+            return value.encode('latin-1')
+        for key, meta in self.disk.items():
+            try:
+                entry = CacheEntry(
+                    enc(meta['uri']),
+                    tuple([(enc(n), enc(v)) for (n, v) in meta['selecting']]),
+                    enc(meta['status']), enc(meta['phrase']),
+                    [(enc(n), enc(v)) for (n, v) in meta['res_hdrs']],
+                    "", meta['request_time'], meta['response_time']
+                )
+            except (KeyError, TypeError, ValueError, AttributeError):
+                self.disk.delete(key)
+                continue
+            entry.disk_key = key
+            self._entries.setdefault(entry.uri, []).append(entry)
+
+    def _selecting(self, res_hdrs, req_hdrs):
+        """
+        Return the values of the request headers that the response varies
+        upon.
+        """
+        return tuple([
+            (name.lower(), ",".join(get_header(req_hdrs, name.lower())))
+            for name in get_header(res_hdrs, 'vary') if name
+        ])
+
+    def _touch(self, entry):
+        "Mark entry as the most recently used."
+        token = object()
+        entry._lru_token = token
+        self._lru.append((token, entry))
+        if len(self._lru) > 2 * self._count + 64:
+            self._lru = deque(
+                [(t, e) for (t, e) in self._lru if e._lru_token is t]
+            )
+
+    def _remove(self, entry):
+        "Remove entry from the cache."
+        variants = self._entries.get(entry.uri, [])
+        if entry not in variants:
+            return
+        variants.remove(entry)
+        if not variants:
+            del self._entries[entry.uri]
+        if entry.disk_key is not None:
+            self.disk.delete(entry.disk_key)
+            return
+        entry._lru_token = None
+        self._count -= 1
+        self.size -= entry.size
+
+
+class HttpCacheExchange(EventEmitter):
+    """
+    A request/response exchange that goes through an HttpCache. It has
+    the same methods and events as an HttpClient exchange.
+    """
+
+    def __init__(self, cache):
+        EventEmitter.__init__(self)
+        self.cache = cache
+        self.method = None
+        self.uri = None
+        self.req_hdrs = None
+        self.upstream_ex = None
+        self.cache_status = None # 'hit', 'miss', 'revalidated' or 'pass'
+        self._cacheable = False
+        self._req_done = None # trailers, once the request is finished
+        self._hit = None # entry to serve when the request is finished
+        self._stale = None # entry being revalidated
+        self._leading = False # whether others are waiting on our fetch
+        self._followers = []
+        self._request_time = None
+        self._store = False
+        self._body = []
+        self._body_len = 0
+        self._res = None # (status, phrase, res_hdrs)
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s {%s}' % (self.method or "-", self.uri or "-"))
+        if self.cache_status:
+            status.append(self.cache_status)
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    @property
+    def tcp_conn(self):
+        "The connection used upstream, if any."
+        return self.upstream_ex and self.upstream_ex.tcp_conn
+
+    def request_start(self, method, uri, req_hdrs):
+        """
+        Start a request to uri using method, where
+        req_hdrs is a list of (field_name, field_value) for
+        the request headers.
+        """
+        self.method = method
+        self.uri = uri
+        self.req_hdrs = req_hdrs
+        self._cacheable = method in ["GET"] and not [
+            n for (n, v) in req_hdrs if n.lower() in bypass_hdrs
+        ] and 'no-store' not in parse_cc(req_hdrs)
+        if not self._cacheable:
+            self.cache_status = 'pass'
+            self._fetch(req_hdrs)
+            return
+        self._lookup(True)
+
+    def request_body(self, chunk):
+        "Send part of the request body. May be called zero to many times."
+        if self.upstream_ex:
+            self.upstream_ex.request_body(chunk)
+
+    def request_done(self, trailers):
+        """
+        Signal the end of the request, whether or not there was a body. MUST
+        be called exactly once for each request.
+        """
+        self._req_done = trailers
+        if self.upstream_ex:
+            self.upstream_ex.request_done(trailers)
+        elif self._hit:
+            self._serve(self._hit)
+
+    def res_body_pause(self, paused):
+        "Temporarily stop / restart sending the response body."
+        if self.upstream_ex:
+            self.upstream_ex.res_body_pause(paused)
+
+    def _dead_conn(self):
+        "Inform the client that the upstream connection is dead."
+        if self.upstream_ex:
+            self.upstream_ex._dead_conn()
+
+    # cache handling
+
+    def _lookup(self, coalesce):
+        """
+        Serve the request from the cache if we can; otherwise, fetch it,
+        conditionally if there's a stale response. If coalesce is True and
+        the URI is already being fetched, wait for that instead.
+        """
+        cache = self.cache
+        entry = cache.lookup(self.uri, self.req_hdrs)
+        if entry and cache.is_fresh(entry, self.req_hdrs):
+            cache.hits += 1
+            self.cache_status = 'hit'
+            if self._req_done is not None:
+                self._serve(entry)
+            else:
+                self._hit = entry
+            return
+        leader = cache._pending.get(self.uri)
+        if coalesce and leader:
+            leader._followers.append(self)
+            return
+        cache.misses += 1
+        self.cache_status = 'miss'
+        cache._pending[self.uri] = self
+        self._leading = True
+        req_hdrs = self.req_hdrs
+        if entry:
+            validators = entry.validators()
+            if validators:
+                self._stale = entry
+                req_hdrs = req_hdrs + validators
+        self._fetch(req_hdrs)
+
+    def _fetch(self, req_hdrs):
+        "Send the request upstream."
+        self._request_time = self.cache.loop.time()
+        self.upstream_ex = self.cache.client.exchange()
+        self.upstream_ex.on('response_nonfinal', self._res_nonfinal)
+        self.upstream_ex.on('response_start', self._res_start)
+        self.upstream_ex.on('response_body', self._res_body)
+        self.upstream_ex.on('response_done', self._res_done)
+        self.upstream_ex.on('error', self._res_error)
+        self.upstream_ex.on('pause', self._res_pause)
+        self.upstream_ex.request_start(self.method, self.uri, req_hdrs)
+        if self._req_done is not None:
+            self.upstream_ex.request_done(self._req_done)
+
+    def _serve(self, entry):
+        "Send a stored response."
+        self._hit = None
+        hdrs = [(n, v) for (n, v) in entry.res_hdrs if n.lower() != 'age']
+        hdrs.append(('Age', str(int(self.cache.current_age(entry)))))
+        self.emit('response_start', entry.status, entry.phrase, hdrs)
+        for chunk in self.cache.body(entry):
+            self.emit('response_body', chunk)
+        self.emit('response_done', [])
+
+    def _wake_followers(self):
+        "Let requests waiting on this one know it's done."
+        if not self._leading:
+            return
+        self._leading = False
+        if self.cache._pending.get(self.uri) is self:
+            del self.cache._pending[self.uri]
+        followers, self._followers = self._followers, []
+        for follower in followers:
+            follower._lookup(False)
+
+    # events from upstream
+
+    def _res_nonfinal(self, status, phrase, res_hdrs):
+        self.emit('response_nonfinal', status, phrase, res_hdrs)
+
+    def _res_pause(self, paused):
+        self.emit('pause', paused)
+
+    def _res_start(self, status, phrase, res_hdrs):
+        res_hdrs = [(n.strip(), v.strip()) for (n, v) in res_hdrs]
+        self._res = (status, phrase, res_hdrs)
+        if self._stale and status == '304':
+            return # _res_done will serve the updated entry
+        self._stale = None
+        self._store = self._cacheable and self.cache.storable(
+            self.method, self.req_hdrs, status, res_hdrs
+        )
+        self.emit('response_start', status, phrase, res_hdrs)
+
+    def _res_body(self, chunk):
+        if self._stale:
+            return
+        if self._store:
+            self._body.append(chunk)
+            self._body_len += len(chunk)
+            if self._body_len > self.cache._max_body():
+                self._store = False
+                self._body = []
+        self.emit('response_body', chunk)
+
+    def _res_done(self, trailers):
+        cache = self.cache
+        status, phrase, res_hdrs = self._res
+        if self._stale:
+            self._update(self._stale, res_hdrs)
+            self.cache_status = 'revalidated'
+            self._serve(self._stale)
+            self._stale = None
+        else:
+            if self._store:
+                stored_hdrs = [(n, v) for (n, v) in res_hdrs
+                               if n.lower() not in hop_by_hop_hdrs]
+                entry = CacheEntry(
+                    self.uri, cache._selecting(res_hdrs, self.req_hdrs),
+                    status, phrase, stored_hdrs, "",
+                    self._request_time, cache.loop.time()
+                )
+                if self._body_len > cache.max_entry_size:
+                    cache.store_disk(entry, self._body)
+                else:
+                    entry.body = "".join(self._body)
+                    entry.update_size()
+                    cache.store(entry)
+            elif self.method not in safe_methods and status[:1] in '23':
+                cache.invalidate(self.uri)
+            self._body = []
+            self.emit('response_done', trailers)
+        self._wake_followers()
+
+    def _res_error(self, err):
+        self.emit('error', err)
+        self._wake_followers()
+
+    def _update(self, entry, res_hdrs):
+        "Freshen entry with the headers from a 304 response."
+        names = set([n.lower() for (n, v) in res_hdrs
+                     if n.lower() not in no_update_hdrs + hop_by_hop_hdrs])
+        entry.res_hdrs = [(n, v) for (n, v) in entry.res_hdrs
+                          if n.lower() not in names] + \
+                         [(n, v) for (n, v) in res_hdrs
+                          if n.lower() in names]
+        entry.request_time = self._request_time
+        entry.response_time = self.cache.loop.time()
+        if entry.disk_key is None:
+            self.cache._remove(entry)
+            entry.update_size()
+            self.cache.store(entry)
@@ -34,10 +34,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from urlparse import urlsplit, urlunsplit
+import zlib
 
 import thor
+from thor import metrics
 from thor.events import EventEmitter, on
 from thor.tcp import TcpClient
 from thor.tls import TlsClient
@@ -46,12 +48,44 @@ from thor.http.common import HttpMessageHandler, \
     CLOSE, COUNTED, CHUNKED, NOBODY, \
     WAITING, ERROR, \
     idempotent_methods, no_body_status, hop_by_hop_hdrs, \
-    header_names
+    header_names, get_header
 from thor.http.error import UrlError, ConnectError, \
-    ReadTimeoutError, HttpVersionError
+    ReadTimeoutError, HttpVersionError, ContentCodingError
+from thor.http.compress import Decompressor
+from thor.http.upstream import Upstream
 
 req_rm_hdrs = hop_by_hop_hdrs + ['host']
 
+def split_uri(uri):
+    """
+    Given an absolute http or https URI, return a tuple of
+    (scheme, host, port, authority, request target).
+
+    Raises UrlError if it can't be used.
+    """
+    (scheme, authority, path, query, fragment) = urlsplit(uri)
+    scheme = scheme.lower()
+    if scheme == 'http':
+        default_port = 80
+    elif scheme == 'https':
+        default_port = 443
+    else:
+        raise UrlError("Unsupported URL scheme '%s'" % scheme)
+    if "@" in authority:
+        userinfo, authority = authority.split("@", 1)
+    if ":" in authority:
+        host, port = authority.rsplit(":", 1)
+        try:
+            port = int(port)
+        except ValueError:
+            raise UrlError("Non-integer port in URL")
+    else:
+        host, port = authority, default_port
+    if path == "":
+        path = "/"
+    req_target = urlunsplit(('', '', path, query, ''))
+    return scheme, host, port, authority, req_target
+
 # TODO: next-hop version cache for Expect/Continue, etc.
 
 class HttpClient(object):
@@ -61,41 +95,125 @@ class HttpClient(object):
     tls_client_class = TlsClient
 
     def __init__(self, loop=None):
-        self.loop = loop or thor.loop._loop
+        self.loop = loop or thor.loop.get_loop()
         self.idle_timeout = 60 # in seconds
         self.connect_timeout = None
         self.read_timeout = None
+        self.expect_timeout = 1 # how long to wait for 100 Continue (secs)
         self.retry_limit = 2
         self.retry_delay = 0.5 # in sec
         self.max_server_conn = 4
         self.proxy_tls = False
         self.proxy_host = None
         self.proxy_port = None
-        self._idle_conns = defaultdict(list)
+        self.decompress = False # decode gzip and deflate response bodies
+        self.max_idle_conns = 512 # across all origins
+        self.max_idle_per_origin = 16
+        self._idle_conns = defaultdict(list) # origin: [tcp_conn, ...]
+        self._idle_lru = deque() # (idle since, tcp_conn, origin), oldest first
+        self._idle_entries = {} # tcp_conn: its current entry in _idle_lru
+        self._idle_count = 0
+        self._sweeper = None
         self._conn_counts = defaultdict(int)
+        self._warm_targets = {}
+        self._warming = defaultdict(int)
+        self._warm_failures = defaultdict(int) # consecutive connect errors
+        self._warm_retries = {} # origin: scheduled retry
+        self.upstreams = {}
         self.loop.on('stop', self._close_conns)
 
     def exchange(self):
         return HttpClientExchange(self)
 
-    def _attach_conn(self, origin, handle_connect,
-               handle_connect_error, connect_timeout):
-        "Find an idle connection for origin, or create a new one."
+    def upstream(self, name, backends, strategy=None):
+        """
+        Send requests for URIs whose host is name to backends, a list of
+        (host, port) tuples, choosing between them with strategy (from
+        thor.http.upstream; default RoundRobin). Returns the Upstream.
+        """
+        upstream = Upstream(self, name, backends, strategy)
+        self.upstreams[name] = upstream
+        return upstream
+
+    def prewarm(self, uri, min_idle):
+        """
+        Open connections to the origin of uri ahead of time, and keep at
+        least min_idle of them idle in the pool, replacing them as they're
+        used or closed. A min_idle of 0 stops doing so.
+        """
+        origin = self._route(split_uri(uri)[:3])
+        if min_idle > 0:
+            self._warm_targets[origin] = min_idle
+            self._replenish(origin)
+        else:
+            self._warm_targets.pop(origin, None)
+            self._warm_failures.pop(origin, None)
+            retry = self._warm_retries.pop(origin, None)
+            if retry is not None:
+                retry.delete()
+
+    def _route(self, origin):
+        "Return the origin that a connection for origin should go to."
         if self.proxy_host and self.proxy_port:
             # TODO: full form of request-target
-            import sys
-            host, port = self.proxy_host, self.proxy_port
             if self.proxy_tls:
                 scheme = 'https'
             else:
                 scheme = 'http'
-            origin = (scheme, host, port)
-        else:
-            scheme, host, port = origin
+            return (scheme, self.proxy_host, self.proxy_port)
+        return origin
+
+    def _replenish(self, origin):
+        """
+        Open connections until origin has its minimum idle pool, without
+        going over max_server_conn. After connect errors, wait (twice as
+        long after each one) before trying again.
+        """
+        if origin in self._warm_retries:
+            return
+        target = min(
+            self._warm_targets.get(origin, 0), self.max_idle_per_origin
+        )
+        idle = len([c for c in self._idle_conns.get(origin, [])
+                    if c.tcp_connected])
+        wanted = target - idle - self._warming[origin]
+        if self.max_server_conn > 0:
+            wanted = min(wanted,
+                         self.max_server_conn - self._conn_counts[origin])
+        scheme = origin[0]
+        def handle_connect(tcp_conn, reused=False):
+            self._warming[origin] -= 1
+            self._warm_failures.pop(origin, None)
+            self._release_conn(tcp_conn, scheme)
+        def handle_error(err_type, err_id, err_str):
+            self._warming[origin] -= 1
+            self._dead_conn(origin)
+            if origin in self._warm_targets and \
+              origin not in self._warm_retries:
+                failures = self._warm_failures[origin]
+                self._warm_failures[origin] += 1
+                delay = self.retry_delay * 2 ** min(failures, 6)
+                self._warm_retries[origin] = self.loop.schedule(
+                    delay, retry
+                )
+        def retry():
+            del self._warm_retries[origin]
+            self._replenish(origin)
+        for i in range(wanted):
+            self._warming[origin] += 1
+            self._new_conn(origin, handle_connect, handle_error,
+                self.connect_timeout
+            )
+
+    def _attach_conn(self, origin, handle_connect,
+               handle_connect_error, connect_timeout):
+        "Find an idle connection for origin, or create a new one."
+        origin = self._route(origin)
         while True:
-            try:
-                tcp_conn = self._idle_conns[origin].pop()
-            except IndexError:
+            conns = self._idle_conns.get(origin)
+            if not conns:
+                if metrics.enabled:
+                    metrics.http_client_pool_misses.inc()
                 self._new_conn(
                     origin,
                     handle_connect,
@@ -103,40 +221,122 @@ class HttpClient(object):
                     connect_timeout
                 )
                 break
-            if tcp_conn.tcp_connected:
-                if hasattr(tcp_conn, "_idler"):
-                    tcp_conn._idler.delete()
-                handle_connect(tcp_conn)
+            tcp_conn = conns[-1]
+            self._unpool(tcp_conn, origin)
+            if tcp_conn.peek_closed():
+                # the server has closed it (or is talking out of turn)
+                tcp_conn.close()
+                self._dead_conn(origin)
+            else:
+                if metrics.enabled:
+                    metrics.http_client_pool_hits.inc()
+                handle_connect(tcp_conn, True)
                 break
+        if origin in self._warm_targets:
+            self._replenish(origin)
 
     def _release_conn(self, tcp_conn, scheme):
         "Add an idle connection back to the pool."
+        tcp_conn.protocol = None
         tcp_conn.removeListeners('data', 'pause', 'close')
         tcp_conn.on('close', tcp_conn.handle_close)
         tcp_conn.pause(True)
         origin = (scheme, tcp_conn.host, tcp_conn.port)
-        if tcp_conn.tcp_connected:
+        if not tcp_conn.tcp_connected:
+            self._dead_conn(origin)
+        elif not self.idle_timeout > 0:
+            tcp_conn.close()
+            self._dead_conn(origin)
+        else:
             def idle_close():
                 "Remove the connection from the pool when it closes."
-                if hasattr(tcp_conn, "_idler"):
-                    tcp_conn._idler.delete()                    
-                self._dead_conn(origin)
-                try:
-                    self._idle_conns[origin].remove(tcp_conn)
-                except (KeyError, ValueError):
-                    pass
+                if self._unpool(tcp_conn, origin):
+                    self._dead_conn(origin)
+                    if origin in self._warm_targets:
+                        self._replenish(origin)
             tcp_conn.on('close', idle_close)
-            if self.idle_timeout > 0:
-                tcp_conn._idler = self.loop.schedule(
-                    self.idle_timeout, tcp_conn.close
-                )
-            else:
-                tcp_conn.close()
-                self._dead_conn(origin)
-            self._idle_conns[origin].append(tcp_conn)
-        else:
+            self._pool(tcp_conn, origin)
+
+    def _pool(self, tcp_conn, origin):
+        """
+        Put an idle connection in the pool, evicting the least recently
+        used ones if the origin or the pool as a whole is over budget.
+        """
+        conns = self._idle_conns[origin]
+        while len(conns) >= self.max_idle_per_origin > 0:
+            self._evict(conns[0], origin)
+        while self._idle_count >= self.max_idle_conns > 0:
+            self._evict_lru()
+        entry = (self.loop.now(), tcp_conn, origin)
+        self._idle_entries[tcp_conn] = entry
+        conns.append(tcp_conn)
+        self._idle_lru.append(entry)
+        self._idle_count += 1
+        # entries for connections that have left the pool are dropped lazily;
+        # don't let them pile up.
+        if len(self._idle_lru) > 2 * self._idle_count + 64:
+            self._idle_lru = deque(
+                [e for e in self._idle_lru
+                 if self._idle_entries.get(e[1]) is e]
+            )
+        self._arm_sweeper()
+
+    def _unpool(self, tcp_conn, origin):
+        """
+        Take a connection out of the idle pool. Returns False if it
+        wasn't there.
+        """
+        if self._idle_entries.pop(tcp_conn, None) is None:
+            return False
+        conns = self._idle_conns[origin]
+        conns.remove(tcp_conn)
+        if not conns:
+            del self._idle_conns[origin]
+        self._idle_count -= 1
+        return True
+
+    def _evict(self, tcp_conn, origin):
+        "Close an idle connection and take it out of the pool."
+        if self._unpool(tcp_conn, origin):
+            tcp_conn.close()
             self._dead_conn(origin)
 
+    def _evict_lru(self):
+        "Close the least recently used idle connection, across all origins."
+        lru = self._idle_lru
+        while lru:
+            entry = lru.popleft()
+            if self._idle_entries.get(entry[1]) is entry:
+                self._evict(entry[1], entry[2])
+                return
+
+    def _arm_sweeper(self):
+        "Make sure the sweeper will run when the oldest idle conn expires."
+        if self._sweeper is None and self._idle_lru:
+            expires = self._idle_lru[0][0] + self.idle_timeout
+            self._sweeper = self.loop.schedule(
+                max(expires - self.loop.now(), 0), self._sweep
+            )
+
+    def _sweep(self):
+        "Close idle connections that have been idle for too long."
+        self._sweeper = None
+        deadline = self.loop.now() - self.idle_timeout
+        lru = self._idle_lru
+        while lru:
+            entry = lru[0]
+            when, tcp_conn, origin = entry
+            if self._idle_entries.get(tcp_conn) is not entry:
+                lru.popleft()
+                continue
+            if when > deadline:
+                break
+            lru.popleft()
+            self._evict(tcp_conn, origin)
+            if origin in self._warm_targets:
+                self._replenish(origin)
+        self._arm_sweeper()
+
     def _new_conn(self, origin, handle_connect, handle_error, timeout):
         "Create a new connection."
         (scheme, host, port) = origin
@@ -157,18 +357,35 @@ class HttpClient(object):
 
     def _close_conns(self):
         "Close all idle HTTP connections."
-        for conn_list in self._idle_conns.values():
+        conn_lists = self._idle_conns.values()
+        # forget them first, so that closing them doesn't unpool them.
+        self._idle_conns = defaultdict(list)
+        self._idle_lru = deque()
+        self._idle_entries = {}
+        self._idle_count = 0
+        for conn_list in conn_lists:
             for conn in conn_list:
                 try:
                     conn.close()
                 except:
                     pass
-        self._idle_conns = {}
+        self._sweeper = None # the loop has dropped it already
+        self._warm_retries = {} # and these
         # TODO: probably need to close in-progress conns too.
 
 
 class HttpClientExchange(HttpMessageHandler, EventEmitter):
 
+    __slots__ = HttpMessageHandler.handler_slots + ('client', 'method', 'uri',
+        'req_hdrs', 'req_target', 'scheme', 'authority', 'res_version',
+        'tcp_conn', 'origin', 'upstream', 'backend', 'decompress',
+        '_decompressor', '_decode_failed', '_conn_reusable', '_conn_reused',
+        '_nonfinal', '_req_body', '_req_started', '_req_head', '_req_done',
+        '_expect_continue', '_continue_ev', '_body_ready', '_body_refused',
+        '_body_sent', '_held_body', '_held_done', '_producer', '_conn_paused',
+        '_retries', '_read_timeout_ev', '_read_deadline', '_read_waiting',
+        '_output_buffer', '_aborted')
+
     def __init__(self, client):
         HttpMessageHandler.__init__(self)
         EventEmitter.__init__(self)
@@ -182,12 +399,33 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
         self.res_version = None
         self.tcp_conn = None
         self.origin = None
+        self.upstream = None
+        self.backend = None
+        self.decompress = client.decompress
+        self._decompressor = None
+        self._decode_failed = False
         self._conn_reusable = False
+        self._conn_reused = False
+        self._nonfinal = False
         self._req_body = False
         self._req_started = False
+        self._req_head = None # (top_line, hdr_tuples, delimit)
+        self._req_done = None # trailers, once the request has been finished
+        self._expect_continue = False
+        self._continue_ev = None
+        self._body_ready = False # whether the body can be sent yet
+        self._body_refused = False # got a final response before sending it
+        self._body_sent = False
+        self._held_body = [] # body chunks waiting for _body_ready
+        self._held_done = None # trailers waiting for _body_ready
+        self._producer = None
+        self._conn_paused = False
         self._retries = 0
         self._read_timeout_ev = None
+        self._read_deadline = None # when the read timeout expires
+        self._read_waiting = None # what we're waiting to read
         self._output_buffer = []
+        self._aborted = False
 
     def __repr__(self):
         status = [self.__class__.__module__ + "." + self.__class__.__name__]
@@ -207,47 +445,70 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
         self.uri = uri
         self.req_hdrs = req_hdrs
         try:
-            self.origin = self._parse_uri(self.uri)
+            self.origin = self._balance(self._parse_uri(self.uri))
         except (TypeError, ValueError):
             return 
+        self.emit('pause', True) # until we can send the body
         self.client._attach_conn(self.origin, self._handle_connect,
             self._handle_connect_error, self.client.connect_timeout
         )
-    # TODO: if we sent Expect: 100-continue, don't wait forever
-    # (i.e., schedule something)
 
     def _parse_uri(self, uri):
         """
         Given a URI, parse out the host, port, authority and request target. 
         Returns None if there is an error, otherwise the origin.
         """
-        (scheme, authority, path, query, fragment) = urlsplit(uri)
-        scheme = scheme.lower()
-        if scheme == 'http':
-            default_port = 80
-        elif scheme == 'https':
-            default_port = 443
-        else:
-            self.input_error(UrlError("Unsupported URL scheme '%s'" % scheme))
+        try:
+            scheme, host, port, authority, self.req_target = split_uri(uri)
+        except UrlError, why:
+            self.input_error(why)
             raise ValueError
-        if "@" in authority:
-            userinfo, authority = authority.split("@", 1)
-        if ":" in authority:
-            host, port = authority.rsplit(":", 1)
-            try:
-                port = int(port)
-            except ValueError:
-                self.input_error(UrlError("Non-integer port in URL"))
-                raise
-        else:
-            host, port = authority, default_port
-        if path == "":
-            path = "/"
         self.scheme = scheme
         self.authority = authority
-        self.req_target = urlunsplit(('', '', path, query, ''))
         return scheme, host, port
 
+    def _balance(self, origin):
+        """
+        If origin's host is the name of an upstream, return the origin of
+        its backend to use instead.
+        """
+        scheme, host, port = origin
+        upstream = self.client.upstreams.get(host)
+        if upstream is None:
+            return origin
+        if self.backend is None:
+            self.upstream = upstream
+            self.backend = upstream.pick(self.uri)
+        return scheme, self.backend.host, self.backend.port
+
+    def _upstream_done(self, err=None):
+        "Tell the upstream (if any) that we're done with its backend."
+        if self.backend is not None:
+            self.upstream.done(self.backend, err)
+            self.backend = None
+
+    def abort(self):
+        """
+        Give up on the exchange, closing its connection (if any). Nothing
+        more is emitted.
+        """
+        if self._aborted:
+            return
+        self._aborted = True
+        self._input_state = ERROR
+        self._cancel_read_timeout()
+        if self._continue_ev:
+            self._continue_ev.delete()
+            self._continue_ev = None
+        tcp_conn, self.tcp_conn = self.tcp_conn, None
+        if tcp_conn and tcp_conn.tcp_connected:
+            self._dead_conn()
+            tcp_conn.close()
+        if self.backend is not None:
+            # that says nothing about the backend's health.
+            self.upstream.release(self.backend)
+            self.backend = None
+
     def _req_start(self):
         """
         Actually queue the request headers for sending.
@@ -257,6 +518,8 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
             i for i in self.req_hdrs if not i[0].lower() in req_rm_hdrs
         ]
         req_hdrs.append(("Host", self.authority))
+        if self.decompress and "accept-encoding" not in header_names(req_hdrs):
+            req_hdrs.append(("Accept-Encoding", "gzip, deflate"))
         if self.client.idle_timeout > 0:
             req_hdrs.append(("Connection", "keep-alive"))
         else:
@@ -268,17 +531,34 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
             delimit = CHUNKED
         else:
             delimit = NOBODY
-        self.output_start("%s %s HTTP/1.1" % (self.method, self.req_target),
+        self._expect_continue = '100-continue' in [
+            v.lower() for v in get_header(req_hdrs, 'expect')
+        ]
+        self._req_head = (
+            "%s %s HTTP/1.1" % (self.method, self.req_target),
             req_hdrs, delimit
         )
-
+        self.output_start(*self._req_head)
+        self._body_check()
 
     def request_body(self, chunk):
-        "Send part of the request body. May be called zero to many times."
+        """
+        Send part of the request body. May be called zero to many times.
+
+        Chunks are held until the body can be sent (i.e., there's a
+        connection, and the server has agreed to an Expect: 100-continue),
+        and then buffered by the connection until they're written. Neither
+        is limited, so callers must wait for 'pause' to be emitted with
+        False before sending more than a little, or use
+        request_body_producer instead.
+        """
         if not self._req_started:
             self._req_body = True
             self._req_start()
-        self.output_body(chunk)
+        if self._body_ready:
+            self._send_body(chunk)
+        elif not self._body_refused:
+            self._held_body.append(chunk)
 
     def request_done(self, trailers):
         """
@@ -287,7 +567,25 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
         """
         if not self._req_started:
             self._req_start()
-        self.output_end(trailers)
+        if self._body_ready:
+            self._send_done(trailers)
+        elif not self._body_refused:
+            self._held_done = trailers
+
+    def request_body_producer(self, producer):
+        """
+        Send the request body by calling producer, which should return
+        the next chunk of the body, or an empty string when it's done.
+
+        It's only called when the connection can take more, so the body
+        doesn't have to be held in memory. The request is finished when the
+        body is, so request_done shouldn't be called.
+        """
+        if not self._req_started:
+            self._req_body = True
+            self._req_start()
+        self._producer = producer
+        self._pull()
 
     def res_body_pause(self, paused):
         "Temporarily stop / restart sending the response body."
@@ -296,19 +594,28 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
 
     # Methods called by tcp
 
-    def _handle_connect(self, tcp_conn):
-        "The connection has succeeded."
+    def _handle_connect(self, tcp_conn, reused=False):
+        """
+        The connection has succeeded. reused is True if it came from the
+        idle pool.
+        """
+        if self._aborted:
+            tcp_conn.close()
+            self._dead_conn()
+            return
         self.tcp_conn = tcp_conn
+        self._conn_reused = reused
+        self._conn_paused = False
         self._set_read_timeout('connect')
-        tcp_conn.on('data', self.handle_input)
-        tcp_conn.on('close', self._conn_closed)
-        tcp_conn.on('pause', self._req_body_pause)
-        # FIXME: should this be done AFTER _req_start?
+        tcp_conn.protocol = self
         self.output("") # kick the output buffer
         self.tcp_conn.pause(False)
+        self._body_check()
 
     def _handle_connect_error(self, err_type, err_id, err_str):
         "The connection has failed."
+        if self._aborted:
+            return
         self.input_error(ConnectError(err_str))
 
     def _conn_closed(self):
@@ -320,7 +627,11 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
             self.input_end([])
         elif self._input_state == WAITING: # TODO: needs to be tighter
             if self.method in idempotent_methods:
-                if self._retries < self.client.retry_limit:
+                if self._conn_reused:
+                    # The server closed an idle connection before we noticed;
+                    # that says nothing about the server, so retry right away.
+                    self._retry(False)
+                elif self._retries < self.client.retry_limit:
                     self.client.loop.schedule(
                         self.client.retry_delay, self._retry
                     )
@@ -339,21 +650,111 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
                 "Server dropped connection before the response was complete."
             ))
 
-    def _retry(self):
-        "Retry the request."
+    def _retry(self, count=True):
+        """
+        Retry the request. If count is False, it won't count against the
+        retry limit.
+        """
+        if self._aborted:
+            return
         self._clear_read_timeout()
-        self._retries += 1
+        if count:
+            self._retries += 1
+            # try another backend, if there's a choice.
+            self._upstream_done(ConnectError("Server dropped connection."))
+        if self._body_sent:
+            self.input_error(ConnectError(
+                "Can't retry; the request body has already been sent."
+            ))
+            return
         try:
-            origin = self._parse_uri(self.uri)
+            origin = self.origin = self._balance(self._parse_uri(self.uri))
         except (TypeError, ValueError):
             return 
+        self._body_ready = False
+        if self._continue_ev:
+            self._continue_ev.delete()
+            self._continue_ev = None
+        if self._req_done is not None:
+            self._held_done, self._req_done = self._req_done, None
+        if self._req_started:
+            self._output_buffer = []
+            self.output_start(*self._req_head)
         self.client._attach_conn(origin, self._handle_connect,
             self._handle_connect_error, self.client.connect_timeout
         )
 
     def _req_body_pause(self, paused):
         "The client needs the application to pause/unpause the request body."
-        self.emit('pause', paused)
+        self._conn_paused = paused
+        if self._body_ready:
+            self.emit('pause', paused)
+            self._pull()
+
+    # TcpConnection protocol
+    pause_writing = _req_body_pause
+    connection_lost = _conn_closed
+
+    # request body flow control
+
+    def _body_check(self):
+        "Start sending the request body, if we're ready to."
+        if self._body_ready or not self._req_started or not self.tcp_conn:
+            return
+        if self._expect_continue:
+            # wait for 100 Continue, but not forever.
+            if self._continue_ev is None:
+                self._continue_ev = self.client.loop.schedule(
+                    self.client.expect_timeout, self._body_start
+                )
+        else:
+            self._body_start()
+
+    def _body_start(self):
+        "Send any held request body, and let the application send more."
+        if self._continue_ev:
+            self._continue_ev.delete()
+            self._continue_ev = None
+        if self._body_ready or self._body_refused:
+            return
+        self._body_ready = True
+        held, self._held_body = self._held_body, []
+        for chunk in held:
+            self._send_body(chunk)
+        if self._held_done is not None:
+            trailers, self._held_done = self._held_done, None
+            self._send_done(trailers)
+        if not self._conn_paused:
+            self.emit('pause', False)
+            self._pull()
+
+    def _body_refuse(self):
+        "The server answered before we sent the body; don't send it."
+        if self._continue_ev:
+            self._continue_ev.delete()
+            self._continue_ev = None
+        self._body_refused = True
+        self._held_body = []
+        self._held_done = None
+        self._producer = None
+
+    def _pull(self):
+        "Get more of the request body from the producer, while there's room."
+        while self._producer and self._body_ready and not self._conn_paused:
+            chunk = self._producer()
+            if chunk:
+                self._send_body(chunk)
+            else:
+                self._producer = None
+                self._send_done([])
+
+    def _send_body(self, chunk):
+        self._body_sent = True
+        self.output_body(chunk)
+
+    def _send_done(self, trailers):
+        self._req_done = trailers
+        self.output_end(trailers)
 
     # Methods called by common.HttpMessageHandler
 
@@ -378,30 +779,82 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
         except ValueError:
             res_code = status_txt.rstrip()
             res_phrase = ""
+        if res_code[:1] == "1" and res_code != "101":
+            self._nonfinal = True
+            self._set_read_timeout('start')
+            self.emit('response_nonfinal', res_code, res_phrase, hdr_tuples)
+            if res_code == "100":
+                self._body_start()
+            return False
         if 'close' not in conn_tokens:
             if (
               self.res_version == "1.0" and 'keep-alive' in conn_tokens) or \
               self.res_version in ["1.1"]:
                 self._conn_reusable = True
+        if self._expect_continue and not self._body_ready:
+            self._body_refuse()
+            if self._req_head[2] != NOBODY:
+                # we promised a body but won't send it.
+                self._conn_reusable = False
         self._set_read_timeout('start')
+        allows_body = (res_code not in no_body_status) \
+            and (self.method != "HEAD")
+        if self.decompress and allows_body:
+            hdr_tuples = self._decode_start(hdr_tuples)
         self.emit('response_start',
                   res_code,
                   res_phrase,
                   hdr_tuples
         )
-        allows_body = (res_code not in no_body_status) \
-            and (self.method != "HEAD")
         return allows_body
 
+    def _decode_start(self, hdr_tuples):
+        """
+        If the response body has a content-coding that we can decode, start
+        decoding it and return the headers that describe the decoded body.
+        """
+        codings = [c.strip().lower()
+                   for v in get_header(hdr_tuples, 'content-encoding')
+                   for c in v.split(",") if c.strip()]
+        if len(codings) != 1 or \
+          codings[0] not in ['gzip', 'x-gzip', 'deflate']:
+            return hdr_tuples
+        self._decompressor = Decompressor(codings[0])
+        return [(n, v) for (n, v) in hdr_tuples
+                if n.lower() not in ['content-encoding', 'content-length']]
+
     def input_body(self, chunk):
         "Process a response body chunk from the wire."
         self._clear_read_timeout()
+        if self._decode_failed:
+            return
+        if self._decompressor:
+            try:
+                chunk = self._decompressor.decompress(chunk)
+            except zlib.error, why:
+                self._decode_failed = True
+                self.input_error(ContentCodingError(str(why)))
+                return
         self.emit('response_body', chunk)
         self._set_read_timeout('body')
 
     def input_end(self, trailers):
         "Indicate that the response body is complete."
-        self._clear_read_timeout()
+        if self._nonfinal:
+            self._nonfinal = False
+            return
+        if self._decode_failed:
+            return
+        self._cancel_read_timeout()
+        if self._decompressor:
+            rest = self._decompressor.flush()
+            self._decompressor = None
+            if rest:
+                self.emit('response_body', rest)
+        if self._req_done is None:
+            # the response finished before the request did
+            self._body_refuse()
+            self._conn_reusable = False
         if self.tcp_conn.tcp_connected and self._conn_reusable:
             self.client._release_conn(self.tcp_conn, self.scheme)
         else:
@@ -409,6 +862,7 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
               self.tcp_conn.close()
             self._dead_conn()
         self.tcp_conn = None
+        self._upstream_done()
         self.emit('response_done', trailers)
 
     def input_error(self, err):
@@ -417,7 +871,8 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
             self._conn_reusable = False
         else:
             self._input_state = ERROR
-            self._clear_read_timeout()
+            self._cancel_read_timeout()
+            self._body_refuse()
             if err.client_recoverable and \
               self.tcp_conn and self.tcp_conn.tcp_connected:
                 self.client._release_conn(self.tcp_conn, self.scheme)
@@ -426,6 +881,7 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
                 if self.tcp_conn:
                     self.tcp_conn.close()
             self.tcp_conn = None
+            self._upstream_done(err)
         self.emit('error', err)
         
     def _dead_conn(self):
@@ -440,18 +896,45 @@ class HttpClientExchange(HttpMessageHandler, EventEmitter):
 
     # misc
 
+    # The read timeout is a deadline that moves every time something is
+    # read. One timer at a time checks it, re-arming itself if the deadline
+    # has moved, so reading a body doesn't touch the loop's schedule.
+
     def _set_read_timeout(self, kind):
         "Set the read timeout."
         if self.client.read_timeout:
-            self._read_timeout_ev = self.client.loop.schedule(
-                self.client.read_timeout, self.input_error,
-                ReadTimeoutError(kind)
-            )
+            loop = self.client.loop
+            self._read_deadline = loop.now() + self.client.read_timeout
+            self._read_waiting = kind
+            if self._read_timeout_ev is None:
+                self._read_timeout_ev = loop.schedule(
+                    self.client.read_timeout, self._check_read_timeout
+                )
 
     def _clear_read_timeout(self):
-        "Clear the read timeout."
+        "Clear the read timeout (leaving the timer, if any, to lapse)."
+        self._read_deadline = None
+
+    def _cancel_read_timeout(self):
+        "Clear the read timeout and its timer."
+        self._read_deadline = None
         if self._read_timeout_ev:
             self._read_timeout_ev.delete()
+            self._read_timeout_ev = None
+
+    def _check_read_timeout(self):
+        "The read timer has fired; see if the deadline has passed."
+        self._read_timeout_ev = None
+        if self._read_deadline is None:
+            return
+        loop = self.client.loop
+        remaining = self._read_deadline - loop.now()
+        if remaining > 0:
+            self._read_timeout_ev = loop.schedule(
+                max(remaining, loop.precision), self._check_read_timeout
+            )
+        else:
+            self.input_error(ReadTimeoutError(self._read_waiting))
 
 
 def test_client(request_uri, out, err):
@@ -32,6 +32,9 @@ THE SOFTWARE.
 
 from collections import defaultdict
 import re
+import time
+
+from thor import metrics
 
 from thor.http import error
 
@@ -98,7 +101,7 @@ def get_header(hdr_tuples, name):
     ]
 
 
-class HttpMessageHandler:
+class HttpMessageHandler(object):
     """
     This is a base class for something that has to parse and/or serialise
     HTTP messages, request or response.
@@ -107,8 +110,15 @@ class HttpMessageHandler:
     input_end, and call handle_input when you get bytes from the network.
 
     For serialising, it expects you to override _output.
+
+    Subclasses that define __slots__ need to include handler_slots.
     """
 
+    __slots__ = ()
+    handler_slots = ('input_header_length', 'input_transfer_length',
+        '_input_buffer', '_input_state', '_input_delimit', '_input_body_left',
+        '_output_state', '_output_delimit')
+
     inspecting = False # if True, don't fail on errors, but preserve them.
 
     def __init__(self):
@@ -183,6 +193,9 @@ class HttpMessageHandler:
         else:
             raise Exception, "Unknown state %s" % self._input_state
 
+    # so that subclasses can be TcpConnection protocols
+    data_received = handle_input
+
     def _handle_nobody(self, instr):
         "Handle input that shouldn't have a body."
         self.input_end([])
@@ -361,6 +374,7 @@ class HttpMessageHandler:
         more), parse the headers out and return the rest. Calls
         self.input_start to kick off processing.
         """
+        parse_start = metrics.enabled and time.time()
         top, rest = hdr_end.split(instr, 1)
         self.input_header_length = len(top)
         header_lines = top.splitlines()
@@ -385,6 +399,9 @@ class HttpMessageHandler:
         if transfer_codes != [] and content_length != None:
             content_length = None
 
+        if parse_start:
+            metrics.http_parse_time.observe(time.time() - parse_start)
+
         try:
             allows_body = self.input_start(top_line, hdr_tuples,
                         conn_tokens, transfer_codes, content_length)
@@ -434,6 +451,12 @@ class HttpMessageHandler:
         if not chunk or self._output_delimit == None:
             return
         if self._output_delimit == CHUNKED:
+            if not isinstance(chunk, str):
+                # don't copy buffers into the chunk
+                self.output("%s\r\n" % hex(len(chunk))[2:])
+                self.output(chunk)
+                self.output("\r\n")
+                return
             chunk = "%s\r\n%s\r\n" % (hex(len(chunk))[2:], chunk)
         self.output(chunk)
         # TODO: body counting
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Compression
+
+This library has what HttpServer and HttpClient need to compress and
+decompress message bodies (with the gzip and deflate content-codings) as
+they're streamed, without buffering them.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from collections import deque
+import zlib
+
+from thor.http.common import get_header
+
+# content-codings we can produce, most preferred first
+codings = ['gzip', 'deflate']
+# media types that are already compressed
+precompressed_types = set([
+    'application/zip', 'application/gzip', 'application/x-gzip',
+    'application/x-bzip2', 'application/x-xz', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/pdf', 'application/woff',
+    'font/woff', 'font/woff2', 'application/font-woff',
+])
+precompressed_majors = set(['image', 'audio', 'video'])
+uncompressed_types = set(['image/svg+xml', 'image/bmp', 'image/x-icon'])
+
+
+def negotiate(req_hdrs):
+    """
+    Given a list of request header tuples, return the content-coding to
+    compress the response with, or None if it shouldn't be.
+    """
+    accepted = {}
+    for value in get_header(req_hdrs, 'accept-encoding'):
+        params = [p.strip() for p in value.split(";")]
+        coding = params[0].lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        q = 1.0
+        for param in params[1:]:
+            if param.lower().startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0
+        accepted[coding] = q
+    best, best_q = None, 0
+    for coding in codings:
+        q = accepted.get(coding, accepted.get('*', 0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compressible(res_hdrs):
+    """
+    Given a list of response header tuples, return whether the body is
+    worth compressing (i.e., it isn't already encoded or compressed, and
+    may be transformed).
+    """
+    if get_header(res_hdrs, 'content-encoding') or \
+      get_header(res_hdrs, 'content-range'):
+        return False
+    if 'no-transform' in [v.lower() for v in
+                          get_header(res_hdrs, 'cache-control')]:
+        return False
+    ctype = get_header(res_hdrs, 'content-type')
+    if not ctype:
+        return False
+    ctype = ctype[0].split(";", 1)[0].strip().lower()
+    if ctype in uncompressed_types:
+        return True
+    if ctype in precompressed_types or \
+      ctype.split("/", 1)[0] in precompressed_majors:
+        return False
+    return True
+
+def variant_etag(etag, coding):
+    "Return the ETag to use for the coding variant of a response."
+    if etag.endswith('"'):
+        return '%s-%s"' % (etag[:-1], coding)
+    return etag
+
+
+class Compressor(object):
+    """
+    Compresses a body with coding, a chunk at a time.
+
+    If sync is True, everything given to compress is flushed, so that it
+    can be decompressed as soon as it's received (at some cost in size).
+    """
+
+    def __init__(self, coding, level=6, sync=False):
+        if coding == 'gzip':
+            wbits = 16 + zlib.MAX_WBITS
+        else:
+            wbits = zlib.MAX_WBITS
+        self.coding = coding
+        self.sync = sync
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, chunk):
+        """
+        Return the compressed form of chunk, which may be empty until there's
+        enough data to compress (unless sync is True).
+        """
+        if self.sync:
+            if not chunk:
+                return ""
+            return self._zlib.compress(chunk) + \
+                self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        return self._zlib.compress(chunk)
+
+    def flush(self, finish=True):
+        """
+        Return whatever's left; if finish is False, the body can be
+        continued (e.g., to push what's been compressed so far to the
+        client).
+        """
+        if finish:
+            return self._zlib.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Decompressor(object):
+    "Decompresses a body encoded with coding, a chunk at a time."
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding in ['gzip', 'x-gzip']:
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS)
+        self._started = False
+
+    def decompress(self, chunk):
+        "Return the decompressed form of chunk. Raises zlib.error."
+        if not self._started and self.coding == 'deflate' and chunk:
+            self._started = True
+            # some servers send raw deflate, without the zlib wrapper.
+            try:
+                return self._zlib.decompress(chunk)
+            except zlib.error:
+                self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._zlib.decompress(chunk)
+
+    def flush(self):
+        "Return whatever's left."
+        return self._zlib.flush()
+
+
+class VariantCache(object):
+    """
+    Holds up to max_size bytes of compressed bodies, discarding the least
+    recently used when it's full.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._bodies = {} # key: (body, token)
+        self._lru = deque() # (token, key), least recently used first
+
+    def get(self, key):
+        "Return the body stored for key, or None."
+        entry = self._bodies.get(key)
+        if entry is None:
+            return None
+        body = entry[0]
+        self._touch(key, body)
+        return body
+
+    def put(self, key, body):
+        "Store body under key."
+        if len(body) > self.max_size:
+            return
+        self.remove(key)
+        self.size += len(body)
+        self._touch(key, body)
+        while self.size > self.max_size:
+            token, old_key = self._lru.popleft()
+            entry = self._bodies.get(old_key)
+            if entry and entry[1] is token:
+                self.remove(old_key)
+
+    def remove(self, key):
+        entry = self._bodies.pop(key, None)
+        if entry:
+            self.size -= len(entry[0])
+
+    def _touch(self, key, body):
+        token = object()
+        self._bodies[key] = (body, token)
+        self._lru.append((token, key))
+        if len(self._lru) > 2 * len(self._bodies) + 64:
+            self._lru = deque([(t, k) for (t, k) in self._lru
+                               if self._bodies.get(k, (0, 0))[1] is t])
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""
+Thor Disk Store
+
+This library stores large response bodies on disk for HttpCache, in
+append-only segment files. Stored bodies are read back as buffers over
+memory-mapped segments, so they can be written to a TcpConnection without
+being copied into strings.
+
+The index is saved to disk from time to time, and on start-up whatever was
+written after it was saved is recovered from the segments, so a warm store
+stays warm across restarts.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+# each record is a header, then JSON metadata, then the body.
+record_magic = "THR1"
+record_hdr = struct.Struct("!4sIQ") # magic, meta length, body length
+index_version = 1
+
+
+class DiskStore(object):
+    """
+    Stores bodies (with some metadata) under string keys, in segment files
+    in directory.
+
+    New records are appended to the current segment until it reaches
+    segment_size bytes. When all of the segments add up to more than
+    max_size bytes, the oldest one is deleted, along with everything in it.
+
+    It can be used from more than one thread, so that (e.g.) put can run
+    on a loop's pool while get is used on the loop.
+    """
+
+    chunk_size = 256 * 1024 # size of the buffers get() returns
+    index_every = 100 # save the index after this many changes
+
+    def __init__(self, directory, max_size=4 * 1024 * 1024 * 1024,
+                 segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.max_entry_size = min(segment_size, max_size)
+        self.size = 0 # bytes in segments
+        self._index = {} # key: (segment, body offset, body length, meta)
+        self._segments = {} # segment: size
+        self._maps = {} # segment: mmap
+        self._active = None # segment being appended to
+        self._active_file = None
+        self._changes = 0
+        self._lock = threading.RLock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append(self.directory)
+        status.append('%s entries' % len(self._index))
+        status.append('%s bytes' % self.size)
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def has(self, key):
+        "Return whether key is stored."
+        self._lock.acquire()
+        try:
+            return key in self._index
+        finally:
+            self._lock.release()
+
+    def items(self):
+        "Return a list of (key, meta) for everything stored."
+        self._lock.acquire()
+        try:
+            return [(key, entry[3]) for (key, entry) in self._index.items()]
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """
+        Return the body stored for key as a list of buffers, or None if
+        there isn't one.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            segment, offset, length = entry[:3]
+            body_map = self._map(segment, offset + length)
+        finally:
+            self._lock.release()
+        return [
+            buffer(body_map, i, min(self.chunk_size, offset + length - i))
+            for i in xrange(offset, offset + length, self.chunk_size)
+        ]
+
+    def put(self, key, meta, chunks):
+        """
+        Store the body in the list of strings chunks under key, along with
+        the dictionary meta (which must be serialisable as JSON; strings in
+        it are returned as unicode after a restart). Returns False if it's
+        too big to store.
+        """
+        length = sum([len(chunk) for chunk in chunks])
+        if length > self.max_entry_size:
+            return False
+        meta = dict(meta, key=key)
+        self._lock.acquire()
+        try:
+            segment, offset = self._append(meta, chunks, length)
+            self._index[key] = (segment, offset, length, meta)
+            self._changed()
+        finally:
+            self._lock.release()
+        return True
+
+    def delete(self, key):
+        "Remove key from the store."
+        self._lock.acquire()
+        try:
+            if self._index.pop(key, None) is not None:
+                self._append({'key': key, 'deleted': True}, [], 0)
+                self._changed()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        "Remove everything from the store."
+        self._lock.acquire()
+        try:
+            for segment in self._segments.keys():
+                self._drop_segment(segment)
+            self._save_index()
+        finally:
+            self._lock.release()
+
+    def sync(self):
+        "Save the index, so that start-up doesn't need to scan segments."
+        self._lock.acquire()
+        try:
+            self._save_index()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        "Save the index and close the active segment."
+        self._lock.acquire()
+        try:
+            self._close_active()
+            self._save_index()
+        finally:
+            self._lock.release()
+
+    # segments
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segment_path(self, segment):
+        return self._path("segment-%08d" % segment)
+
+    def _append(self, meta, chunks, length):
+        """
+        Append a record to the active segment, returning its segment and the
+        offset of its body.
+        """
+        meta_str = json.dumps(meta, encoding='latin-1')
+        record_len = record_hdr.size + len(meta_str) + length
+        if self._active is None or \
+          self._segments[self._active] + record_len > self.segment_size:
+            self._new_segment()
+        segment = self._active
+        start = self._segments[segment]
+        out = self._active_file
+        out.write(record_hdr.pack(record_magic, len(meta_str), length))
+        out.write(meta_str)
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
+        self._segments[segment] += record_len
+        self.size += record_len
+        while self.size > self.max_size and len(self._segments) > 1:
+            self._drop_segment(min(self._segments))
+        return segment, start + record_hdr.size + len(meta_str)
+
+    def _new_segment(self):
+        "Start appending to a new segment."
+        self._close_active()
+        segment = max(self._segments.keys() or [0]) + 1
+        self._active = segment
+        self._active_file = open(self._segment_path(segment), 'ab')
+        self._segments[segment] = 0
+
+    def _close_active(self):
+        if self._active_file:
+            self._active_file.close()
+        self._active = None
+        self._active_file = None
+
+    def _drop_segment(self, segment):
+        "Delete a segment and everything in it."
+        if segment == self._active:
+            self._close_active()
+        for key, entry in self._index.items():
+            if entry[0] == segment:
+                del self._index[key]
+        self.size -= self._segments.pop(segment)
+        # buffers from get() may still be using the map; it'll be unmapped
+        # when they're gone.
+        self._maps.pop(segment, None)
+        try:
+            os.unlink(self._segment_path(segment))
+        except OSError:
+            pass
+
+    def _map(self, segment, end):
+        "Return a map of segment that extends to at least end."
+        body_map = self._maps.get(segment)
+        if body_map is None or len(body_map) < end:
+            fh = open(self._segment_path(segment), 'rb')
+            try:
+                body_map = mmap.mmap(
+                    fh.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ
+                )
+            finally:
+                fh.close()
+            self._maps[segment] = body_map
+        return body_map
+
+    # index
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= self.index_every:
+            self._save_index()
+
+    def _save_index(self):
+        "Save the index (with the lock held)."
+        self._changes = 0
+        index = {
+            'version': index_version,
+            'segments': self._segments,
+            'entries': self._index,
+        }
+        tmp_path = self._path("index.tmp")
+        out = open(tmp_path, 'wb')
+        try:
+            json.dump(index, out)
+        finally:
+            out.close()
+        os.rename(tmp_path, self._path("index"))
+
+    def _load(self):
+        """
+        Load the index, then bring it up to date by scanning whatever has
+        been written to the segments since it was saved.
+        """
+        on_disk = {}
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-"):
+                try:
+                    segment = int(name[8:])
+                except ValueError:
+                    continue
+                on_disk[segment] = os.path.getsize(self._segment_path(segment))
+        try:
+            fh = open(self._path("index"), 'rb')
+            try:
+                index = json.load(fh)
+            finally:
+                fh.close()
+            if index.get('version') != index_version:
+                raise ValueError
+            seen = dict([(int(segment), size)
+                         for (segment, size) in index['segments'].items()])
+            entries = index['entries']
+        except (IOError, ValueError, KeyError):
+            seen = {}
+            entries = {}
+        for key, (segment, offset, length, meta) in entries.items():
+            if on_disk.get(segment, 0) >= offset + length:
+                self._index[key.encode('latin-1')] = \
+                    (segment, offset, length, meta)
+        for segment in sorted(on_disk):
+            start = min(seen.get(segment, 0), on_disk[segment])
+            size = self._scan(segment, start)
+            self._segments[segment] = size
+            self.size += size
+
+    def _scan(self, segment, start):
+        """
+        Read the records in segment after start into the index, returning
+        where the last complete one ends. Anything after that (e.g., from a
+        crash while writing) is truncated.
+        """
+        path = self._segment_path(segment)
+        fh = open(path, 'rb')
+        try:
+            fh.seek(start)
+            pos = start
+            while True:
+                header = fh.read(record_hdr.size)
+                if len(header) < record_hdr.size:
+                    break
+                magic, meta_len, length = record_hdr.unpack(header)
+                if magic != record_magic:
+                    break
+                try:
+                    meta = json.loads(fh.read(meta_len))
+                except ValueError:
+                    break
+                offset = pos + record_hdr.size + meta_len
+                fh.seek(length, 1)
+                if fh.tell() != offset + length or \
+                  os.fstat(fh.fileno()).st_size < offset + length:
+                    break
+                key = meta.get('key', u'').encode('latin-1')
+                if meta.get('deleted'):
+                    self._index.pop(key, None)
+                else:
+                    self._index[key] = (segment, offset, length, meta)
+                pos = offset + length
+        finally:
+            fh.close()
+        if os.path.getsize(path) > pos:
+            fh = open(path, 'r+b')
+            try:
+                fh.truncate(pos)
+            finally:
+                fh.close()
+        return pos
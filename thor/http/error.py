@@ -82,6 +82,10 @@ class TooManyMsgsError(HttpError):
     desc = "Too many messages to parse"
     server_status = ("400", "Bad Request")
 
+class ContentCodingError(HttpError):
+    desc = "Content-coding error"
+    server_status = ("502", "Bad Gateway")
+
 # client-specific errors
 
 class UrlError(HttpError):
@@ -103,3 +107,11 @@ class ConnectError(HttpError):
 class HostRequiredError(HttpError):
     desc = "Host header required"
     server_recoverable = True
+
+class BodyTooLargeError(HttpError):
+    desc = "Request body too large"
+    server_status = ("413", "Request Entity Too Large")
+
+class FormError(HttpError):
+    desc = "Malformed form data"
+    server_status = ("400", "Bad Request")
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Form Parsing
+
+Parsers for request bodies in the application/x-www-form-urlencoded and
+multipart/form-data formats that consume the body a chunk at a time, as
+it arrives, so that uploads don't have to be buffered to be understood:
+
+> parser = form_parser(req_hdrs)
+> parser.on('part_start', start_part)
+> exchange.on('request_body', parser.feed)
+> exchange.on('request_done', lambda trailers: parser.close())
+
+FormCollector gathers what a parser emits into fields and files, keeping
+uploaded files in memory until they get big, then on disk.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import re
+import tempfile
+from urllib import unquote_plus
+
+from thor.events import EventEmitter
+from thor.http.common import get_header
+from thor.http.error import FormError
+
+_param = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+_quoted_pair = re.compile(r'\\(.)')
+
+# multipart parser states
+PREAMBLE = 'preamble'
+DELIMITER = 'delimiter'
+HEADERS = 'headers'
+BODY = 'body'
+EPILOGUE = 'epilogue'
+ERROR = 'error'
+
+
+def parse_params(value):
+    """
+    Given a header value like 'form-data; name="a"', return the lowercased
+    value before the parameters and a dictionary of the parameters (with
+    lowercased names).
+    """
+    main, semi, rest = value.partition(";")
+    params = {}
+    for name, val in _param.findall(semi + rest):
+        val = val.strip()
+        if val[:1] == '"':
+            val = _quoted_pair.sub(r'\1', val[1:-1])
+        params[name.lower()] = val
+    return main.strip().lower(), params
+
+
+def form_parser(hdr_tuples):
+    """
+    Return a parser for a request body with the header tuples hdr_tuples,
+    or None if it isn't a form. Raises FormError if it's a multipart body
+    without a boundary.
+    """
+    values = get_header(hdr_tuples, 'content-type')
+    if not values:
+        return None
+    media_type, params = parse_params(values[-1])
+    if media_type == 'application/x-www-form-urlencoded':
+        return UrlEncodedParser()
+    if media_type == 'multipart/form-data':
+        if not params.get('boundary'):
+            raise FormError("no boundary")
+        return MultipartParser(params['boundary'])
+    return None
+
+
+class UrlEncodedParser(EventEmitter):
+    """
+    Parses an application/x-www-form-urlencoded body as it's fed.
+
+    Emits:
+     - field (name, value): a name/value pair
+     - done (): the whole body has been parsed
+     - error (err): a FormError; nothing else is emitted afterwards
+
+    Only one field is buffered at a time; if one is longer than
+    max_field_size bytes, it's an error.
+    """
+
+    def __init__(self, max_field_size=64 * 1024):
+        EventEmitter.__init__(self)
+        self.max_field_size = max_field_size
+        self._buffer = ""
+        self._failed = False
+
+    def feed(self, chunk):
+        "Parse the next chunk of the body."
+        if self._failed:
+            return
+        pairs = (self._buffer + chunk).split("&")
+        self._buffer = pairs.pop()
+        for pair in pairs:
+            self._field(pair)
+        if len(self._buffer) > self.max_field_size:
+            self._fail(FormError("field over %s bytes" % self.max_field_size))
+
+    def close(self):
+        "The body is complete."
+        if self._failed:
+            return
+        if self._buffer:
+            self._field(self._buffer)
+            self._buffer = ""
+        self.emit('done')
+
+    def _field(self, pair):
+        if pair:
+            name, equals, value = pair.partition("=")
+            self.emit('field', unquote_plus(name), unquote_plus(value))
+
+    def _fail(self, err):
+        self._failed = True
+        self._buffer = ""
+        self.emit('error', err)
+
+
+class MultipartParser(EventEmitter):
+    """
+    Parses a multipart/form-data body delimited by boundary as it's fed.
+
+    Emits:
+     - part_start (headers, name, filename): a part has started; headers
+       is a list of header tuples, and name and filename are from its
+       Content-Disposition (filename is None unless it's a file).
+     - part_body (chunk): a chunk of the part's body
+     - part_done (): the part is complete
+     - done (): the whole body has been parsed
+     - error (err): a FormError; nothing else is emitted afterwards
+
+    Part bodies are emitted as they arrive; only enough of the body to
+    recognise the next boundary is held back. Part headers longer than
+    max_header_size bytes are an error.
+    """
+
+    def __init__(self, boundary, max_header_size=16 * 1024):
+        EventEmitter.__init__(self)
+        self.boundary = boundary
+        self.max_header_size = max_header_size
+        self._delimiter = "\r\n--" + boundary
+        # so that a boundary at the very start matches the delimiter.
+        self._buffer = "\r\n"
+        self._state = PREAMBLE
+
+    def feed(self, chunk):
+        "Parse the next chunk of the body."
+        if self._state in [EPILOGUE, ERROR]:
+            return
+        self._buffer += chunk
+        while getattr(self, '_handle_%s' % self._state)():
+            pass
+
+    def close(self):
+        "The body is complete."
+        if self._state == ERROR:
+            return
+        if self._state != EPILOGUE:
+            self._fail("body ended before the final boundary")
+            return
+        self.emit('done')
+
+    def _handle_preamble(self):
+        "Discard everything before the first boundary."
+        found = self._buffer.find(self._delimiter)
+        if found == -1:
+            self._buffer = self._buffer[-len(self._delimiter):]
+            return False
+        self._buffer = self._buffer[found + len(self._delimiter):]
+        self._state = DELIMITER
+        return True
+
+    def _handle_delimiter(self):
+        "Work out whether a boundary ends the body or starts another part."
+        if self._buffer[:2] == "--":
+            self._buffer = ""
+            self._state = EPILOGUE
+            return False
+        found = self._buffer.find("\r\n")
+        if found == -1:
+            if len(self._buffer) > self.max_header_size:
+                self._fail("malformed boundary")
+            return False
+        if self._buffer[:found].strip(" \t"):
+            self._fail("malformed boundary")
+            return False
+        self._buffer = self._buffer[found + 2:]
+        self._state = HEADERS
+        return True
+
+    def _handle_headers(self):
+        "Parse a part's headers."
+        if self._buffer[:2] == "\r\n": # no headers at all
+            block, rest = "", self._buffer[2:]
+        else:
+            found = self._buffer.find("\r\n\r\n")
+            if found == -1:
+                if len(self._buffer) > self.max_header_size:
+                    self._fail("part headers over %s bytes" %
+                               self.max_header_size)
+                return False
+            block, rest = self._buffer[:found], self._buffer[found + 4:]
+        hdr_tuples = []
+        for line in block.split("\r\n") if block else []:
+            if line[:1] in [" ", "\t"] and hdr_tuples: # continuation
+                name, value = hdr_tuples.pop()
+                hdr_tuples.append((name, value + " " + line.strip()))
+                continue
+            name, colon, value = line.partition(":")
+            if not colon or not name.strip():
+                self._fail("malformed part header")
+                return False
+            hdr_tuples.append((name.strip(), value.strip()))
+        self._buffer = rest
+        self._state = BODY
+        disposition = get_header(hdr_tuples, 'content-disposition')
+        params = disposition and parse_params(disposition[-1])[1] or {}
+        self.emit('part_start', hdr_tuples, params.get('name'),
+                  params.get('filename'))
+        return True
+
+    def _handle_body(self):
+        "Emit a part's body, up to the next boundary."
+        buf = self._buffer
+        found = buf.find(self._delimiter)
+        if found == -1:
+            # hold back anything that could be the start of a delimiter.
+            keep = buf.find("\r", max(len(buf) - len(self._delimiter), 0))
+            if keep == -1:
+                keep = len(buf)
+            if keep:
+                self._buffer = buf[keep:]
+                self.emit('part_body', buf[:keep])
+            return False
+        self._buffer = buf[found + len(self._delimiter):]
+        self._state = DELIMITER
+        if found:
+            self.emit('part_body', buf[:found])
+        self.emit('part_done')
+        return True
+
+    def _handle_epilogue(self):
+        return False
+
+    def _handle_error(self):
+        return False
+
+    def _fail(self, detail):
+        self._state = ERROR
+        self._buffer = ""
+        self.emit('error', FormError(detail))
+
+
+class FormFile(object):
+    "A file uploaded in a form."
+
+    def __init__(self, name, filename, headers, fileobj):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+        self.file = fileobj # positioned at the start once complete
+        self.size = 0
+
+    def __repr__(self):
+        return "<%s.%s %s (%s bytes) at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.filename, self.size, id(self))
+
+
+class FormCollector(EventEmitter):
+    """
+    Collects what parser (a UrlEncodedParser or MultipartParser) emits.
+
+    Emits:
+     - done (fields, files): fields is a list of (name, value) tuples, and
+       files is a list of FormFile, for the parts that had a filename.
+     - error (err): a FormError
+
+    Fields longer than max_field_size bytes are an error. Files are kept
+    in memory until they're bigger than spool_size bytes, and then in a
+    temporary file (in tmpdir, if given).
+    """
+
+    def __init__(self, parser, max_field_size=64 * 1024,
+                 spool_size=1024 * 1024, tmpdir=None):
+        EventEmitter.__init__(self)
+        self.max_field_size = max_field_size
+        self.spool_size = spool_size
+        self.tmpdir = tmpdir
+        self.fields = []
+        self.files = []
+        self._part = None # (name, chunks, size) or a FormFile
+        self._failed = False
+        parser.on('field', self._field)
+        parser.on('part_start', self._part_start)
+        parser.on('part_body', self._part_body)
+        parser.on('part_done', self._part_done)
+        parser.on('done', self._done)
+        parser.on('error', self._error)
+
+    def _field(self, name, value):
+        self.fields.append((name, value))
+
+    def _part_start(self, hdr_tuples, name, filename):
+        if self._failed:
+            return
+        if filename is None:
+            self._part = (name, [], [0])
+        else:
+            fileobj = tempfile.SpooledTemporaryFile(
+                self.spool_size, dir=self.tmpdir
+            )
+            self._part = FormFile(name, filename, hdr_tuples, fileobj)
+            self.files.append(self._part)
+
+    def _part_body(self, chunk):
+        part = self._part
+        if isinstance(part, FormFile):
+            part.file.write(chunk)
+            part.size += len(chunk)
+        elif part is not None:
+            name, chunks, size = part
+            size[0] += len(chunk)
+            if size[0] > self.max_field_size:
+                self._error(
+                    FormError("field over %s bytes" % self.max_field_size)
+                )
+                return
+            chunks.append(chunk)
+
+    def _part_done(self):
+        part, self._part = self._part, None
+        if isinstance(part, FormFile):
+            part.file.seek(0)
+        elif part is not None:
+            self.fields.append((part[0], "".join(part[1])))
+
+    def _done(self):
+        if not self._failed:
+            self.emit('done', self.fields, self.files)
+
+    def _error(self, err):
+        if self._failed:
+            return
+        self._failed = True
+        self._part = None
+        for form_file in self.files:
+            form_file.file.close()
+        self.files = []
+        self.emit('error', err)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Metrics Server
+
+This is an HttpServer that makes metrics from thor.metrics available in the
+Prometheus text exposition format, so that they can be scraped.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from urlparse import urlsplit
+
+from thor import metrics
+from thor.events import on
+from thor.http.server import HttpServer
+
+
+class MetricsServer(HttpServer):
+    """
+    Serves the metrics in registry (by default, thor.metrics.registry) at
+    path on host:port.
+    """
+
+    path = "/metrics"
+    content_type = "text/plain; version=0.0.4"
+
+    def __init__(self, host, port, registry=None, loop=None):
+        HttpServer.__init__(self, host, port, loop)
+        self.registry = registry or metrics.registry
+        self.on('exchange', self.handle_exchange)
+
+    def handle_exchange(self, exchange):
+        @on(exchange)
+        def request_done(trailers):
+            if urlsplit(exchange.uri).path != self.path:
+                status, phrase = "404", "Not Found"
+                body = "Not Found\n"
+            elif exchange.method not in ["GET", "HEAD"]:
+                status, phrase = "405", "Method Not Allowed"
+                body = "Method Not Allowed\n"
+            else:
+                status, phrase = "200", "OK"
+                body = metrics.prometheus_text(self.registry.collect())
+            exchange.response_start(status, phrase, [
+                ('Content-Type', self.content_type),
+                ('Content-Length', str(len(body))),
+                ('Cache-Control', 'no-store')
+            ])
+            if exchange.method != "HEAD":
+                exchange.response_body(body)
+            exchange.response_done([])
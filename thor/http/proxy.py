@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Proxy
+
+This library relays requests received by an HttpServer to their origin
+servers using an HttpClient, streaming request and response bodies in
+both directions without buffering them, and pausing each side when the
+other can't keep up.
+
+It can act as a forward proxy (using the absolute request-target that
+clients send to proxies), or as a reverse proxy / gateway in front of a
+single upstream.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from thor.events import EventEmitter
+from thor.http.client import HttpClient
+from thor.http.common import hop_by_hop_hdrs, get_header
+
+
+def strip_hop_by_hop(hdr_tuples):
+    """
+    Given a list of header tuples, return it without the hop-by-hop
+    headers, including any named in the Connection header. Surrounding
+    whitespace is removed from the names and values that are left.
+    """
+    omit = set(hop_by_hop_hdrs)
+    omit.update([v.lower() for v in get_header(hdr_tuples, 'connection')])
+    return [(n.strip(), v.strip()) for (n, v) in hdr_tuples
+            if n.strip().lower() not in omit]
+
+
+class HttpProxy(EventEmitter):
+    """
+    Relays exchanges on server to upstream servers, using client.
+
+    Emits:
+      - exchange (proxy_exchange): for each exchange being relayed.
+
+    If upstream is given (e.g., "http://127.0.0.1:8000"), request
+    paths are relayed to it; otherwise, the absolute URIs that clients
+    send to forward proxies are used.
+
+    To change what's sent, subclass and override target_uri,
+    rewrite_request and/or rewrite_response.
+    """
+
+    def __init__(self, server, upstream=None, client=None):
+        EventEmitter.__init__(self)
+        self.server = server
+        self.upstream = upstream and upstream.rstrip("/")
+        self.client = client or HttpClient(server.loop)
+        server.on('exchange', self.handle_exchange)
+
+    def handle_exchange(self, server_ex):
+        proxy_ex = HttpProxyExchange(self, server_ex)
+        self.emit('exchange', proxy_ex)
+
+    def target_uri(self, method, uri, req_hdrs):
+        "Return the URI that the request should be sent to."
+        if self.upstream:
+            if uri[:1] != "/":
+                # absolute-form; just keep the path.
+                uri = "/" + uri.split("/", 3)[-1]
+            return self.upstream + uri
+        return uri
+
+    def rewrite_request(self, method, uri, req_hdrs):
+        "Return the request headers to send upstream."
+        return req_hdrs
+
+    def rewrite_response(self, status, phrase, res_hdrs):
+        "Return the response headers to send downstream."
+        return res_hdrs
+
+
+class HttpProxyExchange(object):
+    """
+    A request/response being relayed by an HttpProxy; ties an exchange on
+    the server to one on the client.
+    """
+
+    def __init__(self, proxy, server_ex):
+        self.proxy = proxy
+        self.server_ex = server_ex
+        self.client_ex = proxy.client.exchange()
+        self.http_conn = server_ex.http_conn
+        self.res_started = False
+        self.done = False
+
+        server_ex.on('request_start', self.request_start)
+        server_ex.on('request_body', self.client_ex.request_body)
+        server_ex.on('request_done', self.client_ex.request_done)
+
+        self.client_ex.on('pause', self.request_pause)
+        self.client_ex.on('response_start', self.response_start)
+        self.client_ex.on('response_body', self.response_body)
+        self.client_ex.on('response_done', self.response_done)
+        self.client_ex.on('error', self.error)
+
+        self.http_conn.on('pause', self.client_ex.res_body_pause)
+        self.http_conn.tcp_conn.on('close', self.abort)
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s {%s}' % (
+            self.server_ex.method or "-", self.client_ex.uri or "-"
+        ))
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    # request: server -> client
+
+    def request_start(self, method, uri, req_hdrs):
+        target = self.proxy.target_uri(method, uri, req_hdrs)
+        req_hdrs = self.proxy.rewrite_request(
+            method, target, strip_hop_by_hop(req_hdrs)
+        )
+        self.client_ex.request_start(method, target, req_hdrs)
+
+    def request_pause(self, paused):
+        "Stop/start reading the request body while upstream can't take it."
+        if self.http_conn.tcp_conn:
+            self.http_conn.req_body_pause(paused)
+
+    # response: client -> server
+
+    def response_start(self, status, phrase, res_hdrs):
+        if self.done:
+            return
+        self.res_started = True
+        res_hdrs = self.proxy.rewrite_response(
+            status, phrase, strip_hop_by_hop(res_hdrs)
+        )
+        self.server_ex.response_start(status, phrase, res_hdrs)
+
+    def response_body(self, chunk):
+        if self.done:
+            return
+        self.server_ex.response_body(chunk)
+
+    def response_done(self, trailers):
+        if self.done:
+            return
+        self.server_ex.response_done(trailers)
+        self._finish()
+
+    def error(self, err):
+        "Something went wrong upstream; tell the client if we still can."
+        if self.done:
+            return
+        if self.res_started:
+            # too late to say anything; all we can do is drop it.
+            self.abort()
+            return
+        status_code, status_phrase = err.server_status or \
+            (502, 'Bad Gateway')
+        body = err.desc
+        if err.detail:
+            body += " (%s)" % err.detail
+        self.server_ex.response_start(status_code, status_phrase, [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(body)))
+        ])
+        self.server_ex.response_body(body)
+        self.server_ex.response_done([])
+        self._finish()
+
+    def abort(self):
+        "Give up on the exchange, closing both sides."
+        if self.done:
+            return
+        self._finish()
+        if self.http_conn.tcp_conn:
+            self.http_conn.tcp_conn.close()
+        self.client_ex.abort()
+
+    def _finish(self):
+        "Stop listening to the connections' events."
+        self.done = True
+        self.http_conn.removeListener('pause', self.client_ex.res_body_pause)
+        tcp_conn = self.http_conn.tcp_conn
+        if tcp_conn:
+            if self.abort in tcp_conn.listeners('close'):
+                tcp_conn.removeListener('close', self.abort)
+            if tcp_conn.tcp_connected:
+                self.http_conn.req_body_pause(False)
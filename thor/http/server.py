@@ -7,7 +7,8 @@ This library allow implementation of an HTTP/1.1 server that is
 "non-blocking," "asynchronous" and "event-driven" -- i.e., it achieves very
 high performance and concurrency, so long as the application code does not
 block (e.g., upon network, disk or database access). Blocking on one request
-will block the entire server.
+will block the entire server; use loop.run_in_pool for work that can't avoid
+blocking.
 
 """
 
@@ -34,20 +35,57 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+from collections import deque
 import os
 import sys
 
-from thor import schedule
+import thor
+from thor import metrics
 from thor.events import EventEmitter, on
-from thor.tcp import TcpServer
+from thor.tcp import TcpServer, map_file
 
 from thor.http.common import HttpMessageHandler, \
     CLOSE, COUNTED, CHUNKED, \
     ERROR, \
     hop_by_hop_hdrs, \
     get_header, header_names
+from thor.http.compress import Compressor, VariantCache, \
+    negotiate, compressible, variant_etag
 from thor.http.error import HttpVersionError, HostRequiredError, \
-    TransferCodeError
+    TransferCodeError, BodyTooLargeError
+
+
+def parse_range(value, size):
+    """
+    Given the value of a Range header and the size of the representation
+    it applies to, return (first, last) for the byte range it asks for, or
+    None if it can't be satisfied.
+
+    Raises ValueError if the header should be ignored (e.g., it's malformed
+    or asks for more than one range).
+    """
+    unit, equals, spec = value.partition("=")
+    if not equals or unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        raise ValueError
+    first, last = first.strip(), last.strip()
+    if first == "":
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return None
+        return max(size - suffix, 0), size - 1
+    first = int(first)
+    if last == "":
+        last = size - 1
+    else:
+        last = int(last)
+        if last < first:
+            raise ValueError
+    if first >= size:
+        return None
+    return first, min(last, size - 1)
 
 
 class HttpServer(EventEmitter):
@@ -55,18 +93,23 @@ class HttpServer(EventEmitter):
 
     tcp_server_class = TcpServer
     idle_timeout = 60 # in seconds
+    compress_level = None # zlib level to compress responses with, if any
+    compress_min_size = 256 # don't compress smaller bodies (in bytes)
+    compress_flush = True # send what each response_body call compresses
+    compress_chunk_size = 64 * 1024 # file bytes to compress per loop step
+    compressed_files_size = 32 * 1024 * 1024 # in bytes
+    max_body_size = None # largest request body allowed (in bytes), if any
 
     def __init__(self, host, port, loop=None):
         EventEmitter.__init__(self)
-        self.tcp_server = self.tcp_server_class(host, port, loop=loop)
+        self.loop = loop or thor.loop.get_loop()
+        self.compressed_files = VariantCache(self.compressed_files_size)
+        self.tcp_server = self.tcp_server_class(host, port, loop=self.loop)
         self.tcp_server.on('connect', self.handle_conn)
-        schedule(0, self.emit, 'start')
+        self.loop.schedule(0, self.emit, 'start')
 
     def handle_conn(self, tcp_conn):
-        http_conn = HttpServerConnection(tcp_conn, self)
-        tcp_conn.on('data', http_conn.handle_input)
-        tcp_conn.on('close', http_conn.conn_closed)
-        tcp_conn.on('pause', http_conn.res_body_pause)
+        tcp_conn.protocol = HttpServerConnection(tcp_conn, self)
         tcp_conn.pause(False)
 
     def shutdown(self):
@@ -78,12 +121,18 @@ class HttpServer(EventEmitter):
 
 class HttpServerConnection(HttpMessageHandler, EventEmitter):
     "A handler for an HTTP server connection."
+
+    __slots__ = HttpMessageHandler.handler_slots + ('tcp_conn', 'server',
+        'ex_queue', 'res_queue', 'outstanding', 'output_paused')
+
     def __init__(self, tcp_conn, server):
         HttpMessageHandler.__init__(self)
         EventEmitter.__init__(self)
         self.tcp_conn = tcp_conn
         self.server = server
         self.ex_queue = [] # queue of exchanges
+        self.res_queue = deque() # exchanges whose responses haven't been sent
+        self.outstanding = 0 # exchanges whose responses haven't finished
         self.output_paused = False
 
     def req_body_pause(self, paused):
@@ -91,7 +140,8 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
         Indicate that the server should pause (True) or unpause (False) the
         request.
         """
-        self.tcp_conn.pause(paused)
+        if self.tcp_conn:
+            self.tcp_conn.pause(paused)
 
     # Methods called by tcp
 
@@ -107,12 +157,18 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
 #        for exchange in self.ex_queue:
 #            exchange.pause() # FIXME - maybe a connclosed err?
         self.ex_queue = []
+        self.res_queue.clear()
         self.tcp_conn = None
 
+    # TcpConnection protocol
+    pause_writing = res_body_pause
+    connection_lost = conn_closed
+
     # Methods called by common.HttpRequestHandler
 
     def output(self, data):
-        self.tcp_conn.write(data)
+        if self.tcp_conn: # we may have given up on the connection
+            self.tcp_conn.write(data)
 
     def input_start(self, top_line, hdr_tuples, conn_tokens,
         transfer_codes, content_length):
@@ -120,6 +176,8 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
         Take the top set of headers from the input stream, parse them
         and queue the request to be processed by the application.
         """
+        if self.tcp_conn is None: # we gave up on the connection
+            raise ValueError
         try:
             method, _req_line = top_line.split(None, 1)
             uri, req_version = _req_line.rsplit(None, 1)
@@ -136,10 +194,20 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
             if code not in ['identity', 'chunked']:
                 self.input_error(TransferCodeError(code))
                 raise ValueError
+        max_size = self.server.max_body_size
+        if max_size is not None and content_length is not None and \
+          content_length > max_size:
+            self.input_error(BodyTooLargeError(
+                "%s bytes; limit is %s" % (content_length, max_size)
+            ))
+            raise ValueError
         exchange = HttpServerExchange(
             self, method, uri, hdr_tuples, req_version
         )
         self.ex_queue.append(exchange)
+        self.queue_response(exchange)
+        if metrics.enabled:
+            metrics.http_server_outstanding.observe(self.outstanding)
         self.server.emit('exchange', exchange)
         if not self.output_paused:
             # we only start new requests if we have some output buffer 
@@ -150,11 +218,44 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
 
     def input_body(self, chunk):
         "Process a request body chunk from the wire."
-        self.ex_queue[-1].emit('request_body', chunk)
+        if self.tcp_conn is None:
+            return
+        exchange = self.ex_queue[-1]
+        exchange.body_received += len(chunk)
+        max_size = self.server.max_body_size
+        if max_size is not None and exchange.body_received > max_size:
+            self._body_too_large(exchange, max_size)
+        elif exchange._body_credit is None:
+            exchange.emit('request_body', chunk)
+        else:
+            if exchange._held_body is None:
+                exchange._held_body = deque()
+            exchange._held_body.append(chunk)
+            exchange._release_body()
 
     def input_end(self, trailers):
         "Indicate that the request body is complete."
-        self.ex_queue[-1].emit('request_done', trailers)
+        if self.tcp_conn is None:
+            return
+        exchange = self.ex_queue[-1]
+        if exchange._body_credit is None:
+            exchange.emit('request_done', trailers)
+        else:
+            exchange._held_done = trailers
+            exchange._release_body()
+
+    def _body_too_large(self, exchange, max_size):
+        """
+        The request body has grown past max_size; answer with 413 (if the
+        response hasn't started) and give up on the connection.
+        """
+        err = BodyTooLargeError("limit is %s bytes" % max_size)
+        self._input_state = ERROR
+        exchange.emit('error', err)
+        if not exchange.response_started:
+            exchange._response_error(err)
+        tcp_conn, self.tcp_conn = self.tcp_conn, None
+        tcp_conn.close()
 
     def input_error(self, err):
         """
@@ -162,19 +263,11 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
         hasn't been queued as an exchange yet).
         """
         self._input_state = ERROR
-        status_code, status_phrase = err.server_status or \
-            (500, 'Internal Server Error')
-        hdrs = [
-            ('Content-Type', 'text/plain'),
-        ]
-        body = err.desc
-        if err.detail:
-            body += " (%s)" % err.detail
-        ex = HttpServerExchange(self, "1.1") # FIXME
-        ex.response_start(status_code, status_phrase, hdrs)
-        ex.response_body(body)
-        ex.response_done([])
+        # a 1.0 exchange, so that the connection is closed afterwards.
+        ex = HttpServerExchange(self, None, None, [], "1.0")
         self.ex_queue.append(ex)
+        self.queue_response(ex)
+        ex._response_error(err)
 
 # FIXME: connection?
 
@@ -185,6 +278,24 @@ class HttpServerConnection(HttpMessageHandler, EventEmitter):
 # TODO: if in mid-request, we need to send an error event and clean up.
 #        self.ex_queue[-1].emit('error', err)
 
+    def queue_response(self, exchange):
+        """
+        Line up exchange's response behind those of earlier requests, so
+        that pipelined responses are sent in order.
+        """
+        if self.res_queue:
+            exchange._held_output = []
+        self.res_queue.append(exchange)
+        self.outstanding += 1
+
+    def response_sent(self, exchange):
+        "exchange's response has been sent; let the next one go."
+        queue = self.res_queue
+        if queue and queue[0] is exchange:
+            queue.popleft()
+            if queue:
+                queue[0]._release_output()
+
     def drain_exchange_queue(self):
         """
         Walk through the exchange queue and kick off unstarted requests
@@ -202,6 +313,11 @@ class HttpServerExchange(EventEmitter):
     A request/response interaction on an HTTP server.
     """
 
+    __slots__ = ('http_conn', 'method', 'uri', 'req_hdrs', 'req_version',
+                 'started', 'response_started', 'body_received',
+                 'compress_level', '_compressor', '_body_credit',
+                 '_body_paused', '_held_body', '_held_done', '_held_output')
+
     def __init__(self, http_conn, method, uri, req_hdrs, req_version):
         EventEmitter.__init__(self)
         self.http_conn = http_conn
@@ -210,6 +326,15 @@ class HttpServerExchange(EventEmitter):
         self.req_hdrs = req_hdrs
         self.req_version = req_version
         self.started = False
+        self.response_started = False
+        self.body_received = 0 # bytes of request body so far
+        self.compress_level = http_conn.server.compress_level
+        self._compressor = None
+        self._body_credit = None # bytes the app will take; None for any
+        self._body_paused = False # whether we've paused the connection
+        self._held_body = None # chunks waiting for credit
+        self._held_done = None # trailers waiting for the body to go
+        self._held_output = None # output waiting for earlier responses
 
     def __repr__(self):
         status = [self.__class__.__module__ + "." + self.__class__.__name__]
@@ -220,10 +345,59 @@ class HttpServerExchange(EventEmitter):
         self.started = True
         self.emit('request_start', self.method, self.uri, self.req_hdrs)
 
+    def request_body_credit(self, nbytes):
+        """
+        Allow nbytes more of the request body to be emitted.
+
+        Once this has been called, 'request_body' only emits as much as
+        has been allowed; when that runs out, reading from the connection
+        is paused until more is. Otherwise, the body is emitted as it
+        arrives.
+        """
+        if self._body_credit is None:
+            self._body_credit = 0
+        self._body_credit += nbytes
+        self._release_body()
+
+    def _release_body(self):
+        "Emit as much of the held request body as credit allows."
+        held = self._held_body
+        while held and self._body_credit > 0:
+            chunk = held[0]
+            if len(chunk) > self._body_credit:
+                held[0] = chunk[self._body_credit:]
+                chunk = chunk[:self._body_credit]
+            else:
+                held.popleft()
+            self._body_credit -= len(chunk)
+            self.emit('request_body', chunk)
+        if held:
+            self._pause_body(True)
+        elif self._held_done is not None:
+            # the request is complete, so stop counting.
+            trailers, self._held_done = self._held_done, None
+            self._body_credit = None
+            self._pause_body(False)
+            self.emit('request_done', trailers)
+        elif self._body_credit is not None:
+            self._pause_body(self._body_credit <= 0)
+
+    def _pause_body(self, paused):
+        "Pause or unpause reading the request body."
+        if paused != self._body_paused:
+            self._body_paused = paused
+            self.http_conn.req_body_pause(paused)
+
     def response_start(self, status_code, status_phrase, res_hdrs):
         "Start a response. Must only be called once per response."
+        self.response_started = True
         res_hdrs = [i for i in res_hdrs \
                     if not i[0].lower() in hop_by_hop_hdrs ]
+        if self.compress_level is not None:
+            res_hdrs, coding = self._negotiate(status_code, res_hdrs)
+            if coding:
+                self._compressor = Compressor(coding, self.compress_level,
+                    self.http_conn.server.compress_flush)
 
         try:
             body_len = int(get_header(res_hdrs, "content-length").pop(0))
@@ -239,21 +413,229 @@ class HttpServerExchange(EventEmitter):
             delimit = CLOSE
             res_hdrs.append(("Connection", "close"))
 
-        self.http_conn.output_start(
+        self._output(self.http_conn.output_start,
             "HTTP/1.1 %s %s" % (status_code, status_phrase),
             res_hdrs, delimit
         )
 
     def response_body(self, chunk):
         "Send part of the response body. May be called zero to many times."
-        self.http_conn.output_body(chunk)
+        if self._compressor:
+            chunk = self._compressor.compress(chunk)
+        self._output(self.http_conn.output_body, chunk)
 
     def response_done(self, trailers):
         """
         Signal the end of the response, whether or not there was a body. MUST
         be called exactly once for each response.
         """
+        if self._compressor:
+            self._output(self.http_conn.output_body, self._compressor.flush())
+            self._compressor = None
+        self.http_conn.outstanding -= 1
+        self._output(self._response_end, trailers)
+
+    def _response_end(self, trailers):
+        "Finish sending the response and let the next one go."
         self.http_conn.output_end(trailers)
+        self.http_conn.response_sent(self)
+
+    def _output(self, method, *args):
+        """
+        Call method (which writes to the connection) with args now if it's
+        this response's turn to be sent, or hold it until it is. Does
+        nothing once the connection has gone away.
+        """
+        if self.http_conn.tcp_conn is None:
+            return
+        if self._held_output is None:
+            method(*args)
+        else:
+            self._held_output.append((method, args))
+
+    def _release_output(self):
+        "It's this response's turn; send what's been held."
+        held, self._held_output = self._held_output, None
+        for method, args in held or []:
+            method(*args)
+
+    def _response_error(self, err):
+        "Send a complete response describing err (a thor.http.error)."
+        status_code, status_phrase = err.server_status or \
+            ("500", "Internal Server Error")
+        body = err.desc
+        if err.detail:
+            body += " (%s)" % err.detail
+        self.response_start(status_code, status_phrase,
+                            [('Content-Type', 'text/plain')])
+        self.response_body(body)
+        self.response_done([])
+
+    def response_file(self, fileobj, offset=0, length=None, res_hdrs=None):
+        """
+        Send a complete response whose body is length bytes of fileobj,
+        starting at offset (by default, the rest of the file, which is
+        empty if offset is past its end), with the response headers
+        res_hdrs.
+
+        Range requests are answered with 206 (or 416), and the body is sent
+        without reading it into Python where possible.
+
+        If the response is compressed, the compressed body is kept in the
+        server's compressed_files, so that it can be reused until the file
+        changes.
+        """
+        if length is None:
+            length = max(os.fstat(fileobj.fileno()).st_size - offset, 0)
+        res_hdrs = [(n, v) for (n, v) in (res_hdrs or []) if n.lower() not in
+                    ['content-length', 'content-range', 'transfer-encoding']]
+        res_hdrs.append(('Accept-Ranges', 'bytes'))
+        status, phrase = "200", "OK"
+        body_offset, body_len = offset, length
+        ranges = [v for (n, v) in self.req_hdrs if n.lower() == 'range']
+        byte_range = None
+        if self.method == "GET" and ranges and self._if_range(res_hdrs):
+            try:
+                byte_range = parse_range(ranges[-1], length)
+            except ValueError:
+                pass # serve the whole thing
+            else:
+                if byte_range is None:
+                    self.response_start("416", "Range Not Satisfiable",
+                        res_hdrs + [
+                            ('Content-Range', 'bytes */%s' % length),
+                            ('Content-Length', '0')
+                        ]
+                    )
+                    self.response_done([])
+                    return
+        if byte_range is not None:
+            first, last = byte_range
+            status, phrase = "206", "Partial Content"
+            res_hdrs.append(('Content-Range',
+                'bytes %s-%s/%s' % (first, last, length)
+            ))
+            body_offset, body_len = offset + first, last - first + 1
+        elif self.compress_level is not None and \
+          self._compressed_file(fileobj, offset, length, res_hdrs):
+            return
+        res_hdrs.append(('Content-Length', str(body_len)))
+        self.response_start(status, phrase, res_hdrs)
+        if self.method != "HEAD" and body_len > 0:
+            tcp_conn = self.http_conn.tcp_conn
+            if self._held_output is None and tcp_conn and \
+              self.http_conn._output_delimit == COUNTED:
+                tcp_conn.write_file(fileobj, body_offset, body_len)
+            else:
+                # fileobj may be closed by the time it's our turn.
+                self.response_body(map_file(fileobj, body_offset, body_len))
+        self.response_done([])
+
+    def _compressed_file(self, fileobj, offset, length, res_hdrs):
+        """
+        Send a complete response with the compressed form of length bytes
+        of fileobj at offset, if it should be compressed. Returns whether
+        it was sent.
+        """
+        res_hdrs, coding = self._negotiate("200",
+            res_hdrs + [('Content-Length', str(length))]
+        )
+        if coding is None:
+            return False
+        cache = self.http_conn.server.compressed_files
+        stat = os.fstat(fileobj.fileno())
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size,
+               offset, length, coding, self.compress_level)
+        body = cache.get(key)
+        if body is not None:
+            res_hdrs.append(('Content-Length', str(len(body))))
+            self.response_start("200", "OK", res_hdrs)
+            self.response_body(body)
+            self.response_done([])
+            return True
+        # compress it a piece at a time, so that the loop isn't held up,
+        # without a Content-Length, since it isn't known yet. Only keep the
+        # pieces if the result might fit in the cache.
+        self.response_start("200", "OK", res_hdrs)
+        data = map_file(fileobj, offset, length)
+        if length <= cache.max_size:
+            pieces = []
+        else:
+            pieces = None
+        self._output(self._compress_file, data,
+            Compressor(coding, self.compress_level), key, pieces, 0)
+        return True
+
+    def _compress_file(self, data, compressor, key, pieces, start):
+        "Compress and send the next piece of data, starting at start."
+        http_conn = self.http_conn
+        if http_conn.tcp_conn is None:
+            return # the connection has gone away
+        if http_conn.output_paused:
+            http_conn.once('pause', lambda paused: self._compress_file(
+                data, compressor, key, pieces, start))
+            return
+        end = min(start + http_conn.server.compress_chunk_size, len(data))
+        piece = compressor.compress(data[start:end])
+        if end == len(data):
+            piece += compressor.flush()
+        if piece:
+            if pieces is not None:
+                pieces.append(piece)
+            http_conn.output_body(piece)
+        if end < len(data):
+            http_conn.server.loop.schedule(0, self._compress_file,
+                data, compressor, key, pieces, end)
+        else:
+            if pieces is not None:
+                http_conn.server.compressed_files.put(key, "".join(pieces))
+            self.response_done([])
+
+    def _negotiate(self, status_code, res_hdrs):
+        """
+        Work out whether to compress a response, returning the response
+        headers to send and the content-coding to use (or None).
+        """
+        try:
+            status = int(status_code)
+        except ValueError:
+            return res_hdrs, None
+        if self.method == "HEAD" or status < 200 or \
+          status in [204, 206, 304] or not compressible(res_hdrs):
+            return res_hdrs, None
+        try:
+            body_len = int(get_header(res_hdrs, "content-length")[0])
+        except (IndexError, ValueError):
+            body_len = None
+        if body_len is not None and \
+          body_len < self.http_conn.server.compress_min_size:
+            return res_hdrs, None
+        vary = ", ".join(get_header(res_hdrs, "vary")).lower()
+        if "accept-encoding" not in vary and "*" not in vary:
+            res_hdrs = res_hdrs + [("Vary", "Accept-Encoding")]
+        coding = negotiate(self.req_hdrs)
+        if coding is None:
+            return res_hdrs, None
+        res_hdrs = [(n, n.lower() == 'etag' and variant_etag(v, coding) or v)
+                    for (n, v) in res_hdrs if n.lower() != 'content-length']
+        res_hdrs.append(("Content-Encoding", coding))
+        return res_hdrs, coding
+
+    def _if_range(self, res_hdrs):
+        """
+        Return whether the request's If-Range precondition (if any) matches
+        the response headers.
+        """
+        if_range = [v.strip() for (n, v) in self.req_hdrs
+                    if n.lower() == 'if-range']
+        if not if_range:
+            return True
+        if if_range[-1].startswith('"'):
+            validator = 'etag'
+        else:
+            validator = 'last-modified'
+        return if_range[-1] in [v.strip() for (n, v) in res_hdrs
+                                if n.lower() == validator]
 
 
 def test_handler(x):
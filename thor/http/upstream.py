@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""
+Thor HTTP Upstreams
+
+This library lets an HttpClient send requests for a logical upstream name
+(e.g., "http://api/users") to one of a set of backend servers, chosen by a
+pluggable strategy. Backends that fail are ejected for a while, based
+upon the errors seen by exchanges and (optionally) active health checks.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import bisect
+from hashlib import md5
+import random
+
+from thor.events import EventEmitter, on
+from thor.http.error import ConnectError, ReadTimeoutError
+
+# errors that count against a backend
+backend_errors = (ConnectError, ReadTimeoutError)
+
+
+class Backend(object):
+    "A server that an Upstream can send requests to."
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.outstanding = 0 # requests in progress
+        self.failures = 0 # consecutive failures
+        self.ejected_until = None # when it can be used again, if ejected
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s:%s' % (self.host, self.port))
+        status.append('%s outstanding' % self.outstanding)
+        if self.ejected_until:
+            status.append('ejected')
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+
+class RoundRobin(object):
+    "Use each backend in turn."
+
+    def __init__(self):
+        self._next = 0
+
+    def pick(self, backends, key):
+        self._next = (self._next + 1) % len(backends)
+        return backends[self._next]
+
+
+class LeastOutstanding(object):
+    "Use the backend with the fewest requests in progress."
+
+    def __init__(self):
+        self._next = 0
+
+    def pick(self, backends, key):
+        # start somewhere different each time, so ties are spread around.
+        self._next = (self._next + 1) % len(backends)
+        rotated = backends[self._next:] + backends[:self._next]
+        return min(rotated, key=lambda b: b.outstanding)
+
+
+class PowerOfTwo(object):
+    """
+    Choose two backends at random, and use the one with fewer requests in
+    progress.
+    """
+
+    def pick(self, backends, key):
+        if len(backends) == 1:
+            return backends[0]
+        a, b = random.sample(backends, 2)
+        if b.outstanding < a.outstanding:
+            return b
+        return a
+
+
+class ConsistentHash(object):
+    """
+    Use the backend that the request's key hashes to, so that the same key
+    usually goes to the same backend, even as others come and go.
+    """
+
+    replicas = 100 # points on the ring for each backend
+
+    def __init__(self):
+        self._ring = []
+        self._ring_for = None
+
+    def pick(self, backends, key):
+        if self._ring_for != backends:
+            self._build(backends)
+        i = bisect.bisect(self._ring, (self._hash(key),))
+        return self._ring[i % len(self._ring)][1]
+
+    def _build(self, backends):
+        "(Re)build the hash ring for backends."
+        ring = []
+        for backend in backends:
+            for replica in range(self.replicas):
+                ring.append((self._hash("%s:%s-%s" % (
+                    backend.host, backend.port, replica
+                )), backend))
+        ring.sort(key=lambda point: point[0])
+        self._ring = ring
+        self._ring_for = list(backends)
+
+    @staticmethod
+    def _hash(key):
+        return int(md5(key).hexdigest()[:8], 16)
+
+
+class Upstream(EventEmitter):
+    """
+    A logical name for a set of backends.
+
+    Emits:
+      - eject (backend): when a backend is taken out of use.
+      - restore (backend): when an ejected backend is used again.
+
+    A backend is ejected for eject_time seconds after max_fails
+    consecutive connect errors or read timeouts, or failed active health
+    checks. If every backend has been ejected, they're all used anyway.
+    """
+
+    max_fails = 3
+    eject_time = 30 # in seconds
+
+    def __init__(self, client, name, backends, strategy=None):
+        EventEmitter.__init__(self)
+        self.client = client
+        self.name = name
+        self.backends = [Backend(host, port) for (host, port) in backends]
+        self.strategy = strategy or RoundRobin()
+        self._check_ev = None
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append(self.name)
+        status.append('%s/%s backends' % (
+            len(self.available()), len(self.backends)
+        ))
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def available(self):
+        "Return the list of backends that aren't ejected."
+        now = self.client.loop.now()
+        out = []
+        for backend in self.backends:
+            if backend.ejected_until is not None:
+                if backend.ejected_until > now:
+                    continue
+                self._restore(backend)
+            out.append(backend)
+        return out
+
+    def pick(self, key):
+        """
+        Choose a backend for a request identified by key (used by the
+        ConsistentHash strategy), and count it as outstanding.
+        """
+        backends = self.available() or self.backends
+        backend = self.strategy.pick(backends, key)
+        backend.outstanding += 1
+        return backend
+
+    def done(self, backend, err=None):
+        """
+        A request to backend has finished; err is the error it finished
+        with, if any.
+        """
+        self.release(backend)
+        if isinstance(err, backend_errors):
+            self._failed(backend)
+        elif err is None:
+            backend.failures = 0
+
+    def release(self, backend):
+        """
+        Stop counting a request to backend as outstanding, without saying
+        whether it worked (e.g., because it was aborted).
+        """
+        backend.outstanding -= 1
+
+    def start_checks(self, path="/", interval=10, timeout=5):
+        """
+        Check each backend by requesting path every interval seconds; a
+        backend that doesn't respond with a 2xx or 3xx status within timeout
+        seconds counts as failing.
+        """
+        self.stop_checks()
+        def run_checks():
+            for backend in self.backends:
+                self._check(backend, path, timeout)
+            self._check_ev = self.client.loop.schedule(interval, run_checks)
+        run_checks()
+
+    def stop_checks(self):
+        "Stop active health checks."
+        if self._check_ev:
+            self._check_ev.delete()
+            self._check_ev = None
+
+    def _check(self, backend, path, timeout):
+        "Check a backend's health."
+        exchange = self.client.exchange()
+        state = {'done': False}
+        def result(ok):
+            if state['done']:
+                return
+            state['done'] = True
+            timeout_ev.delete()
+            if ok:
+                backend.failures = 0
+                if backend.ejected_until is not None:
+                    self._restore(backend)
+            else:
+                self._failed(backend)
+        def timed_out():
+            exchange.abort()
+            result(False)
+        timeout_ev = self.client.loop.schedule(timeout, timed_out)
+        @on(exchange)
+        def response_start(status, phrase, headers):
+            result(status[:1] in ['2', '3'])
+        @on(exchange)
+        def error(err):
+            result(False)
+        exchange.request_start(
+            "GET", "http://%s:%s%s" % (backend.host, backend.port, path), []
+        )
+        exchange.request_done([])
+
+    def _failed(self, backend):
+        "Note a failure on backend, ejecting it if there are too many."
+        backend.failures += 1
+        if backend.failures >= self.max_fails:
+            if backend.ejected_until is None:
+                self.emit('eject', backend)
+            backend.ejected_until = self.client.loop.now() + self.eject_time
+
+    def _restore(self, backend):
+        "Put an ejected backend back into use."
+        backend.ejected_until = None
+        backend.failures = 0
+        self.emit('restore', backend)
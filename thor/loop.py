@@ -31,16 +31,69 @@ THE SOFTWARE.
 """
 
 import bisect
+from collections import deque
+import errno
+import fcntl
+import os
 import select
 import sys
+import thread
+import threading
 import time as systime
 
 from thor.events import EventEmitter
+from thor import metrics
 
 assert sys.version_info[0] == 2 and sys.version_info[1] >= 6, \
     "Please use Python 2.6 or greater"
 
-__all__ = ['run', 'stop', 'schedule', 'time', 'running', 'debug']
+__all__ = ['run', 'stop', 'schedule', 'call_soon_threadsafe',
+           'run_in_pool', 'time', 'running', 'debug', 'get_loop', 'set_loop']
+
+
+def _monotonic_clock():
+    """
+    Return a function that returns seconds from a clock that never goes
+    backwards (or, where there isn't one, time.time).
+    """
+    if hasattr(systime, 'monotonic'): # Python 3.3+
+        return systime.monotonic
+    clock_id = None
+    if sys.platform.startswith('linux'):
+        clock_id = 1 # CLOCK_MONOTONIC
+    elif sys.platform.startswith('freebsd'):
+        clock_id = 4
+    elif sys.platform == 'darwin':
+        clock_id = 6
+    if clock_id is None:
+        return systime.time
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+            use_errno=True
+        )
+        clock_gettime = libc.clock_gettime
+    except (ImportError, OSError, AttributeError):
+        return systime.time
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    byref = ctypes.byref
+    def monotonic():
+        # ctypes lets go of the GIL during the call, so each call needs its
+        # own timespec.
+        spec = timespec()
+        if clock_gettime(clock_id, byref(spec)) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime failed")
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    try:
+        monotonic()
+    except OSError:
+        return systime.time
+    return monotonic
+
+monotonic = _monotonic_clock()
 
 
 class EventSource(EventEmitter):
@@ -51,9 +104,12 @@ class EventSource(EventEmitter):
     An instance should map to one thing with an interesting file
     descriptor, registered with register_fd.
     """
+
+    __slots__ = ('_loop', '_interesting_events', '_fd')
+
     def __init__(self, loop=None):
         EventEmitter.__init__(self)
-        self._loop = loop or _loop
+        self._loop = loop or get_loop()
         self._interesting_events = set()
         self._fd = None
 
@@ -68,8 +124,10 @@ class EventSource(EventEmitter):
 
     def unregister_fd(self):
         "Unregister myself from the loop."
-        if self._fd:
-            self._loop.unregister_fd(self._fd)
+        if self._fd is not None:
+            # the loop may have already forgotten us (e.g., when stopped)
+            if self._loop._fd_targets.get(self._fd) is self:
+                self._loop.unregister_fd(self._fd)
             self._fd = None
 
     def event_add(self, event):
@@ -85,6 +143,46 @@ class EventSource(EventEmitter):
             self._loop.event_del(self._fd, event)
 
 
+class _Waker(EventSource):
+    """
+    A pipe that other threads write to, to wake the loop up when they've
+    given it something to do.
+    """
+    def __init__(self, loop):
+        EventSource.__init__(self, loop)
+        self.read_fd, self.write_fd = os.pipe()
+        for fd in [self.read_fd, self.write_fd]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.woken = False
+        self.on('readable', loop._run_pending_calls)
+        self.register_fd(self.read_fd, 'readable')
+
+    def wake(self):
+        "Wake the loop up, if that hasn't been done already."
+        if not self.woken:
+            self.woken = True
+            try:
+                os.write(self.write_fd, "x")
+            except OSError, why:
+                if why[0] != errno.EAGAIN:
+                    raise
+
+    def clear(self):
+        "The loop is awake; get ready to be woken again."
+        self.woken = False
+        try:
+            os.read(self.read_fd, 1024)
+        except OSError, why:
+            if why[0] != errno.EAGAIN:
+                raise
+
+    def close(self):
+        self.unregister_fd()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
 class LoopBase(EventEmitter):
     """
     Base class for async loops.
@@ -96,19 +194,37 @@ class LoopBase(EventEmitter):
         self.precision = precision or .5 # of running scheduled queue (secs)
         self.running = False # whether or not the loop is running (read-only)
         self.last_event_check = 0
+        self.iterations = 0 # how many times the loop has gone around
+        self.thread_id = None # the thread running the loop
+        self.profiler = None # a thor.profiler.Profiler, when profiling
+        self.pool = None # a thor.pool.Pool, for run_in_pool
         self.__sched_events = []
+        self.__pending_calls = deque() # (callback, args) from other threads
+        self.__waker = None # while running
+        self.__waker_lock = thread.allocate_lock()
         self._fd_targets = {}
-        self.__now = None
+        self.__now = None # monotonic time, while running
+        self.__wall = None # Unix time, once asked for in this iteration
         self._eventlookup = dict(
             [(v,k) for (k,v) in self._event_types.items()]
         )
         self.__event_cache = {}
+        self._polled_at = 0 # when fd events were last returned (for metrics)
 
     def run(self):
         "Start the loop."
         self.running = True
         self.last_event_check = 0
-        self.__now = systime.time()
+        self.thread_id = thread.get_ident()
+        self.__now = monotonic()
+        self.__wall = None
+        self.__waker_lock.acquire()
+        try:
+            self.__waker = _Waker(self)
+            if self.__pending_calls:
+                self.__waker.wake()
+        finally:
+            self.__waker_lock.release()
         self.emit('start')
         while self.running:
             self._step()
@@ -117,6 +233,8 @@ class LoopBase(EventEmitter):
         """Runs one iteration of the loop. When `force` is `True`, this will
         force an iteration on the events, but will not modfify there
         `last_event_check`."""
+        self.iterations += 1
+        step_start = metrics.enabled and systime.time()
         if debug:
             fd_start = systime.time()
         if not force:
@@ -124,9 +242,10 @@ class LoopBase(EventEmitter):
             # we'll have to wait for `precision` seconds if there's no
             # fd event happening.
             self._run_fd_events()
-        self.__now = systime.time()
+        self.__now = monotonic()
+        self.__wall = None
         if debug:
-            delay = self.__now - fd_start
+            delay = systime.time() - fd_start
             if delay >= self.precision * 1.5:
                 sys.stderr.write(
                  "WARNING: long fd delay (%.2f)\n" % delay
@@ -134,8 +253,10 @@ class LoopBase(EventEmitter):
         # find scheduled events
         if not self.running:
             return
+        events = self.__sched_events
         delay = self.__now - self.last_event_check
-        if force or delay >= self.precision * 0.90:
+        if force or delay >= self.precision * 0.90 or \
+          (events and events[0][0] <= self.__now):
             if debug:
                 if (not force) and self.last_event_check and (delay >= self.precision * 4):
                     sys.stderr.write(
@@ -147,38 +268,71 @@ class LoopBase(EventEmitter):
                         len(self.__sched_events))
             if not force:
                 self.last_event_check = self.__now
-            for event in self.__sched_events:
+            # events scheduled while these run wait for the next iteration.
+            due = 0
+            while due < len(events) and events[due][0] <= self.__now:
+                due += 1
+            for event in events[:due]:
                 when, what = event
-                if self.__now >= when:
-                    try:
-                        self.__sched_events.remove(event)
-                    except ValueError:
-                        # a previous event may have removed this one.
-                        continue
-                    if debug:
-                        ev_start = systime.time()
-                    what()
-                    if debug:
-                        delay = systime.time() - ev_start
-                        if delay > self.precision * 2:
-                            sys.stderr.write(
-                    "WARNING: long event delay (%.2f): %s\n" % \
-                            (delay, repr(what))
-                            )
+                try:
+                    events.remove(event)
+                except ValueError:
+                    # a previous event may have removed this one.
+                    continue
+                if debug:
+                    ev_start = systime.time()
+                if step_start:
+                    metrics.loop_timer_lag.observe(self.__now - when)
+                if self.profiler:
+                    self.profiler.run(what)
                 else:
-                    break
+                    what()
+                if debug:
+                    delay = systime.time() - ev_start
+                    if delay > self.precision * 2:
+                        sys.stderr.write(
+                "WARNING: long event delay (%.2f): %s\n" % \
+                        (delay, repr(what))
+                        )
+        if step_start:
+            if not force:
+                step_start = max(step_start, self._polled_at)
+            metrics.loop_busy.observe(systime.time() - step_start)
 
     def _run_fd_events(self):
         "Run loop-specific FD events."
         raise NotImplementedError
 
+    def _poll_timeout(self):
+        """
+        How long to wait for fd events (in seconds): precision, or less if
+        a scheduled event is due before then.
+        """
+        events = self.__sched_events
+        if not events:
+            return self.precision
+        return max(min(events[0][0] - monotonic(), self.precision), 0)
+
+    def _polled(self, count):
+        "Record that count fd events have been returned (for metrics)."
+        self._polled_at = systime.time()
+        metrics.loop_fd_events.observe(count)
+
     def stop(self):
         "Stop the loop and unregister all fds."
         self.__sched_events = []
         self.__now = None
+        self.__wall = None
         self.running = False
         for fd in self._fd_targets.keys():
             self.unregister_fd(fd)
+        self.__waker_lock.acquire()
+        try:
+            if self.__waker:
+                self.__waker.close()
+                self.__waker = None
+        finally:
+            self.__waker_lock.release()
         self.emit('stop')
 
     def register_fd(self, fd, events, target):
@@ -204,12 +358,42 @@ class LoopBase(EventEmitter):
     def _fd_event(self, event, fd):
         "An event has occured on an fd."
         if self._fd_targets.has_key(fd):
-            self._fd_targets[fd].emit(event)
+            if self.profiler:
+                self.profiler.emit(self._fd_targets[fd], event)
+            else:
+                self._fd_targets[fd].emit(event)
         # TODO: automatic unregister on 'close'?
 
     def time(self):
-        "Return the current time (to avoid a system call)."
-        return self.__now or systime.time()
+        """
+        Return the current Unix time. While the loop is running, this is
+        only read once per iteration (to avoid system calls).
+
+        This can jump when the system clock is changed, so use now() to
+        measure intervals.
+        """
+        if self.__now is None:
+            return systime.time()
+        if self.__wall is None:
+            self.__wall = systime.time()
+        return self.__wall
+
+    def now(self):
+        """
+        Return the loop's monotonic time, in seconds from an arbitrary
+        point. While the loop is running, this is only read once per
+        iteration; callbacks that run for a long time can call update_time()
+        to refresh it.
+
+        Scheduled events are run against this clock.
+        """
+        return self.__now or monotonic()
+
+    def update_time(self):
+        "Refresh the time that now() and time() return."
+        if self.__now is not None:
+            self.__now = monotonic()
+            self.__wall = None
 
     def schedule(self, delta, callback, *args):
         """
@@ -222,7 +406,8 @@ class LoopBase(EventEmitter):
             if callback:
                 callback(*args)
         cb.__name__ = callback.__name__
-        now       = self.time()
+        cb.callback = callback
+        now       = self.now()
         new_event = (now + delta, cb)
         events = self.__sched_events
         bisect.insort(events, new_event)
@@ -236,10 +421,53 @@ class LoopBase(EventEmitter):
                         self._deleted = True
                     except ValueError: # already gone
                         pass
-        res = event_holder()
-        # We force a step if the event is scheduled before the next iteration
-        if new_event[0]  < ((self.last_event_check or now) + self.precision): self._step(True)
-        return res
+        # the loop waits for fd events only until it's due, so there's no
+        # need to run it here; schedule(0, ...) runs on the next iteration.
+        return event_holder()
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Call callback with *args as soon as possible, from the loop's
+        thread. Unlike the loop's other methods, this can be called from
+        any thread; it wakes the loop up if it's waiting for events.
+
+        If the loop isn't running, callback is called once it starts.
+        """
+        self.__pending_calls.append((callback, args))
+        self.__waker_lock.acquire()
+        try:
+            if self.__waker:
+                self.__waker.wake()
+        finally:
+            self.__waker_lock.release()
+
+    def run_in_pool(self, func, *args):
+        """
+        Call func with *args on a worker thread (or process), returning a
+        thor.pool.PoolJob that emits 'done' or 'error' on the loop.
+
+        Uses self.pool; if it isn't set, a thor.pool.ThreadPool is created.
+        """
+        if self.pool is None:
+            from thor.pool import ThreadPool
+            self.pool = ThreadPool(self)
+        return self.pool.submit(func, *args)
+
+    def _run_pending_calls(self):
+        "Run the callbacks that other threads have given us."
+        self.__waker_lock.acquire()
+        try:
+            self.__waker.clear()
+        finally:
+            self.__waker_lock.release()
+        calls = self.__pending_calls
+        # calls added while these run wait for the next wakeup.
+        for i in xrange(len(calls)):
+            callback, args = calls.popleft()
+            if self.profiler:
+                self.profiler.run(callback, *args)
+            else:
+                callback(*args)
 
     def _eventmask(self, events):
         "Calculate the mask for a list of events."
@@ -294,7 +522,9 @@ class PollLoop(LoopBase):
         self._poll.register(fd, eventmask)
 
     def _run_fd_events(self):
-        event_list = self._poll.poll(self.precision)
+        event_list = self._poll.poll(self._poll_timeout() * 1000) # in ms
+        if metrics.enabled:
+            self._polled(len(event_list))
         for fileno, eventmask in event_list:
             for event in self._filter2events(eventmask):
                 self._fd_event(event, fileno)
@@ -343,7 +573,9 @@ class EpollLoop(LoopBase):
         self._epoll.modify(fd, eventmask)
 
     def _run_fd_events(self):
-        event_list = self._epoll.poll(self.precision)
+        event_list = self._epoll.poll(self._poll_timeout())
+        if metrics.enabled:
+            self._polled(len(event_list))
         for fileno, eventmask in event_list:
             for event in self._filter2events(eventmask):
                 self._fd_event(event, fileno)
@@ -393,7 +625,9 @@ class KqueueLoop(LoopBase):
             self._kq.control([ev], 0, 0)
 
     def _run_fd_events(self):
-        events = self._kq.control([], self.max_ev, self.precision)
+        events = self._kq.control([], self.max_ev, self._poll_timeout())
+        if metrics.enabled:
+            self._polled(len(events))
         for e in events:
             event_types = self._filter2events(e.filter)
             for event_type in event_types:
@@ -414,7 +648,8 @@ class KqueueLoop(LoopBase):
 def make(precision=None):
     """
     Create and return a named loop that is suitable for the current system. If
-    _precision_ is given, it indicates how often scheduled events will be run.
+    _precision_ is given, it's the longest the loop waits for fd events at a
+    time (scheduled events run when they're due).
 
     Returned loop instances have all of the methods and instance variables
     that *thor.loop* has.
@@ -430,10 +665,42 @@ def make(precision=None):
         raise ImportError, "What is this thing, a Windows box?"
     return loop
 
+_local = threading.local()
+
+def get_loop():
+    """
+    Return the current thread's default loop, creating it if necessary.
+    The thread that imports thor gets _loop.
+    """
+    try:
+        return _local.loop
+    except AttributeError:
+        loop = _local.loop = make()
+        return loop
+
+def set_loop(loop):
+    "Make loop the current thread's default loop."
+    _local.loop = loop
+
+# The module-level functions act on the current thread's default loop.
+def run():
+    get_loop().run()
+
+def stop():
+    get_loop().stop()
+
+def schedule(delta, callback, *args):
+    return get_loop().schedule(delta, callback, *args)
+
+def run_in_pool(func, *args):
+    return get_loop().run_in_pool(func, *args)
+
+def time():
+    return get_loop().time()
+
 _loop = make() # by default, just one big loop.
-run = _loop.run
-stop = _loop.stop
-schedule = _loop.schedule
-time = _loop.time
+set_loop(_loop)
+# other threads use this to hand work to the main loop, so it isn't per-thread
+call_soon_threadsafe = _loop.call_soon_threadsafe
 running = _loop.running
 debug = False
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+Thor Metrics
+
+This is a small library of counters, gauges and histograms that Thor uses to
+report what the loop, TCP connections and HTTP clients and servers are
+doing.
+
+Metrics are only recorded while *enabled* is True; when it's False (the
+default), instrumented code does no more than check it.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import bisect
+
+import thor
+
+enabled = False # whether to record metrics
+
+# upper bounds of histogram buckets
+time_buckets = [.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1,
+                .25, .5, 1, 2.5, 5, 10]
+count_buckets = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+class Counter(object):
+    "A count of things that have happened."
+    kind = 'counter'
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+
+    def __repr__(self):
+        return "<%s.%s %s=%s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.name, self.value, id(self))
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def reset(self):
+        self.value = 0
+
+
+class Gauge(object):
+    """
+    A value that can go up and down. If func is given, it's called to get
+    the value whenever it's needed.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, doc, func=None):
+        self.name = name
+        self.doc = doc
+        self.func = func
+        self._value = 0
+
+    def __repr__(self):
+        return "<%s.%s %s=%s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.name, self.value, id(self))
+
+    @property
+    def value(self):
+        if self.func:
+            return self.func()
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+    def reset(self):
+        self._value = 0
+
+
+class Histogram(object):
+    """
+    A distribution of observed values, counted in buckets with the given
+    upper bounds (plus one for everything bigger).
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, doc, buckets=None):
+        self.name = name
+        self.doc = doc
+        self.buckets = sorted(buckets or time_buckets)
+        self.reset()
+
+    def __repr__(self):
+        return "<%s.%s %s count=%s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, self.name, self.count, id(self))
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        "Return a list of (upper bound, count of values <= it)."
+        total = 0
+        out = []
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+class Registry(object):
+    """
+    A set of named metrics, and the sinks that they're exported to.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._sinks = {} # sink: scheduled event
+
+    def __repr__(self):
+        return "<%s.%s, %s metrics at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, len(self._metrics), id(self))
+
+    def _add(self, metric_class, name, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, *args)
+        elif not isinstance(metric, metric_class):
+            raise ValueError("%s is already a %s" % (name, metric.kind))
+        return metric
+
+    def counter(self, name, doc):
+        "Return the Counter called name, creating it if necessary."
+        return self._add(Counter, name, doc)
+
+    def gauge(self, name, doc, func=None):
+        "Return the Gauge called name, creating it if necessary."
+        return self._add(Gauge, name, doc, func)
+
+    def histogram(self, name, doc, buckets=None):
+        "Return the Histogram called name, creating it if necessary."
+        return self._add(Histogram, name, doc, buckets)
+
+    def get(self, name):
+        "Return the metric called name, or None."
+        return self._metrics.get(name)
+
+    def collect(self):
+        "Return a list of all metrics, sorted by name."
+        return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def reset(self):
+        "Reset all metrics to zero."
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def add_sink(self, sink, interval, loop=None):
+        """
+        Call sink with the list of metrics every interval seconds, on loop
+        (by default, the default loop).
+        """
+        loop = loop or thor.loop.get_loop()
+        def export():
+            self._sinks[sink] = loop.schedule(interval, export)
+            sink(self.collect())
+        self.remove_sink(sink)
+        self._sinks[sink] = loop.schedule(interval, export)
+
+    def remove_sink(self, sink):
+        "Stop calling sink."
+        event = self._sinks.pop(sink, None)
+        if event:
+            event.delete()
+
+
+def prometheus_text(metrics):
+    "Return the list of metrics in the Prometheus text exposition format."
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP %s %s" % (metric.name, metric.doc))
+        lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+        if metric.kind == 'histogram':
+            for bound, count in metric.cumulative():
+                if bound == float('inf'):
+                    bound = "+Inf"
+                lines.append('%s_bucket{le="%s"} %s' % (
+                    metric.name, bound, count))
+            lines.append("%s_sum %r" % (metric.name, metric.sum))
+            lines.append("%s_count %s" % (metric.name, metric.count))
+        else:
+            lines.append("%s %r" % (metric.name, metric.value))
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# the metrics that Thor records
+loop_busy = registry.histogram("thor_loop_busy_seconds",
+    "Time spent running callbacks in each loop iteration.")
+loop_fd_events = registry.histogram("thor_loop_fd_events",
+    "File descriptor events per loop iteration.", count_buckets)
+loop_timer_lag = registry.histogram("thor_loop_timer_lag_seconds",
+    "How late scheduled events run.")
+tcp_bytes_read = registry.counter("thor_tcp_read_bytes_total",
+    "Bytes read from TCP connections.")
+tcp_bytes_written = registry.counter("thor_tcp_written_bytes_total",
+    "Bytes written to TCP connections.")
+http_parse_time = registry.histogram("thor_http_parse_seconds",
+    "Time spent parsing each HTTP message's headers.")
+http_client_pool_hits = registry.counter("thor_http_client_pool_hits_total",
+    "HTTP client requests that reused an idle connection.")
+http_client_pool_misses = registry.counter(
+    "thor_http_client_pool_misses_total",
+    "HTTP client requests that needed a new connection.")
+http_server_outstanding = registry.histogram(
+    "thor_http_server_outstanding_exchanges",
+    "Exchanges outstanding on a server connection when a request arrives.",
+    count_buckets)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""
+Thor Worker Pools
+
+Blocking work (disk IO, CPU-heavy transforms, libraries without an async
+API) blocks everything else on the loop. These pools run it on other
+threads (or processes) instead, and tell the loop when it's finished:
+
+> job = loop.run_in_pool(parse_big_document, body)
+> job.on('done', send_response)
+> job.on('error', send_error)
+
+Each pool has a queue of work waiting for a worker; it emits 'pause' when
+the queue gets long, so that whatever is feeding it can back off.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import cPickle as pickle
+import multiprocessing
+import Queue
+import threading
+
+import thor
+from thor.events import EventEmitter
+
+
+class PoolFullError(Exception):
+    "The pool's queue is full."
+    pass
+
+
+class PoolJob(EventEmitter):
+    """
+    A piece of work given to a pool.
+
+    Emits:
+     - done (result): what the function returned
+     - error (err): the exception that the function raised
+    """
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        EventEmitter.__init__(self)
+        self.func = func
+        self.args = args
+
+    def __repr__(self):
+        return "<%s.%s %s at %#x>" % (self.__class__.__module__,
+            self.__class__.__name__, getattr(self.func, '__name__', '-'),
+            id(self))
+
+
+def _call(func, args):
+    "Call func with args, returning (True, result) or (False, exception)."
+    try:
+        return True, func(*args)
+    except Exception, why:
+        return False, why
+
+
+def _call_pickled(data):
+    """
+    Unpickle (func, args) from data, call func with args, and return
+    (ok, value) pickled; runs in a worker process.
+
+    multiprocessing only reports jobs that succeed, so this always does,
+    even when the job can't be unpickled or its result can't be pickled.
+    """
+    try:
+        func, args = pickle.loads(data)
+    except Exception, why:
+        result = (False, why)
+    else:
+        result = _call(func, args)
+    try:
+        return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except Exception, why:
+        return pickle.dumps((False, pickle.PicklingError(
+            "Can't pickle the result of %r: %s" % (result[1], why)
+        )), pickle.HIGHEST_PROTOCOL)
+
+
+class Pool(EventEmitter):
+    """
+    Base class for worker pools.
+
+    Up to max_queue jobs (by default, 1000; None for no limit) can wait for
+    a worker; after that, submit raises PoolFullError. When pause_queue
+    (by default, half of max_queue) are waiting, 'pause' is emitted with
+    True; when half as many are, it's emitted with False.
+    """
+
+    def __init__(self, loop=None, workers=4, max_queue=1000,
+                 pause_queue=None):
+        EventEmitter.__init__(self)
+        self.loop = loop or thor.loop.get_loop()
+        self.workers = workers
+        self.max_queue = max_queue
+        if pause_queue is None and max_queue is not None:
+            pause_queue = max_queue // 2
+        self.pause_queue = pause_queue
+        self.outstanding = 0 # jobs waiting or running
+        self.paused = False
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s workers' % self.workers)
+        status.append('%s outstanding' % self.outstanding)
+        if self.paused:
+            status.append('paused')
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def queued(self):
+        "Return how many jobs are waiting for a worker."
+        return max(0, self.outstanding - self.workers)
+
+    def submit(self, func, *args):
+        """
+        Call func with args on a worker, returning a PoolJob that emits
+        the result on the loop.
+        """
+        if self.max_queue is not None and self.queued() >= self.max_queue:
+            raise PoolFullError("%s jobs queued" % self.queued())
+        job = PoolJob(func, args)
+        self.outstanding += 1
+        self._start(job)
+        if self.pause_queue is not None and not self.paused and \
+          self.queued() >= self.pause_queue:
+            self.paused = True
+            self.emit('pause', True)
+        return job
+
+    def shutdown(self):
+        "Stop the workers once the jobs already submitted are finished."
+        raise NotImplementedError
+
+    def _start(self, job):
+        "Give job to a worker."
+        raise NotImplementedError
+
+    def _finish(self, job, ok, value):
+        "job has finished; runs on the loop."
+        self.outstanding -= 1
+        if self.paused and self.queued() <= self.pause_queue // 2:
+            self.paused = False
+            self.emit('pause', False)
+        if ok:
+            job.emit('done', value)
+        else:
+            job.emit('error', value)
+
+
+class ThreadPool(Pool):
+    """
+    Runs jobs on up to workers threads, which are started as they're
+    needed.
+    """
+
+    def __init__(self, loop=None, workers=4, max_queue=1000,
+                 pause_queue=None):
+        Pool.__init__(self, loop, workers, max_queue, pause_queue)
+        self._queue = Queue.Queue()
+        self._threads = []
+
+    def _start(self, job):
+        self._queue.put(job)
+        if len(self._threads) < min(self.outstanding, self.workers):
+            worker = threading.Thread(target=self._work,
+                                      name="thor pool worker")
+            worker.daemon = True
+            self._threads.append(worker)
+            worker.start()
+
+    def _work(self):
+        "Run jobs until told to stop; runs on a worker thread."
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            ok, value = _call(job.func, job.args)
+            self.loop.call_soon_threadsafe(self._finish, job, ok, value)
+
+    def shutdown(self):
+        for worker in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+
+class ProcessPool(Pool):
+    """
+    Runs jobs on workers processes, using multiprocessing; this avoids
+    contention for the GIL, but functions, their arguments and results
+    have to be picklable.
+    """
+
+    def __init__(self, loop=None, workers=None, max_queue=1000,
+                 pause_queue=None):
+        Pool.__init__(self, loop, workers or multiprocessing.cpu_count(),
+                      max_queue, pause_queue)
+        self._pool = multiprocessing.Pool(self.workers)
+
+    def _start(self, job):
+        try:
+            data = pickle.dumps((job.func, job.args), pickle.HIGHEST_PROTOCOL)
+        except Exception, why:
+            # once submit has returned, so that listeners can be added.
+            self.loop.call_soon_threadsafe(self._finish, job, False, why)
+            return
+        def callback(result):
+            try:
+                ok, value = pickle.loads(result)
+            except Exception, why:
+                ok, value = False, why
+            self.loop.call_soon_threadsafe(self._finish, job, ok, value)
+        self._pool.apply_async(_call_pickled, (data,), callback=callback)
+
+    def shutdown(self):
+        self._pool.close()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""
+Thor Loop Profiler
+
+This library finds out what's slowing down a loop. A Profiler times every
+callback that the loop runs (fd event listeners and scheduled events), and a
+Watchdog notices when a single iteration of the loop blocks for too long,
+capturing what the loop is doing at the time.
+"""
+
+__author__ = "Mark Nottingham <mnot@mnot.net>"
+__copyright__ = """\
+Copyright (c) 2005-2013 Mark Nottingham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import heapq
+import os
+import signal
+import sys
+import threading
+import traceback
+
+import thor
+from thor.loop import monotonic
+from thor.metrics import Histogram
+
+
+def describe(func):
+    "Return a string saying where func (a callable) comes from."
+    func = getattr(func, 'callback', func) # unwrap scheduled events
+    name = getattr(func, '__name__', None) or func.__class__.__name__
+    im_class = getattr(func, 'im_class', None)
+    if im_class is not None:
+        name = "%s.%s" % (im_class.__name__, name)
+    module = getattr(func, '__module__', None)
+    if module:
+        name = "%s.%s" % (module, name)
+    code = getattr(getattr(func, 'im_func', func), 'func_code', None)
+    if code is not None:
+        name += " (%s:%s)" % (
+            os.path.basename(code.co_filename), code.co_firstlineno
+        )
+    return name
+
+
+class Profiler(object):
+    """
+    Times each callback that loop (by default, the default loop) runs,
+    attributing the time to the function that was called.
+
+    The top slowest calls are remembered.
+    """
+
+    def __init__(self, loop=None, top=20):
+        self.loop = loop or thor.loop.get_loop()
+        self.top = top
+        self.reset()
+        self.loop.profiler = self
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s calls' % self.histogram.count)
+        if self.loop.profiler is not self:
+            status.append('stopped')
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def stop(self):
+        "Stop profiling the loop."
+        if self.loop.profiler is self:
+            self.loop.profiler = None
+
+    def reset(self):
+        "Forget what's been recorded."
+        self.stats = {} # key: [description, calls, total time, max time]
+        self.slowest = [] # heap of (time, description)
+        self.histogram = Histogram("thor_callback_seconds",
+            "Time taken by each loop callback.")
+
+    def run(self, func, *args):
+        "Call func with args, recording how long it takes."
+        start = monotonic()
+        try:
+            return func(*args)
+        finally:
+            self.record(func, monotonic() - start)
+
+    def emit(self, target, event):
+        """
+        Emit event on target (an EventEmitter), timing each listener
+        separately.
+        """
+        listeners = target.listeners(event)
+        if not listeners:
+            # the event goes to the emitter's sink, if it has one.
+            return self.run(target.emit, event)
+        for listener in listeners:
+            self.run(listener)
+
+    def record(self, func, elapsed):
+        "Record that calling func took elapsed seconds."
+        func = getattr(func, 'callback', func)
+        real_func = getattr(func, 'im_func', func)
+        key = getattr(real_func, 'func_code', None) or real_func
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = [describe(func), 0, 0.0, 0.0]
+        stats[1] += 1
+        stats[2] += elapsed
+        if elapsed > stats[3]:
+            stats[3] = elapsed
+        self.histogram.observe(elapsed)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, (elapsed, stats[0]))
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (elapsed, stats[0]))
+
+    def report(self):
+        "Return a report of what's been recorded, as a string."
+        out = ["Thor loop profile: %s calls, %.6fs" % (
+            self.histogram.count, self.histogram.sum
+        )]
+        out.append("")
+        out.append("By total time:")
+        out.append("%10s %12s %12s  %s" % (
+            "calls", "total (s)", "max (s)", "callback"
+        ))
+        by_total = sorted(self.stats.values(),
+                          key=lambda s: s[2], reverse=True)
+        for description, calls, total, longest in by_total[:self.top]:
+            out.append("%10d %12.6f %12.6f  %s" % (
+                calls, total, longest, description
+            ))
+        out.append("")
+        out.append("Slowest calls:")
+        for elapsed, description in sorted(self.slowest, reverse=True):
+            out.append("%12.6f  %s" % (elapsed, description))
+        out.append("")
+        out.append("Call times:")
+        last = 0
+        for bound, count in self.histogram.cumulative():
+            if count > last:
+                out.append("%12s  %s" % ("<= %ss" % bound, count - last))
+            last = count
+        return "\n".join(out) + "\n"
+
+    def dump_on(self, signum=signal.SIGUSR1, out=sys.stderr):
+        "Write the report to out whenever the process receives signum."
+        def dump(signum, frame):
+            out.write(self.report())
+            out.flush()
+        signal.signal(signum, dump)
+
+
+class Watchdog(object):
+    """
+    Watches loop (by default, the default loop) from another thread, and
+    calls callback with the loop thread's stack (as a string) and how long
+    it has been blocked when one iteration of the loop takes more than
+    threshold seconds. By default, the stack is written to stderr.
+
+    Since the loop waits for events for at most its precision, threshold
+    should be bigger than that.
+    """
+
+    def __init__(self, loop=None, threshold=1.0, callback=None):
+        self.loop = loop or thor.loop.get_loop()
+        self.threshold = threshold
+        self.callback = callback or self._write
+        self.stalls = 0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __repr__(self):
+        status = [self.__class__.__module__ + "." + self.__class__.__name__]
+        status.append('%s stalls' % self.stalls)
+        return "<%s at %#x>" % (", ".join(status), id(self))
+
+    def stop(self):
+        "Stop watching the loop."
+        self._stopping.set()
+        self._thread.join()
+
+    def _watch(self):
+        last_seen = None
+        changed_at = monotonic()
+        reported = False
+        while not self._stopping.isSet():
+            self._stopping.wait(self.threshold / 4.0)
+            now = monotonic()
+            iterations = self.loop.iterations
+            if not self.loop.running or iterations != last_seen:
+                last_seen = iterations
+                changed_at = now
+                reported = False
+            elif not reported and now - changed_at >= self.threshold:
+                reported = True
+                frame = sys._current_frames().get(self.loop.thread_id)
+                if frame is None:
+                    continue
+                self.stalls += 1
+                stack = "".join(traceback.format_stack(frame))
+                self.callback(stack, now - changed_at)
+
+    def _write(self, stack, blocked):
+        sys.stderr.write(
+            "WARNING: loop blocked for %.2fs in:\n%s" % (blocked, stack)
+        )
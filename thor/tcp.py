@@ -35,11 +35,59 @@ THE SOFTWARE.
 """
 
 import errno
+import mmap
 import os
+import select
 import sys
 import socket
 
-from thor.loop import EventSource, schedule
+try:
+    from sendfile import sendfile # pysendfile, for Python 2
+except ImportError:
+    sendfile = getattr(os, 'sendfile', None)
+
+from thor import metrics
+from thor.loop import EventSource
+
+
+def map_file(fileobj, offset, length):
+    """
+    Return a buffer over length bytes of fileobj, starting at offset,
+    without reading them into memory.
+    """
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    file_map = mmap.mmap(fileobj.fileno(), offset + length - start,
+        access=mmap.ACCESS_READ, offset=start
+    )
+    return buffer(file_map, offset - start, length)
+
+
+class _FileRange(object):
+    "Part of a file waiting to be written to a connection with sendfile."
+
+    def __init__(self, fileobj, offset, length):
+        self.fd = os.dup(fileobj.fileno()) # so the caller can close it
+        self.offset = offset
+        self.remaining = length
+
+    def __len__(self):
+        return self.remaining
+
+    def send(self, sock):
+        "Send as much as possible to sock, returning how much was sent."
+        try:
+            sent = sendfile(sock.fileno(), self.fd, self.offset,
+                            self.remaining)
+        except OSError, why:
+            raise socket.error(why.errno, why.strerror)
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
 
 class TcpConnection(EventSource):
@@ -100,8 +148,26 @@ class TcpConnection(EventSource):
 
     NOTE that connections are paused to start with; if you want to start
     getting data from them, you'll need to pause(False).
+
+    Instead of listening for events, a protocol object can be attached to
+    the connection, which then calls its methods directly:
+
+    > tcp_conn.protocol = my_protocol
+
+    It needs to have these methods:
+
+     - data_received (chunk): incoming data, instead of the 'data' event
+     - connection_lost (): called when the other side closes the
+       connection. handle_close does this, and it's a 'close' listener
+       itself, so it happens during the 'close' event, after any
+       listeners that were added before it.
+     - pause_writing (bool): called before the 'pause' event is emitted
     """
 
+    __slots__ = ('socket', 'host', 'port', 'tcp_connected', '_input_paused',
+                 '_output_paused', '_closing', '_write_buffer', 'bytes_read',
+                 'bytes_written', 'protocol')
+
     # TODO: play with various buffer sizes
     write_bufsize = 16
     read_bufsize = 1024 * 16
@@ -125,6 +191,9 @@ class TcpConnection(EventSource):
         self._output_paused = False
         self._closing = False
         self._write_buffer = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.protocol = None
 
         self.register_fd(sock.fileno())
         self.on('readable', self.handle_read)
@@ -162,16 +231,42 @@ class TcpConnection(EventSource):
         if data == "":
             self.emit('close')
         else:
-            self.emit('data', data)
+            self.bytes_read += len(data)
+            if metrics.enabled:
+                metrics.tcp_bytes_read.inc(len(data))
+            if self.protocol is not None:
+                self.protocol.data_received(data)
+            else:
+                self.emit('data', data)
 
-    # TODO: try using buffer; see
-    # http://itamarst.org/writings/pycon05/fast.html
     def handle_write(self):
-        "The connection is ready for writing; write any buffered data."
+        """
+        The connection is ready for writing; write any buffered data.
+
+        Strings are joined together before they're sent, but other buffers
+        (e.g., from mmap) are sent on their own, to avoid copying them.
+        """
         if len(self._write_buffer) > 0:
-            data = "".join(self._write_buffer)
+            count = 0
+            for item in self._write_buffer:
+                if not isinstance(item, str):
+                    break
+                count += 1
+            if count:
+                data = "".join(self._write_buffer[:count])
+            else:
+                data = self._write_buffer[0]
+                count = 1
             try:
-                sent = self.socket.send(data)
+                if isinstance(data, _FileRange):
+                    sent = data.send(self.socket)
+                    if sent == 0: # the file is shorter than it should be
+                        data.close()
+                        self._write_buffer = []
+                        self.emit('close')
+                        return
+                else:
+                    sent = self.socket.send(data)
             except Exception, why:
                 err = (type(why), why[0])
                 if err in self._block_errs:
@@ -181,37 +276,105 @@ class TcpConnection(EventSource):
                     return
                 else:
                     raise
-            if sent < len(data):
-                self._write_buffer = [data[sent:]]
-            else:
-                self._write_buffer = []
+            self.bytes_written += sent
+            if metrics.enabled:
+                metrics.tcp_bytes_written.inc(sent)
+            rest = self._write_buffer[count:]
+            if isinstance(data, _FileRange):
+                if data.remaining:
+                    rest.insert(0, data) # send() keeps track of where it is
+                else:
+                    data.close()
+            elif sent < len(data):
+                if isinstance(data, str):
+                    rest.insert(0, data[sent:])
+                else:
+                    rest.insert(0, buffer(data, sent))
+            self._write_buffer = rest
         if self._output_paused and \
           len(self._write_buffer) < self.write_bufsize:
             self._output_paused = False
+            if self.protocol is not None:
+                self.protocol.pause_writing(False)
             self.emit('pause', False)
         if self._closing:
             self.close()
         if len(self._write_buffer) == 0:
             self.event_del('writable')
 
-    def handle_close(self):
+    def handle_close(self, lost=True):
         """
-        The connection has been closed by the other side.
+        The connection has been closed; by the other side, unless lost is
+        False.
         """
         self.tcp_connected = False
+        for item in self._write_buffer:
+            if isinstance(item, _FileRange):
+                item.close()
+        self._write_buffer = []
         # TODO: make sure removing close doesn't cause problems.
         self.removeListeners('readable', 'writable', 'close')
         self.unregister_fd()
         self.socket.close()
+        if lost and self.protocol is not None:
+            self.protocol.connection_lost()
 
     def write(self, data):
-        "Write data to the connection."
+        """
+        Write data to the connection. data can be a string or a buffer
+        (e.g., over a mmap); buffers aren't copied.
+        """
         self._write_buffer.append(data)
         if len(self._write_buffer) > self.write_bufsize:
             self._output_paused = True
+            if self.protocol is not None:
+                self.protocol.pause_writing(True)
             self.emit('pause', True)
         self.event_add('writable')
 
+    def write_file(self, fileobj, offset, length):
+        """
+        Write length bytes of fileobj (a file object, or anything else with
+        a fileno() method), starting at offset, to the connection, without
+        reading them into Python.
+
+        sendfile() is used if it's available and this isn't a TLS connection;
+        otherwise, the file is mapped into memory and written from there.
+        fileobj can be closed as soon as this returns.
+        """
+        if length <= 0:
+            return
+        # TLS sockets need to encrypt what's sent, so can't use sendfile.
+        if sendfile is not None and not hasattr(self.socket, 'do_handshake'):
+            self.write(_FileRange(fileobj, offset, length))
+        else:
+            self.write(map_file(fileobj, offset, length))
+
+    def peek_closed(self):
+        """
+        Without blocking or consuming any data, check whether the other
+        side has closed the connection (or sent something), returning True
+        if so.
+
+        Only useful when nothing is expected from the other side; e.g.,
+        before reusing an idle connection.
+        """
+        if not self.tcp_connected:
+            return True
+        try:
+            data = self.socket.recv(1, socket.MSG_PEEK)
+        except ValueError:
+            # SSL sockets don't allow flags; just see if it's readable.
+            poller = select.poll()
+            poller.register(self.socket.fileno(), select.POLLIN)
+            return bool(self.socket.pending() or poller.poll(0))
+        except Exception, why:
+            err = (type(why), why[0])
+            if err in self._block_errs:
+                return False
+            return True
+        return True # either EOF or unexpected data
+
     def pause(self, paused):
         """
         Temporarily stop/start reading from the connection and pushing
@@ -229,7 +392,7 @@ class TcpConnection(EventSource):
         if len(self._write_buffer) > 0:
             self._closing = True
         else:
-            self.handle_close()
+            self.handle_close(False)
 
         # TODO: should loop stop automatically close all conns?
 
@@ -254,7 +417,7 @@ class TcpServer(EventSource):
         self.sock = sock or server_listen(host, port)
         self.on('readable', self.handle_accept)
         self.register_fd(self.sock.fileno(), 'readable')
-        schedule(0, self.emit, 'start')
+        self._loop.schedule(0, self.emit, 'start')
 
     def handle_accept(self):
         try:
@@ -263,6 +426,10 @@ class TcpServer(EventSource):
             # sometimes accept() returns None if we have
             # multiple processes listening
             return
+        except socket.error, why:
+            if why[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                return # someone else got it first
+            raise
         conn.setblocking(False)
         tcp_conn = TcpConnection(conn, self.host, self.port, self._loop)
         self.emit('connect', tcp_conn)
@@ -272,6 +439,7 @@ class TcpServer(EventSource):
     def shutdown(self):
         "Stop accepting requests and close the listening socket."
         self.removeListeners('readable')
+        self.unregister_fd()
         self.sock.close()
         self.emit('stop')
         # TODO: emit close?
@@ -30,11 +30,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+from collections import deque
 import errno
 import socket
 
 from thor.loop import EventSource
 
+try:
+    _memoryview = memoryview
+except NameError: # Python 2.6
+    _memoryview = None
+
 
 
 
@@ -44,13 +50,24 @@ class UdpEndpoint(EventSource):
 
     Emits:
       - datagram (data, address): upon recieving a datagram.
+      - datagrams (batch): upon recieving one or more datagrams, if
+        anything is listening for it; batch is a list of (data, address).
+      - pause (bool): whether the send queue is full.
 
     To start:
 
     > s = UdpEndpoint(host, port)
     > s.on('datagram', datagram_handler)
+
+    If you're listening for 'datagrams', each batch is read into a ring of
+    preallocated buffers, and data is a memoryview onto one of them. It's
+    only valid until the listener returns; copy it (e.g., with
+    data.tobytes()) if you need to keep it. Python 2.6 doesn't have
+    memoryview, so there data is a str.
     """
     recv_buffer = 8192
+    recv_ring = 64 # max datagrams per 'datagrams' batch
+    send_bufsize = 1024 # queued datagrams that make 'pause' be emitted
     _block_errs = set([
         errno.EAGAIN, errno.EWOULDBLOCK
     ])
@@ -62,7 +79,11 @@ class UdpEndpoint(EventSource):
         self.max_dgram = min((2**16 - 40), self.sock.getsockopt(
             socket.SOL_SOCKET, socket.SO_SNDBUF
         ))
+        self._ring = None
+        self._send_queue = deque()
+        self._output_paused = False
         self.on('readable', self.handle_datagram)
+        self.on('writable', self.handle_write)
         self.register_fd(self.sock.fileno())
 
     def bind(self, host, port):
@@ -78,7 +99,8 @@ class UdpEndpoint(EventSource):
 
     def shutdown(self):
         "Close the listening socket."
-        self.removeListeners('readable')
+        self.removeListeners('readable', 'writable')
+        self._send_queue.clear()
         self.sock.close()
         # TODO: emit close?
 
@@ -99,9 +121,47 @@ class UdpEndpoint(EventSource):
             else:
                 raise
 
+    def send_many(self, datagrams, host, port):
+        """
+        Send a sequence of datagrams to host:port.
+
+        Unlike send, datagrams that can't be sent right away are queued
+        and sent when the socket becomes writable again.
+        """
+        addr = (host, port)
+        self._send_queue.extend([(datagram, addr) for datagram in datagrams])
+        self.handle_write()
+
+    def handle_write(self):
+        "The socket is ready for writing; send any queued datagrams."
+        queue = self._send_queue
+        sendto = self.sock.sendto
+        while queue:
+            datagram, addr = queue[0]
+            try:
+                sendto(datagram, addr)
+            except socket.error, why:
+                if why[0] in self._block_errs:
+                    break
+                else:
+                    raise
+            queue.popleft()
+        if queue:
+            self.event_add('writable')
+            if not self._output_paused and len(queue) >= self.send_bufsize:
+                self._output_paused = True
+                self.emit('pause', True)
+        else:
+            self.event_del('writable')
+        if self._output_paused and len(queue) < self.send_bufsize:
+            self._output_paused = False
+            self.emit('pause', False)
+
     def handle_datagram(self):
-        "Handle an incoming datagram, emitting the 'datagram' event."
-        # TODO: consider pre-allocating buffers.
+        "Handle incoming datagrams, emitting 'datagrams' or 'datagram'."
+        if self.listeners('datagrams'):
+            self._handle_batch()
+            return
         # TODO: is it best to loop here?
         while True:
             try:
@@ -112,3 +172,49 @@ class UdpEndpoint(EventSource):
                 else:
                     raise
             self.emit('datagram', data, addr[0], addr[1])
+
+    def _handle_batch(self):
+        """
+        Read datagrams into the ring and emit them up to recv_ring at a
+        time, until there are no more.
+        """
+        if _memoryview is None:
+            self._handle_batch_copy()
+            return
+        views = self._ring
+        if views is None or len(views) != self.recv_ring:
+            views = self._ring = [
+                _memoryview(bytearray(self.recv_buffer))
+                for i in xrange(self.recv_ring)
+            ]
+        recvfrom_into = self.sock.recvfrom_into
+        while True:
+            batch = []
+            append = batch.append
+            try:
+                for view in views:
+                    nbytes, addr = recvfrom_into(view)
+                    append((view[:nbytes], addr))
+            except socket.error, why:
+                if why[0] not in self._block_errs:
+                    raise
+                if batch:
+                    self.emit('datagrams', batch)
+                return
+            self.emit('datagrams', batch)
+
+    def _handle_batch_copy(self):
+        "_handle_batch for Pythons without memoryview; data is a str."
+        recvfrom = self.sock.recvfrom
+        batch = []
+        for i in xrange(self.recv_ring):
+            try:
+                data, addr = recvfrom(self.recv_buffer)
+            except socket.error, why:
+                if why[0] in self._block_errs:
+                    break
+                else:
+                    raise
+            batch.append((data, addr))
+        if batch:
+            self.emit('datagrams', batch)